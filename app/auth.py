@@ -1,8 +1,104 @@
 import os
+import json
+import time
+import base64
+import logging
+import threading
+from datetime import datetime, timezone
 import streamlit as st
-from supabase import create_client, Client
+from app.cache import LRUCache
+from app.config import load_env
+from app.journal import MessageJournal, TokenRejected, EntriesRejected, BackendUnavailable, SessionDeleted, is_journal_enabled
+from app.metrics import timed, annotate, instrumented_transport
 
-def init_supabase(access_token: str = None) -> Client:
+logger = logging.getLogger(__name__)
+
+# Configuration below is read at import time
+load_env()
+
+# The supabase SDK (with httpx, postgrest and gotrue) takes a few hundred milliseconds
+# to import, so it is imported on first use rather than when the app starts.
+
+class ScopedClient:
+    """
+    A lightweight, per-request view over a pooled Supabase client.
+    Carries the caller's access token in its own headers, so concurrent users
+    never share auth state, while all requests reuse the pooled connections.
+    """
+
+    def __init__(self, client, access_token: str = None):
+        self._client = client
+        self._headers = dict(client.options.headers)
+        if access_token:
+            self._headers["Authorization"] = f"Bearer {access_token}"
+        self._postgrest = None
+
+    @property
+    def postgrest(self):
+        if self._postgrest is None:
+            from postgrest import SyncPostgrestClient
+            self._postgrest = SyncPostgrestClient(
+                str(self._client.rest_url),
+                headers=self._headers,
+                schema=self._client.options.schema,
+                http_client=self._client.options.httpx_client,
+            )
+        return self._postgrest
+
+    @property
+    def auth(self):
+        from supabase import SupabaseAuthClient
+        # A fresh GoTrue client per call keeps sign-in state out of the shared pool.
+        return SupabaseAuthClient(
+            url=str(self._client.auth_url),
+            headers=self._headers,
+            auto_refresh_token=False,
+            persist_session=False,
+            http_client=self._client.options.httpx_client,
+        )
+
+    def table(self, table_name: str):
+        return self.postgrest.from_(table_name)
+
+    def rpc(self, fn: str, params: dict = None):
+        return self.postgrest.rpc(fn, params or {})
+
+def _supabase_service(request) -> str:
+    path = request.url.path
+    return "gotrue" if path.startswith("/auth/") else "postgrest" if path.startswith("/rest/") else "supabase"
+
+@st.cache_resource(show_spinner=False)
+def _get_pooled_client(url: str, key: str):
+    """
+    Builds one Supabase client per (URL, anon key) for the whole process.
+    The underlying httpx.Client is thread-safe and keeps connections alive,
+    so Streamlit's script threads share TLS sessions instead of re-handshaking.
+    """
+    import httpx
+    from supabase import create_client, ClientOptions
+
+    transport = httpx.HTTPTransport(
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("SUPABASE_POOL_MAX_CONNECTIONS", "20")),
+            max_keepalive_connections=int(os.getenv("SUPABASE_POOL_MAX_KEEPALIVE", "10")),
+            keepalive_expiry=float(os.getenv("SUPABASE_POOL_KEEPALIVE_EXPIRY", "60")),
+        ),
+        http2=True,
+    )
+    http_client = httpx.Client(
+        # Every GoTrue/PostgREST call is timed and counted; see app/metrics.py
+        transport=instrumented_transport(transport, _supabase_service),
+        timeout=float(os.getenv("SUPABASE_TIMEOUT", "30")),
+        follow_redirects=True,
+    )
+    options = ClientOptions(
+        httpx_client=http_client,
+        auto_refresh_token=False,
+        persist_session=False,
+    )
+    return create_client(url, key, options=options)
+
+def init_supabase(access_token: str = None) -> ScopedClient:
     url = os.environ.get("SUPABASE_URL")
     key = os.environ.get("SUPABASE_KEY")
     
@@ -10,17 +106,77 @@ def init_supabase(access_token: str = None) -> Client:
         st.error("Supabase URL and Key are missing. Please add them to your .env file.")
         st.stop()
         
-    client = create_client(url, key)
-    
-    if access_token:
-        client.postgrest.auth(access_token)
-        
-    return client
+    return ScopedClient(_get_pooled_client(url, key), access_token)
+
+# Refresh the access token only when it is this close to expiring (seconds).
+SESSION_REFRESH_MARGIN = int(os.getenv("SESSION_REFRESH_MARGIN_SECONDS", "300"))
+
+# How long a finished refresh is remembered for reruns still holding the old refresh token.
+_REFRESH_RESULT_TTL = 60
+
+_refresh_lock = threading.Lock()
+_refresh_flights = {}
+
+class _RefreshFlight:
+    """A single in-flight (or recently finished) refresh for one refresh token."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+        self.finished_at = None
+
+def _token_expiry(access_token):
+    """
+    Reads the `exp` claim from a JWT without verifying it.
+    The token is only used to decide whether to refresh; GoTrue and
+    PostgREST still validate it on every request.
+    """
+    try:
+        payload = access_token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except Exception:
+        return None
+
+@timed("auth.refresh_session", "gotrue")
+def _refresh_single_flight(refresh_token):
+    """
+    Refreshes a session, coalescing concurrent callers holding the same refresh token.
+    Refresh tokens are single-use, so reruns that race on the same token must share
+    one GoTrue call (and its result) instead of each trying and all but one failing.
+    """
+    now = time.monotonic()
+    with _refresh_lock:
+        for token, flight in list(_refresh_flights.items()):
+            if flight.finished_at is not None and now - flight.finished_at > _REFRESH_RESULT_TTL:
+                del _refresh_flights[token]
+        flight = _refresh_flights.get(refresh_token)
+        is_leader = flight is None
+        if is_leader:
+            flight = _RefreshFlight()
+            _refresh_flights[refresh_token] = flight
+
+    if is_leader:
+        try:
+            flight.response = init_supabase().auth.refresh_session(refresh_token)
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.finished_at = time.monotonic()
+            flight.done.set()
+    else:
+        flight.done.wait()
+
+    if flight.error:
+        raise flight.error
+    return flight.response
 
 def restore_session():
     """
     Restores the authentication state from st.session_state["session"].
-    Refreshes the session if needed to keep it alive.
+    Refreshes the session only when the access token is within
+    SESSION_REFRESH_MARGIN seconds of expiring, so most reruns make no network call.
     Returns True if a valid session exists, False otherwise.
     
     Note: This function uses supabase.auth.refresh_session() which is available
@@ -31,15 +187,23 @@ def restore_session():
         return False
     
     try:
-        supabase = init_supabase()
         session_data = st.session_state["session"]
+        access_token = session_data.get("access_token")
+        
+        # Skip the round-trip to GoTrue while the current token is still fresh
+        expires_at = _token_expiry(access_token) if access_token else None
+        if expires_at and expires_at - time.time() > SESSION_REFRESH_MARGIN and session_data.get("user"):
+            st.session_state.authenticated = True
+            st.session_state.user = session_data["user"]
+            st.session_state.access_token = access_token
+            return True
         
-        # Try to refresh the session to ensure it's still valid
+        # Token is close to expiry (or unreadable): refresh it
         refresh_token = session_data.get("refresh_token")
         if refresh_token:
             try:
                 # Use refresh_session to extend session lifetime (requires supabase-py >= 2.0)
-                response = supabase.auth.refresh_session(refresh_token)
+                response = _refresh_single_flight(refresh_token)
                 if response and response.session:
                     # Update session with refreshed tokens
                     st.session_state["session"] = {
@@ -60,10 +224,10 @@ def restore_session():
                 return False
         
         # If no refresh token, validate the access token is present
-        if session_data.get("access_token") and session_data.get("user"):
+        if access_token and session_data.get("user"):
             st.session_state.authenticated = True
             st.session_state.user = session_data["user"]
-            st.session_state.access_token = session_data["access_token"]
+            st.session_state.access_token = access_token
             return True
         
     except Exception as e:
@@ -92,6 +256,12 @@ def require_authentication():
         st.info("Please return to the main page to log in.")
         st.stop()
 
+    # Journaled messages are sent with their owner's latest token
+    journal = _get_journal()
+    if journal is not None:
+        journal.remember_token(st.session_state.user.id, st.session_state.access_token)
+
+@timed("auth.sign_in", "gotrue")
 def sign_in(email, password):
     supabase = init_supabase()
     try:
@@ -107,10 +277,17 @@ def sign_in(email, password):
             st.session_state.authenticated = True
             st.session_state.user = response.user
             st.session_state.access_token = response.session.access_token
+            # Warm the profile cache so the first authenticated rerun does not wait for it;
+            # if that fails, the page load fetches it again and reports the error
+            try:
+                get_profile(response.user.id)
+            except Exception:
+                pass
         return response
     except Exception as e:
         return {"error": str(e)}
 
+@timed("auth.sign_up", "gotrue")
 def sign_up(email, password):
     supabase = init_supabase()
     try:
@@ -130,6 +307,7 @@ def sign_up(email, password):
     except Exception as e:
         return {"error": str(e)}
 
+@timed("auth.sign_out", "gotrue")
 def sign_out():
     supabase = init_supabase()
     try:
@@ -143,18 +321,90 @@ def sign_out():
         st.session_state.user = None
         st.session_state.access_token = None
 
-def get_user_sessions():
+def _keyset_cursor(row):
+    return row["created_at"], row["id"]
+
+def _keyset_filter(op, cursor):
+    """
+    PostgREST `or` filter for rows strictly before/after a (created_at, id) cursor.
+    Values are quoted because timestamps contain ':' and '+'.
+    """
+    created_at, row_id = cursor
+    return f'created_at.{op}."{created_at}",and(created_at.eq."{created_at}",id.{op}.{row_id})'
+
+# Only the columns the sidebar renders
+SESSION_COLUMNS = "id, title, created_at"
+
+@timed("auth.get_user_sessions", "postgrest")
+def get_user_sessions(limit=None, before=None):
+    """
+    Returns the user's sessions, newest first.
+    `before` is an exclusive (created_at, id) keyset cursor, or a session to take it from.
+    """
     token = st.session_state.get("access_token")
     if not token:
         return []
     supabase = init_supabase(token)
     try:
-        response = supabase.table("chat_sessions").select("*").eq("user_id", st.session_state.user.id).order("created_at", desc=True).execute()
+        query = (supabase.table("chat_sessions").select(SESSION_COLUMNS)
+                 .eq("user_id", st.session_state.user.id).is_("deleted_at", "null"))
+        if before:
+            query = query.or_(_keyset_filter("lt", _keyset_cursor(before) if isinstance(before, dict) else before))
+        query = query.order("created_at", desc=True).order("id", desc=True)
+        if limit:
+            query = query.limit(limit)
+        response = query.execute()
         return response.data
     except Exception as e:
         st.error(f"Error fetching sessions: {e}")
         return []
 
+# Per-user cache of the sidebar session list: {"sessions": [...], "has_more": bool}.
+# Kept current by create_session, update_session_title and delete_session; the TTL
+# only bounds staleness from changes made in other processes.
+_session_list_cache = LRUCache(
+    max_entries=int(os.getenv("SESSION_LIST_CACHE_MAX_USERS", "1024")),
+    ttl=float(os.getenv("SESSION_LIST_CACHE_TTL", "300")),
+)
+
+def list_user_sessions(page_size):
+    """
+    Returns (sessions, has_more) for the sidebar, loading the first page on a cache miss.
+    """
+    user = st.session_state.get("user")
+    if not user:
+        return [], False
+    entry = _session_list_cache.get(user.id)
+    if entry is None:
+        sessions = get_user_sessions(limit=page_size + 1)
+        entry = {"sessions": sessions[:page_size], "has_more": len(sessions) > page_size}
+        _session_list_cache.set(user.id, entry)
+    return entry["sessions"], entry["has_more"]
+
+@timed("auth.load_more_user_sessions", "postgrest")
+def load_more_user_sessions(page_size):
+    """
+    Appends the next page of sessions to the user's cached session list.
+    """
+    user = st.session_state.get("user")
+    entry = _session_list_cache.get(user.id) if user else None
+    if not entry or not entry["sessions"]:
+        return
+    sessions = get_user_sessions(limit=page_size + 1, before=entry["sessions"][-1])
+    _session_list_cache.set(user.id, {
+        "sessions": entry["sessions"] + sessions[:page_size],
+        "has_more": len(sessions) > page_size,
+    })
+
+def _update_cached_sessions(user_id, update):
+    """
+    Write-through for the session list: replaces the user's cached list with update(list).
+    """
+    entry = _session_list_cache.get(user_id)
+    if entry is not None:
+        _session_list_cache.set(user_id, {"sessions": update(entry["sessions"]), "has_more": entry["has_more"]})
+
+@timed("auth.create_session", "postgrest")
 def create_session(title="New Chat"):
     token = st.session_state.get("access_token")
     if not token:
@@ -162,49 +412,451 @@ def create_session(title="New Chat"):
     supabase = init_supabase(token)
     try:
         response = supabase.table("chat_sessions").insert({"user_id": st.session_state.user.id, "title": title}).execute()
-        return response.data[0] if response.data else None
+        if not response.data:
+            return None
+        session = response.data[0]
+        cached = {column: session.get(column) for column in ("id", "title", "created_at")}
+        _update_cached_sessions(st.session_state.user.id, lambda sessions: [cached] + sessions)
+        return session
     except Exception as e:
         st.error(f"Error creating session: {e}")
         return None
 
-def get_session_messages(session_id):
+# Only the columns the chat view renders
+MESSAGE_COLUMNS = "id, role, content, created_at"
+
+# PostgREST/PostgreSQL error codes that say nothing about the request itself:
+# connection and pool trouble, serialization failures, resource limits, shutdowns
+_TRANSIENT_ERROR_PREFIXES = ("PGRST00", "08", "40", "53", "57")
+
+def _send_journaled_messages(access_token, messages):
+    """
+    Idempotent batch insert (migrations/004_append_messages.sql). Raises what the journal
+    needs to tell an expired token, a refused batch and an unreachable backend apart.
+    """
+    import httpx
+    from postgrest.exceptions import APIError
+
+    try:
+        init_supabase(access_token).rpc("append_messages", {"p_messages": messages}).execute()
+    except APIError as e:
+        # Non-JSON error responses carry the HTTP status as the code
+        code = str(e.code or "")
+        if code.startswith("PGRST30") or code == "401":
+            raise TokenRejected(e.message or code) from e
+        if code == "P0002" and e.details:
+            # migrations/006: the batch writes to a deleted session, named in the details
+            raise SessionDeleted(e.details, e.message or "") from e
+        if code.startswith(_TRANSIENT_ERROR_PREFIXES) or code == "429" or (code.isdigit() and code.startswith("5")):
+            raise
+        raise EntriesRejected(e.message or code) from e
+    except httpx.TransportError as e:
+        raise BackendUnavailable(str(e) or type(e).__name__) from e
+
+@st.cache_resource(show_spinner=False)
+def _get_journal():
+    """
+    The process-wide write-behind message journal, or None when MESSAGE_JOURNAL_ENABLED is off.
+    """
+    if not is_journal_enabled():
+        return None
+    return MessageJournal(
+        os.getenv("MESSAGE_JOURNAL_PATH", ".journal/messages.sqlite3"),
+        _send_journaled_messages,
+        batch_size=int(os.getenv("MESSAGE_JOURNAL_BATCH_SIZE", "50")),
+        max_attempts=int(os.getenv("MESSAGE_JOURNAL_MAX_ATTEMPTS", "50")),
+        retry_max=float(os.getenv("MESSAGE_JOURNAL_RETRY_MAX_DELAY", "60")),
+        on_session_deleted=_forget_session,
+    )
+
+def unsaved_messages() -> list:
+    """
+    The current user's journaled messages that could not be saved and were set aside:
+    [{"seq", "session_id", "messages", "error"}, ...], oldest first.
+    """
+    journal = _get_journal()
+    user = st.session_state.get("user")
+    return journal.set_aside(user.id) if journal is not None and user else []
+
+def retry_unsaved_messages():
+    journal = _get_journal()
+    user = st.session_state.get("user")
+    if journal is not None and user:
+        journal.retry_set_aside(user.id)
+
+def discard_unsaved_messages():
+    journal = _get_journal()
+    user = st.session_state.get("user")
+    if journal is not None and user:
+        journal.drop_set_aside(user.id)
+
+def _merge_pending(session_id, rows, limit=None, before=None, after=None):
+    """
+    Adds the session's journaled but unsent messages to fetched rows, within the same
+    keyset bounds and limit. Rows already stored in the database are not repeated.
+    """
+    journal = _get_journal()
+    user = st.session_state.get("user")
+    pending = journal.pending(user.id, session_id) if journal is not None and user else []
+    if before:
+        cursor = _keyset_cursor(before) if isinstance(before, dict) else tuple(before)
+        pending = [message for message in pending if _keyset_cursor(message) < cursor]
+    if after:
+        cursor = _keyset_cursor(after) if isinstance(after, dict) else tuple(after)
+        pending = [message for message in pending if _keyset_cursor(message) > cursor]
+    if not pending:
+        return rows
+    stored_ids = {row["id"] for row in rows}
+    merged = sorted(rows + [message for message in pending if message["id"] not in stored_ids], key=_keyset_cursor)
+    return merged[-limit:] if limit else merged
+
+@timed("auth.get_session_messages", "postgrest")
+def get_session_messages(session_id, limit=None, before=None, after=None):
+    """
+    Returns messages of a session in chronological order.
+    `before`/`after` are exclusive (created_at, id) keyset cursors, or messages to take
+    the cursor from. With `limit`, only the newest `limit` matching rows are returned.
+    """
     token = st.session_state.get("access_token")
     if not token:
         return []
     supabase = init_supabase(token)
     try:
-        response = supabase.table("chat_messages").select("*").eq("session_id", session_id).order("created_at", desc=False).execute()
-        return response.data
+        query = supabase.table("chat_messages").select(MESSAGE_COLUMNS).eq("session_id", session_id)
+        if before:
+            query = query.or_(_keyset_filter("lt", _keyset_cursor(before) if isinstance(before, dict) else before))
+        if after:
+            query = query.or_(_keyset_filter("gt", _keyset_cursor(after) if isinstance(after, dict) else after))
+        if limit:
+            # Walk the (created_at, id) index backwards from the newest row, then restore order
+            response = query.order("created_at", desc=True).order("id", desc=True).limit(limit).execute()
+            return _merge_pending(session_id, list(reversed(response.data)), limit, before, after)
+        response = query.order("created_at", desc=False).order("id", desc=False).execute()
+        return _merge_pending(session_id, response.data, None, before, after)
     except Exception as e:
         st.error(f"Error fetching messages: {e}")
         return []
 
+def get_message_page(session_id, page_size, before=None):
+    """
+    Returns (messages, has_more): the newest `page_size` messages before `before`
+    in chronological order, and whether older messages exist beyond them.
+    """
+    messages = get_session_messages(session_id, limit=page_size + 1, before=before)
+    if len(messages) > page_size:
+        return messages[1:], True
+    return messages, False
+
+# Per-(user, session) message cache shared by all reruns in this process.
+# Each entry holds the loaded window of messages in chronological order; its last
+# message is the (created_at, id) cursor, so reruns only fetch rows after it.
+_message_cache = LRUCache(
+    max_entries=int(os.getenv("MESSAGE_CACHE_MAX_SESSIONS", "512")),
+    max_bytes=int(os.getenv("MESSAGE_CACHE_MAX_MB", "64")) * 1024 * 1024,
+)
+
+# Sessions known to be deleted (here, from another tab or device over Realtime, or
+# found out when a write was refused), so views still showing one can leave it
+_deleted_sessions = LRUCache(max_entries=int(os.getenv("DELETED_SESSIONS_CACHE_MAX", "10000")))
+
+def is_session_deleted(session_id) -> bool:
+    return _deleted_sessions.get(session_id) is not None
+
+def _forget_session(user_id, session_id):
+    """Drops every trace of a deleted session from this process."""
+    _deleted_sessions.set(session_id, True)
+    journal = _get_journal()
+    if journal is not None:
+        journal.discard_session(user_id, session_id)
+    _message_cache.pop((user_id, session_id))
+    _update_cached_sessions(user_id, lambda sessions: [session for session in sessions if session["id"] != session_id])
+
+def _refused_as_deleted(error) -> bool:
+    """
+    Whether a write to a session failed because the session was deleted: migrations/006
+    refuses those messages with no_data_found (P0002).
+    """
+    from postgrest.exceptions import APIError
+    return isinstance(error, APIError) and str(error.code) == "P0002"
+
+def _message_cache_key(session_id):
+    user = st.session_state.get("user")
+    return (user.id if user else None, session_id)
+
+@timed("auth.sync_session_messages", "postgrest")
+def sync_session_messages(session_id, page_size):
+    """
+    Returns (messages, has_more) for a session from the message cache.
+    The first call loads the newest page; later calls fetch only rows newer
+    than the cached cursor and append them.
+    """
+    if is_session_deleted(session_id):
+        return [], False
+    key = _message_cache_key(session_id)
+    entry = _message_cache.get(key)
+    annotate(cache="hit" if entry is not None else "miss")
+    live_since = _live_since.get(key[0])
+    if entry is not None and live_since is not None and entry.get("synced_at", 0) >= live_since:
+        # Synced while the user's Realtime channel was up, which has pushed every change since
+        return entry["messages"], entry["has_more"]
+    synced_at = time.monotonic()
+    if entry is None:
+        messages, has_more = get_message_page(session_id, page_size)
+        entry = {"messages": messages, "has_more": has_more}
+    elif entry["messages"]:
+        newer = get_session_messages(session_id, after=entry["messages"][-1])
+        known_ids = {message["id"] for message in entry["messages"][-len(newer):]} if newer else set()
+        newer = [message for message in newer if message["id"] not in known_ids]
+        if newer:
+            entry = {"messages": entry["messages"] + newer, "has_more": entry["has_more"]}
+    else:
+        messages = get_session_messages(session_id, limit=page_size)
+        if messages:
+            entry = {"messages": messages, "has_more": entry["has_more"]}
+    _message_cache.set(key, {**entry, "synced_at": synced_at})
+    return entry["messages"], entry["has_more"]
+
+@timed("auth.load_older_session_messages", "postgrest")
+def load_older_session_messages(session_id, page_size):
+    """
+    Prepends the page before the oldest cached message to the session's cache entry.
+    """
+    key = _message_cache_key(session_id)
+    entry = _message_cache.get(key)
+    if not entry or not entry["messages"]:
+        return
+    page, has_more = get_message_page(session_id, page_size, before=entry["messages"][0])
+    _message_cache.set(key, {"messages": page + entry["messages"], "has_more": has_more})
+
+def _append_cached_message(session_id, message):
+    """
+    Write-through for save_message: appends a stored row to the session's cache entry,
+    which also advances its cursor past our own write.
+    """
+    key = _message_cache_key(session_id)
+    entry = _message_cache.get(key)
+    if entry is None:
+        return
+    if entry["messages"] and _keyset_cursor(message) <= _keyset_cursor(entry["messages"][-1]):
+        # Out of order with what we have; let the next sync sort it out
+        _message_cache.pop(key)
+        return
+    _message_cache.set(key, {**entry, "messages": entry["messages"] + [message]})
+
+@timed("auth.save_message", "postgrest")
 def save_message(session_id, role, content):
+    """
+    Stores one message. Returns the stored message, or None on failure, also when
+    the session turns out to be deleted (see is_session_deleted()).
+    """
     token = st.session_state.get("access_token")
-    if not token:
-        return
+    if not token or is_session_deleted(session_id):
+        return None
+    journal = _get_journal()
+    if journal is not None:
+        for message in journal.append(st.session_state.user.id, token, session_id, [(role, content)]):
+            _append_cached_message(session_id, message)
+            return message
     supabase = init_supabase(token)
     try:
-        supabase.table("chat_messages").insert({
+        response = supabase.table("chat_messages").insert({
             "session_id": session_id,
             "role": role,
             "content": content
         }).execute()
+        if response.data:
+            row = response.data[0]
+            message = {column: row[column] for column in ("id", "role", "content", "created_at")}
+            _append_cached_message(session_id, message)
+            return message
     except Exception as e:
+        if _refused_as_deleted(e):
+            _forget_session(st.session_state.user.id, session_id)
+            return None
         st.error(f"Error saving message: {e}")
+    return None
 
-def get_profile(user_id):
+@timed("auth.append_exchange", "postgrest")
+def append_exchange(session_id, user_content, assistant_content, title=None):
+    """
+    Stores one chat turn atomically through the append_exchange RPC
+    (migrations/002_append_exchange.sql): both messages, the session's activity
+    timestamp and, if given, its new title, in one transaction and one HTTP call.
+    With `user_content` None only the reply is stored, for a prompt that was saved
+    with save_message() before the agent was called.
+    Returns the inserted messages, or None on failure, also when the session turns
+    out to be deleted (see is_session_deleted()).
+    With the message journal enabled, the turn is journaled locally instead and
+    written behind; see app/journal.py.
+    """
     token = st.session_state.get("access_token")
-    if not token:
+    if not token or is_session_deleted(session_id):
+        return None
+    try:
+        journal = _get_journal()
+        if journal is not None:
+            annotate(journaled=True)
+            turn = [("user", user_content)] if user_content is not None else []
+            rows = journal.append(st.session_state.user.id, token, session_id,
+                                  turn + [("assistant", assistant_content)], title)
+        else:
+            rows = init_supabase(token).rpc("append_exchange", {
+                "p_session_id": session_id,
+                "p_user_content": user_content,
+                "p_assistant_content": assistant_content,
+                "p_title": title,
+            }).execute().data
+        for message in rows or []:
+            _append_cached_message(session_id, message)
+        if title:
+            _update_cached_sessions(st.session_state.user.id, lambda sessions: [
+                {**session, "title": title} if session["id"] == session_id else session
+                for session in sessions
+            ])
+        return rows
+    except Exception as e:
+        if _refused_as_deleted(e):
+            _forget_session(st.session_state.user.id, session_id)
+            return None
+        st.error(f"Error saving messages: {e}")
         return None
+
+# Recent search pages per (user, query, offset). Short-lived: new messages should
+# show up in results soon, but paging and fragment reruns must not repeat the query.
+_search_cache = LRUCache(
+    max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "1024")),
+    ttl=float(os.getenv("SEARCH_CACHE_TTL", "30")),
+)
+
+@timed("auth.search_messages", "postgrest")
+def search_messages(query, page_size, offset=0):
+    """
+    Full-text search over the user's messages through the search_messages RPC
+    (migrations/003_message_search.sql). Returns (results, has_more): ranked rows
+    with message_id, session_id, session_title, role, snippet and created_at.
+    """
+    token = st.session_state.get("access_token")
+    user = st.session_state.get("user")
+    query = " ".join(query.split())
+    if not token or not user or not query:
+        return [], False
+    key = (user.id, query.casefold(), page_size, offset)
+    cached = _search_cache.get(key)
+    annotate(cache="hit" if cached is not None else "miss")
+    if cached is not None:
+        return cached
     supabase = init_supabase(token)
     try:
-        response = supabase.table("profiles").select("*").eq("id", user_id).single().execute()
-        return response.data
+        response = supabase.rpc("search_messages", {
+            "p_query": query,
+            "p_limit": page_size + 1,
+            "p_offset": offset,
+        }).execute()
+        rows = response.data or []
+        result = (rows[:page_size], len(rows) > page_size)
+        _search_cache.set(key, result)
+        return result
     except Exception as e:
-        # Profile might not exist yet
+        st.error(f"Error searching messages: {e}")
+        return [], False
+
+@timed("auth.load_session_messages_through", "postgrest")
+def load_session_messages_through(session_id, message, page_size):
+    """
+    Makes sure `message` (a search result with message_id and created_at) is in the
+    session's message cache, loading everything between it and the oldest cached
+    message in one query. Returns False if it could not be loaded.
+    """
+    key = _message_cache_key(session_id)
+    entry = _message_cache.get(key)
+    if entry is None:
+        sync_session_messages(session_id, page_size)
+        entry = _message_cache.get(key)
+    if entry is None:
+        return False
+    if any(cached["id"] == message["message_id"] for cached in entry["messages"]):
+        return True
+    # Exclusive cursor just before the target: same timestamp, lowest possible id
+    start = (message["created_at"], "00000000-0000-0000-0000-000000000000")
+    older = get_session_messages(session_id, after=start, before=entry["messages"][0] if entry["messages"] else None)
+    if not any(row["id"] == message["message_id"] for row in older):
+        return False
+    # has_more stays as it was: there may be older messages still
+    _message_cache.set(key, {"messages": older + entry["messages"], "has_more": entry["has_more"]})
+    return True
+
+# Rows per request when exporting; each page is released before the next is fetched
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "500"))
+
+# The export runs on Streamlit's download thread, which has no session_state, so
+# these take the caller's token and user explicitly.
+
+def iter_user_sessions(access_token, user_id, page_size=EXPORT_PAGE_SIZE):
+    """
+    Yields all of the user's sessions, newest first, one keyset page at a time.
+    Unlike get_user_sessions, errors are raised: an export must not end early silently.
+    """
+    supabase = init_supabase(access_token)
+    cursor = None
+    while True:
+        query = (supabase.table("chat_sessions").select(SESSION_COLUMNS)
+                 .eq("user_id", user_id).is_("deleted_at", "null"))
+        if cursor:
+            query = query.or_(_keyset_filter("lt", cursor))
+        rows = query.order("created_at", desc=True).order("id", desc=True).limit(page_size).execute().data
+        yield from rows
+        if len(rows) < page_size:
+            return
+        cursor = _keyset_cursor(rows[-1])
+
+def iter_session_messages(access_token, session_id, page_size=EXPORT_PAGE_SIZE):
+    """
+    Yields all messages of a session in chronological order, one keyset page at a time,
+    walking the (session_id, created_at, id) index forwards. Errors are raised.
+    """
+    supabase = init_supabase(access_token)
+    cursor = None
+    while True:
+        query = supabase.table("chat_messages").select(MESSAGE_COLUMNS).eq("session_id", session_id)
+        if cursor:
+            query = query.or_(_keyset_filter("gt", cursor))
+        rows = query.order("created_at", desc=False).order("id", desc=False).limit(page_size).execute().data
+        yield from rows
+        if len(rows) < page_size:
+            return
+        cursor = _keyset_cursor(rows[-1])
+
+# Profiles that are known to exist, per user ID. Misses are not cached, so a user
+# still in onboarding is re-checked until their profile is created.
+_profile_cache = LRUCache(
+    max_entries=int(os.getenv("PROFILE_CACHE_MAX_USERS", "4096")),
+    ttl=float(os.getenv("PROFILE_CACHE_TTL", "900")),
+)
+
+@timed("auth.get_profile", "postgrest")
+def get_profile(user_id):
+    cached = _profile_cache.get(user_id)
+    annotate(cache="hit" if cached is not None else "miss")
+    if cached is not None:
+        return cached
+    token = st.session_state.get("access_token")
+    if not token:
         return None
+    from postgrest.exceptions import APIError
+
+    supabase = init_supabase(token)
+    try:
+        response = supabase.table("profiles").select("id, full_name").eq("id", user_id).single().execute()
+    except APIError as e:
+        # No row: the profile does not exist yet. Anything else is an outage, not a new user
+        if e.code == "PGRST116":
+            return None
+        raise
+    if response.data:
+        _profile_cache.set(user_id, response.data)
+    return response.data
 
+@timed("auth.update_profile", "postgrest")
 def update_profile(user_id, full_name):
     token = st.session_state.get("access_token")
     if not token:
@@ -213,36 +865,121 @@ def update_profile(user_id, full_name):
     try:
         # Upsert profile
         response = supabase.table("profiles").upsert({"id": user_id, "full_name": full_name}).execute()
+        if response.data:
+            _profile_cache.set(user_id, {"id": user_id, "full_name": response.data[0].get("full_name")})
         return response.data
     except Exception as e:
         st.error(f"Error updating profile: {e}")
         return None
 
-def update_session_title(session_id, title):
-    token = st.session_state.get("access_token")
+@timed("auth.update_session_title", "postgrest")
+def update_session_title(session_id, title, access_token=None):
+    # Background workers have no session_state, so they pass the token explicitly
+    token = access_token or st.session_state.get("access_token")
     if not token:
         return None
     supabase = init_supabase(token)
     try:
         response = supabase.table("chat_sessions").update({"title": title}).eq("id", session_id).execute()
+        # The returned row names its owner, so this also works from background workers
+        for row in response.data or []:
+            _update_cached_sessions(row["user_id"], lambda sessions: [
+                {**session, "title": title} if session["id"] == session_id else session
+                for session in sessions
+            ])
         return response.data
     except Exception as e:
-        print(f"Error updating session title: {e}")
+        logger.warning("Error updating session title of %s: %s", session_id, e)
         return None
 
-def delete_session(session_id):
+@timed("auth.delete_sessions", "postgrest")
+def delete_sessions(session_ids):
+    """
+    Soft-deletes sessions in one request: they get a deleted_at timestamp and drop out
+    of every query at once, and purge_deleted_sessions() (migrations/006) removes their
+    rows later in the background.
+    """
     token = st.session_state.get("access_token")
-    if not token:
+    session_ids = list(dict.fromkeys(session_ids))
+    if not token or not session_ids:
         return False
     supabase = init_supabase(token)
+    user_id = st.session_state.user.id
+    annotate(sessions=len(session_ids))
     try:
-        # Cascade delete should handle messages if configured, but let's be safe
-        # Assuming ON DELETE CASCADE is set in SQL, deleting session is enough.
-        # If not, we might need to delete messages first. 
-        # Given the schema I saw earlier, I didn't verify CASCADE. 
-        # Let's try deleting the session.
-        supabase.table("chat_sessions").delete().eq("id", session_id).execute()
+        supabase.table("chat_sessions").update({"deleted_at": datetime.now(timezone.utc).isoformat()}) \
+            .eq("user_id", user_id).in_("id", session_ids).is_("deleted_at", "null").execute()
+        for session_id in session_ids:
+            _forget_session(user_id, session_id)
         return True
     except Exception as e:
-        st.error(f"Error deleting session: {e}")
+        st.error(f"Error deleting sessions: {e}")
+        return False
+
+def delete_session(session_id):
+    return delete_sessions([session_id])
+
+# Live updates (app/realtime.py). These run on the realtime threads, without a script
+# context, so the user is passed in.
+
+# When each user's Realtime channel joined (time.monotonic()); from then on it keeps
+# message cache entries that were synced later current
+_live_since = {}
+
+def set_live(user_id, live):
+    if live:
+        _live_since[user_id] = time.monotonic()
+    else:
+        _live_since.pop(user_id, None)
+
+def invalidate_user_sessions(user_id):
+    _session_list_cache.pop(user_id)
+
+# Each of these returns whether the cached view changed.
+
+def apply_session_change(user_id, change_type, record, old_record):
+    """Applies a chat_sessions insert, update or (soft) delete to the user's cached session list."""
+    entry = _session_list_cache.get(user_id)
+    session_id = (record or old_record or {}).get("id")
+    if change_type == "UPDATE" and record.get("deleted_at"):
+        # A soft delete
+        change_type = "DELETE"
+    if change_type == "DELETE":
+        if session_id is None:
+            return False
+        # Changed even when this process made the delete: other tabs showing the
+        # session rerun and leave it
+        _forget_session(user_id, session_id)
+        return True
+    if entry is None or session_id is None:
+        return False
+    sessions = entry["sessions"]
+    known = next((session for session in sessions if session["id"] == session_id), None)
+    row = {column: record.get(column) for column in ("id", "title", "created_at")}
+    if known == row:
+        return False
+    if known is not None:
+        sessions = [row if session["id"] == session_id else session for session in sessions]
+    elif change_type == "INSERT":
+        sessions = [row] + sessions
+    else:
+        # An update to a session beyond the loaded pages
+        return False
+    _session_list_cache.set(user_id, {"sessions": sessions, "has_more": entry["has_more"]})
+    return True
+
+def apply_message_change(user_id, change_type, record):
+    """Applies a chat_messages insert to the session's cached messages."""
+    if change_type != "INSERT":
+        return False
+    key = (user_id, record["session_id"])
+    entry = _message_cache.get(key)
+    if entry is None or any(message["id"] == record["id"] for message in entry["messages"]):
         return False
+    message = {column: record[column] for column in ("id", "role", "content", "created_at")}
+    if entry["messages"] and _keyset_cursor(message) <= _keyset_cursor(entry["messages"][-1]):
+        # Out of order with what we have; the next sync reloads the window
+        _message_cache.pop(key)
+    else:
+        _message_cache.set(key, {**entry, "messages": entry["messages"] + [message]})
+    return True
@@ -0,0 +1,223 @@
+import re
+import sys
+import math
+import zlib
+import time
+import threading
+from collections import OrderedDict
+
+def approx_size(value) -> int:
+    """
+    Rough in-memory size of JSON-like data (dicts, lists, strings) in bytes.
+    Good enough to enforce a memory cap without walking every object graph.
+    """
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(approx_size(v) for v in value)
+    return sys.getsizeof(value)
+
+class LRUCache:
+    """
+    Thread-safe, process-wide LRU cache with an optional TTL and an optional memory cap.
+    Entries are evicted least-recently-used first once either `max_entries` or
+    `max_bytes` (measured with `sizeof`) is exceeded. Values should be treated as
+    immutable: replace them with set() instead of mutating them in place.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = None, ttl: float = None, sizeof=approx_size):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, size, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        size = self._sizeof(value) if self.max_bytes else 0
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, size, expires_at)
+            self._bytes += size
+            while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes and self._bytes > self.max_bytes and len(self._data) > 1)
+            ):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            self._remove(key)
+            return item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+def normalize_prompt(text: str) -> str:
+    """
+    Canonical form of a prompt for cache keys: case-folded, whitespace-collapsed,
+    without trailing punctuation.
+    """
+    return re.sub(r"\s+", " ", text.casefold()).strip().rstrip("?!. ")
+
+def text_embedding(text: str, dimensions: int = 512) -> dict:
+    """
+    A cheap local embedding: hashed character-trigram counts, L2-normalized,
+    stored sparsely as {bucket: weight}. Catches rephrasings that differ in
+    punctuation, word order or a typo, without any model or network call.
+    """
+    padded = f"  {text}  "
+    counts = {}
+    for i in range(len(padded) - 2):
+        bucket = zlib.crc32(padded[i:i + 3].encode("utf-8")) % dimensions
+        counts[bucket] = counts.get(bucket, 0) + 1
+    norm = math.sqrt(sum(c * c for c in counts.values())) or 1.0
+    return {bucket: c / norm for bucket, c in counts.items()}
+
+def cosine_similarity(a: dict, b: dict) -> float:
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(bucket, 0.0) for bucket, weight in a.items())
+
+# Function words that rephrasings add or drop freely. Negations ("not", "no",
+# "never", "without") are deliberately absent: they change the answer.
+_FILLER_WORDS = frozenset("""
+    a about an and any are as at be can could do does for from give how i in is
+    it know me much my of on please should tell the there this to
+    vs versus was what whats what's which would you your
+""".split())
+
+def key_terms(text: str) -> tuple:
+    """
+    The words of a normalized prompt that carry its meaning: everything except
+    common function words, sorted. Numbers, names and negations all count, so
+    "sde 1" and "sde 2" or "worth" and "not worth" have different terms.
+    """
+    words = re.findall(r"\w+(?:'\w+)?", text)
+    return tuple(sorted({w for w in words if w not in _FILLER_WORDS}))
+
+def _is_typo(a: str, b: str) -> bool:
+    """One substitution, insertion, deletion or adjacent swap in a word of five letters or more."""
+    if a == b:
+        return True
+    if min(len(a), len(b)) < 5 or abs(len(a) - len(b)) > 1 or not (a.isalpha() and b.isalpha()):
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) < len(b):
+        return a[i:] == b[i + 1:]
+    swapped = i + 1 < len(a) and a[i] == b[i + 1] and a[i + 1] == b[i] and a[i + 2:] == b[i + 2:]
+    return a[i + 1:] == b[i + 1:] or swapped
+
+def same_terms(a: tuple, b: tuple) -> bool:
+    """
+    True when two key_terms() results name the same things, allowing a typo
+    in longer words. Similar-looking prompts that differ in a number, a place
+    or a negation fail this even though their trigram similarity is high.
+    """
+    if len(a) != len(b):
+        return False
+    unmatched = list(b)
+    for term in a:
+        match = next((other for other in unmatched if _is_typo(term, other)), None)
+        if match is None:
+            return False
+        unmatched.remove(match)
+    return True
+
+class PromptCache(LRUCache):
+    """
+    LRUCache keyed by normalized prompt text. When `similarity` is set, an exact
+    miss falls back to the most similar cached prompt whose embedding similarity
+    reaches that threshold and whose key terms are the same (see same_terms()).
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = None, similarity: float = None):
+        super().__init__(max_entries=max_entries, ttl=ttl)
+        self.similarity = similarity
+        self.similar_hits = 0
+
+    def lookup(self, prompt: str):
+        key = normalize_prompt(prompt)
+        entry = self.get(key)
+        if entry is not None or not self.similarity:
+            return entry["value"] if entry else None
+
+        embedding, terms = text_embedding(key), key_terms(key)
+        best_key, best_score = None, self.similarity
+        with self._lock:
+            candidates = [(k, item[0]["embedding"], item[0]["terms"]) for k, item in self._data.items() if item[0]["embedding"]]
+        for candidate_key, candidate_embedding, candidate_terms in candidates:
+            score = cosine_similarity(embedding, candidate_embedding)
+            if score >= best_score and same_terms(terms, candidate_terms):
+                best_key, best_score = candidate_key, score
+        if best_key is None:
+            return None
+        entry = self.get(best_key)
+        if entry is None:
+            return None
+        with self._lock:
+            # The exact-key lookup above counted a miss; this is a hit (also in `hits`)
+            self.misses -= 1
+            self.similar_hits += 1
+        return entry["value"]
+
+    def store(self, prompt: str, value):
+        key = normalize_prompt(prompt)
+        if self.similarity:
+            self.set(key, {"value": value, "embedding": text_embedding(key), "terms": key_terms(key)})
+        else:
+            self.set(key, {"value": value, "embedding": None, "terms": None})
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["similar_hits"] = self.similar_hits
+        return stats
@@ -0,0 +1,31 @@
+import os
+import logging
+import threading
+
+_env_loaded = False
+_env_lock = threading.Lock()
+
+def load_env():
+    """
+    Loads .env into os.environ once per process; later calls are free.
+    Modules that read configuration at import time call this first.
+    """
+    global _env_loaded
+    if _env_loaded:
+        return
+    with _env_lock:
+        if not _env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _configure_logging()
+            _env_loaded = True
+
+def _configure_logging():
+    # The app's own loggers (app.*) write to stderr at LOG_LEVEL; Streamlit's are left alone
+    logger = logging.getLogger("app")
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+        logger.propagate = False
@@ -0,0 +1,98 @@
+import os
+import time
+import threading
+from dataclasses import dataclass, field
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx
+from app.auth import get_profile, list_user_sessions, sync_session_messages
+from app.metrics import timed
+
+# Caps concurrent page-data fetches across all sessions in this process.
+_fetch_slots = threading.BoundedSemaphore(int(os.getenv("DATA_FETCH_MAX_THREADS", "16")))
+
+@dataclass
+class PageData:
+    """
+    Everything a full page render needs, fetched in one concurrent batch.
+    `errors` maps a part's name to why it fell back to its default.
+    """
+    profile: dict = None
+    sessions: list = field(default_factory=list)
+    has_more_sessions: bool = False
+    messages: list = None
+    has_older_messages: bool = False
+    errors: dict = field(default_factory=dict)
+
+def run_concurrently(calls: dict, timeout: float) -> tuple:
+    """
+    Runs {name: (fn, args, fallback)} on separate threads that share the caller's
+    script context (so session_state and st.error work as on the main thread) and
+    returns ({name: result}, {name: error}). A call that raises or does not finish
+    within `timeout` seconds yields its fallback and an error entry.
+    """
+    results, errors, threads = {}, {}, {}
+
+    def runner(name, fn, args):
+        with _fetch_slots:
+            try:
+                results[name] = fn(*args)
+            except Exception as e:
+                errors[name] = str(e)
+
+    for name, (fn, args, _) in calls.items():
+        thread = threading.Thread(target=runner, args=(name, fn, args), name=f"page-data-{name}", daemon=True)
+        add_script_run_ctx(thread)
+        thread.start()
+        threads[name] = thread
+
+    deadline = time.monotonic() + timeout
+    for name, thread in threads.items():
+        thread.join(max(deadline - time.monotonic(), 0))
+        if thread.is_alive():
+            errors[name] = f"timed out after {timeout:g}s"
+
+    for name, (_, _, fallback) in calls.items():
+        if name in errors or name not in results:
+            results[name] = fallback
+    return results, errors
+
+@timed("data.load_page_data")
+def load_page_data(user_id, session_id=None) -> PageData:
+    """
+    Fetches the profile, the first page of the session list and (when a chat is open)
+    its messages concurrently, so a full rerun waits for the slowest call, not the sum.
+    The session list and messages are also kept for the page script; see take_prefetched().
+    """
+    session_page_size = int(os.getenv("SESSION_PAGE_SIZE", "30"))
+    message_page_size = int(os.getenv("MESSAGE_PAGE_SIZE", "50"))
+    calls = {
+        "profile": (get_profile, (user_id,), None),
+        "sessions": (list_user_sessions, (session_page_size,), ([], False)),
+    }
+    if session_id:
+        calls["messages"] = (sync_session_messages, (session_id, message_page_size), None)
+
+    results, errors = run_concurrently(calls, float(os.getenv("DATA_FETCH_TIMEOUT", "15")))
+
+    page_data = PageData(profile=results["profile"], errors=errors)
+    page_data.sessions, page_data.has_more_sessions = results["sessions"]
+    if results.get("messages") is not None:
+        page_data.messages, page_data.has_older_messages = results["messages"]
+
+    # Only successful parts are handed on; the page refetches anything that failed
+    st.session_state["_prefetched"] = {
+        "session_id": session_id,
+        "sessions": results["sessions"] if "sessions" not in errors else None,
+        "messages": results.get("messages") if "messages" not in errors else None,
+    }
+    return page_data
+
+def take_prefetched(part, session_id=None):
+    """
+    Returns a part ("sessions" or "messages") prefetched by load_page_data earlier in
+    this run, at most once. Fragment reruns find nothing and fetch for themselves.
+    """
+    prefetched = st.session_state.get("_prefetched")
+    if not prefetched or (part == "messages" and prefetched["session_id"] != session_id):
+        return None
+    return prefetched.pop(part, None)
@@ -0,0 +1,55 @@
+import io
+import json
+from app.auth import iter_session_messages, iter_user_sessions
+from app.metrics import span
+
+# format -> (label, MIME type, file extension)
+EXPORT_FORMATS = {
+    "jsonl": ("JSON Lines", "application/x-ndjson", "jsonl"),
+    "markdown": ("Markdown", "text/markdown", "md"),
+}
+
+def _jsonl_chunks(access_token, sessions):
+    for session in sessions:
+        for message in iter_session_messages(access_token, session["id"]):
+            yield json.dumps({
+                "session_id": session["id"],
+                "session_title": session.get("title"),
+                "message_id": message["id"],
+                "role": message["role"],
+                "content": message["content"],
+                "created_at": message["created_at"],
+            }, ensure_ascii=False) + "\n"
+
+def _markdown_chunks(access_token, sessions):
+    for session in sessions:
+        yield f"# {session.get('title') or 'Untitled Chat'}\n\n"
+        if session.get("created_at"):
+            yield f"_Started {session['created_at']}_\n\n"
+        for message in iter_session_messages(access_token, session["id"]):
+            yield f"**{message['role'].capitalize()}** · {message['created_at']}\n\n{message['content']}\n\n"
+        yield "---\n\n"
+
+def export_chunks(fmt: str, access_token: str, user_id, session: dict = None):
+    """
+    Yields the export of one session (or, without `session`, all of the user's
+    sessions) as text chunks. Sessions and messages are read a keyset page at a time,
+    so only the output itself grows with the length of the history.
+    """
+    sessions = [session] if session else iter_user_sessions(access_token, user_id)
+    chunks = _jsonl_chunks if fmt == "jsonl" else _markdown_chunks
+    return chunks(access_token, sessions)
+
+def deferred_export(fmt: str, access_token: str, user_id, session: dict = None):
+    """
+    A no-argument callable for st.download_button(data=...): the export is only built
+    when the user clicks Download, on Streamlit's download thread rather than the
+    script thread, and nothing of it is held between reruns.
+    """
+    def build():
+        with span("export.build", "postgrest", scope="session" if session else "all", format=fmt):
+            output = io.BytesIO()
+            for chunk in export_chunks(fmt, access_token, user_id, session):
+                output.write(chunk.encode("utf-8"))
+            return output
+    return build
@@ -0,0 +1,336 @@
+import os
+import json
+import time
+import uuid
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from app.metrics import count_event, span
+
+logger = logging.getLogger(__name__)
+
+def is_journal_enabled() -> bool:
+    """
+    Whether chat messages are written behind through the local journal
+    (needs migrations/004_append_messages.sql).
+    """
+    return os.getenv("MESSAGE_JOURNAL_ENABLED", "false").lower() in ("1", "true", "yes")
+
+_SCHEMA = """
+create table if not exists entries (
+  seq integer primary key autoincrement,
+  user_id text not null,
+  session_id text not null,
+  messages text not null,
+  attempts integer not null default 0,
+  failed integer not null default 0,
+  last_error text
+);
+create index if not exists entries_user_seq on entries (user_id, failed, seq);
+"""
+
+# What `send` raises to tell the journal why a batch was not stored. Any other
+# exception counts as a failed attempt.
+
+class TokenRejected(Exception):
+    """The access token was refused (expired or revoked); wait for a fresh one."""
+
+class EntriesRejected(Exception):
+    """The backend refused the messages themselves; sending them again will not help."""
+
+class BackendUnavailable(Exception):
+    """The backend could not be reached; says nothing about the messages."""
+
+class SessionDeleted(Exception):
+    """A session the messages belong to was deleted; its entries are dropped."""
+
+    def __init__(self, session_id, message: str = ""):
+        super().__init__(message or f"chat session {session_id} was deleted")
+        self.session_id = session_id
+
+class MessageJournal:
+    """
+    A durable write-behind queue for chat messages, kept in a local SQLite file.
+
+    append() gives each message its final ID and timestamp, stores the batch on disk
+    and returns at once. A background thread sends stored entries to Supabase with
+    `send(access_token, messages)`, oldest first per user and one request per batch of
+    up to `batch_size` entries; nothing newer of a user is sent before an older entry.
+    Sends are idempotent (message IDs are fixed), so a resend stores nothing twice.
+
+    How a failed send is handled depends on what `send` raised:
+      * TokenRejected: the user's entries wait, without counting an attempt, until
+        remember_token() brings a different token. Tokens are only held in memory, so
+        after a restart (or once a user has left) entries also wait for their user.
+      * BackendUnavailable: retried with exponential backoff, without counting an attempt.
+      * SessionDeleted: the session's entries are dropped and `on_session_deleted(user_id,
+        session_id)` is called; the rest are sent again.
+      * EntriesRejected or any other error: a batch of several entries is halved until
+        the failing entry is alone, so one bad entry never holds back or takes down
+        the others. A single entry the backend refused is set aside (failed = 1) at
+        once; other errors are retried with backoff and set it aside after
+        `max_attempts`. Set-aside entries stay in the file and are listed by
+        set_aside() until they are retried or dropped.
+
+    Messages not yet sent are served from memory by pending(), so reads can merge them in.
+    """
+
+    def __init__(self, path: str, send, batch_size: int = 50, max_attempts: int = 50,
+                 retry_base: float = 0.5, retry_max: float = 60.0, on_session_deleted=None):
+        self._send = send
+        self._on_session_deleted = on_session_deleted
+        self._batch_size = batch_size
+        self._max_attempts = max_attempts
+        self._retry_base = retry_base
+        self._retry_max = retry_max
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL with synchronous=NORMAL: an append is a local write, not an fsync,
+        # and is still kept if the process crashes
+        self._db.execute("pragma journal_mode=wal")
+        self._db.execute("pragma synchronous=normal")
+        self._db.executescript(_SCHEMA)
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._tokens = {}          # user_id -> latest access token
+        self._refused_tokens = {}  # user_id -> the token last refused for the user
+        self._retry_at = {}        # user_id -> monotonic time of the next attempt
+        self._outages = {}         # user_id -> sends in a row that could not reach the backend
+        self._batch_limit = {}     # user_id -> entries per batch while narrowing down a failure
+        self._last_created = {}    # session_id -> datetime of the newest journaled message
+        self._pending = {}         # (user_id, session_id) -> {seq: [message, ...]}
+        self._set_aside_counts = dict(self._db.execute(
+            "select user_id, count(*) from entries where failed = 1 group by user_id"
+        ).fetchall())
+
+        for seq, user_id, session_id, messages in self._db.execute(
+            "select seq, user_id, session_id, messages from entries where failed = 0 order by seq"
+        ):
+            self._remember_pending(seq, user_id, session_id, json.loads(messages))
+
+        threading.Thread(target=self._run, name="message-journal", daemon=True).start()
+
+    def _remember_pending(self, seq, user_id, session_id, messages):
+        self._pending.setdefault((user_id, session_id), {})[seq] = [
+            {column: message[column] for column in ("id", "role", "content", "created_at")}
+            for message in messages
+        ]
+        self._last_created[session_id] = max(
+            self._last_created.get(session_id, datetime.min.replace(tzinfo=timezone.utc)),
+            datetime.fromisoformat(messages[-1]["created_at"]),
+        )
+
+    def remember_token(self, user_id, access_token):
+        """Records the user's current access token for sending their entries."""
+        with self._lock:
+            if access_token in (self._tokens.get(user_id), self._refused_tokens.get(user_id)):
+                return
+            self._tokens[user_id] = access_token
+            self._retry_at.pop(user_id, None)
+        self._wake.set()
+
+    def append(self, user_id, access_token, session_id, messages, title=None) -> list:
+        """
+        Journals [(role, content), ...] for a session, with an optional new session title.
+        Returns the messages as stored rows (id, role, content, created_at), timestamped
+        in order after anything already journaled for the session.
+        """
+        with self._lock:
+            last = self._last_created.get(session_id)
+            rows = []
+            for role, content in messages:
+                created = datetime.now(timezone.utc)
+                if last and created <= last:
+                    created = last + timedelta(microseconds=1)
+                last = created
+                rows.append({
+                    "id": str(uuid.uuid4()),
+                    "session_id": session_id,
+                    "role": role,
+                    "content": content,
+                    "created_at": created.isoformat(timespec="microseconds"),
+                })
+            if title:
+                rows[-1]["title"] = title
+            seq = self._db.execute(
+                "insert into entries (user_id, session_id, messages) values (?, ?, ?)",
+                (user_id, session_id, json.dumps(rows)),
+            ).lastrowid
+            self._remember_pending(seq, user_id, session_id, rows)
+            if access_token != self._refused_tokens.get(user_id):
+                self._tokens[user_id] = access_token
+        self._wake.set()
+        return [{column: row[column] for column in ("id", "role", "content", "created_at")} for row in rows]
+
+    def pending(self, user_id, session_id) -> list:
+        """The session's journaled messages that have not been sent yet, in order."""
+        with self._lock:
+            entries = self._pending.get((user_id, session_id))
+            return [message for seq in sorted(entries) for message in entries[seq]] if entries else []
+
+    def discard_session(self, user_id, session_id):
+        """Drops a deleted session's unsent and set-aside messages."""
+        with self._lock:
+            self._db.execute("delete from entries where user_id = ? and session_id = ?", (user_id, session_id))
+            self._pending.pop((user_id, session_id), None)
+            self._last_created.pop(session_id, None)
+            self._count_set_aside(user_id)
+
+    def set_aside(self, user_id) -> list:
+        """
+        The user's set-aside entries, oldest first: [{"seq", "session_id", "messages",
+        "error"}, ...]. Costs nothing while the user has none.
+        """
+        with self._lock:
+            if not self._set_aside_counts.get(user_id):
+                return []
+            rows = self._db.execute(
+                "select seq, session_id, messages, last_error from entries "
+                "where user_id = ? and failed = 1 order by seq",
+                (user_id,),
+            ).fetchall()
+        return [
+            {"seq": seq, "session_id": session_id, "messages": json.loads(messages), "error": error}
+            for seq, session_id, messages, error in rows
+        ]
+
+    def retry_set_aside(self, user_id):
+        """Queues the user's set-aside entries again, in their original order."""
+        with self._lock:
+            rows = self._db.execute(
+                "select seq, session_id, messages from entries where user_id = ? and failed = 1", (user_id,)
+            ).fetchall()
+            self._db.execute("update entries set failed = 0, attempts = 0 where user_id = ? and failed = 1", (user_id,))
+            for seq, session_id, messages in rows:
+                self._remember_pending(seq, user_id, session_id, json.loads(messages))
+            self._set_aside_counts.pop(user_id, None)
+            self._retry_at.pop(user_id, None)
+        self._wake.set()
+
+    def drop_set_aside(self, user_id):
+        """Deletes the user's set-aside entries for good."""
+        with self._lock:
+            self._db.execute("delete from entries where user_id = ? and failed = 1", (user_id,))
+            self._set_aside_counts.pop(user_id, None)
+
+    def _count_set_aside(self, user_id):
+        # Called with the lock held
+        (count,) = self._db.execute(
+            "select count(*) from entries where user_id = ? and failed = 1", (user_id,)
+        ).fetchone()
+        if count:
+            self._set_aside_counts[user_id] = count
+        else:
+            self._set_aside_counts.pop(user_id, None)
+
+    def _run(self):
+        while True:
+            # Woken by new entries and tokens; the timeout picks up due retries
+            self._wake.wait(1.0)
+            self._wake.clear()
+            while self._flush_next():
+                pass
+
+    def _next_batch(self):
+        """The oldest unsent entries of the first user that can be sent for now."""
+        with self._lock:
+            now = time.monotonic()
+            users = self._db.execute(
+                "select user_id from entries where failed = 0 group by user_id order by min(seq)"
+            ).fetchall()
+            for (user_id,) in users:
+                token = self._tokens.get(user_id)
+                if token and self._retry_at.get(user_id, 0) <= now:
+                    entries = self._db.execute(
+                        "select seq, session_id, messages, attempts from entries "
+                        "where user_id = ? and failed = 0 order by seq limit ?",
+                        (user_id, self._batch_limit.get(user_id, self._batch_size)),
+                    ).fetchall()
+                    return user_id, token, entries
+        return None
+
+    def _flush_next(self) -> bool:
+        """Sends one batch. Returns False when nothing could be sent right now."""
+        batch = self._next_batch()
+        if batch is None:
+            return False
+        user_id, token, entries = batch
+        messages = [message for _, _, payload, _ in entries for message in json.loads(payload)]
+        try:
+            with span("journal.flush", "postgrest", entries=len(entries), messages=len(messages)):
+                self._send(token, messages)
+        except TokenRejected as e:
+            with self._lock:
+                if self._tokens.get(user_id) == token:
+                    del self._tokens[user_id]
+                self._refused_tokens[user_id] = token
+            logger.info("Message journal: token of user %s refused (%s); waiting for a fresh one", user_id, e)
+            return True
+        except SessionDeleted as e:
+            logger.info("Message journal: dropping entries of deleted session %s", e.session_id)
+            self.discard_session(user_id, e.session_id)
+            if self._on_session_deleted is not None:
+                self._on_session_deleted(user_id, e.session_id)
+            return True
+        except BackendUnavailable as e:
+            with self._lock:
+                outages = self._outages[user_id] = self._outages.get(user_id, 0) + 1
+            self._back_off(user_id, outages)
+            logger.warning("Message journal: backend unavailable, retrying: %s", e)
+            return True
+        except Exception as e:
+            self._record_failure(user_id, entries, e)
+            return True
+
+        with self._lock:
+            self._db.executemany("delete from entries where seq = ?", [(seq,) for seq, _, _, _ in entries])
+            for seq, session_id, _, _ in entries:
+                session_entries = self._pending.get((user_id, session_id))
+                if session_entries is not None:
+                    session_entries.pop(seq, None)
+                    if not session_entries:
+                        del self._pending[(user_id, session_id)]
+            self._retry_at.pop(user_id, None)
+            self._outages.pop(user_id, None)
+            # Back to full batches once the failing entry has gone
+            limit = self._batch_limit.pop(user_id, self._batch_size)
+            if limit * 2 < self._batch_size:
+                self._batch_limit[user_id] = limit * 2
+        return True
+
+    def _back_off(self, user_id, attempts):
+        delay = min(self._retry_base * 2 ** (attempts - 1), self._retry_max)
+        with self._lock:
+            self._retry_at[user_id] = time.monotonic() + delay
+
+    def _record_failure(self, user_id, entries, error):
+        if len(entries) > 1:
+            # Narrow down to the failing entry: send the older half on its own next
+            with self._lock:
+                self._batch_limit[user_id] = len(entries) // 2
+            if not isinstance(error, EntriesRejected):
+                self._back_off(user_id, 1)
+            return
+        seq, session_id, _, attempts = entries[0]
+        attempts += 1
+        if isinstance(error, EntriesRejected) or attempts >= self._max_attempts:
+            # Set the entry aside so the rest of the user's messages can go
+            logger.warning("Message journal: set aside entry %s of user %s after %s attempt(s): %s", seq, user_id, attempts, error)
+            count_event("journal", "entry_set_aside")
+            with self._lock:
+                self._db.execute("update entries set attempts = ?, failed = 1, last_error = ? where seq = ?", (attempts, str(error), seq))
+                session_entries = self._pending.get((user_id, session_id))
+                if session_entries is not None:
+                    session_entries.pop(seq, None)
+                    if not session_entries:
+                        del self._pending[(user_id, session_id)]
+                self._set_aside_counts[user_id] = self._set_aside_counts.get(user_id, 0) + 1
+                self._retry_at.pop(user_id, None)
+            return
+        with self._lock:
+            self._db.execute("update entries set attempts = ?, last_error = ? where seq = ?", (attempts, str(error), seq))
+        self._back_off(user_id, attempts)
@@ -0,0 +1,163 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from app.cache import normalize_prompt
+
+# Process-wide cap on concurrent n8n webhook calls (chat replies and title generation),
+# so a burst of users queues here instead of piling onto the n8n workers.
+_webhook_slots = threading.BoundedSemaphore(int(os.getenv("N8N_MAX_CONCURRENCY", "8")))
+
+@contextmanager
+def webhook_slot():
+    """
+    Holds one of the N8N_MAX_CONCURRENCY webhook slots for the duration of the block.
+    Yields False (without a slot) if none frees up within N8N_CONCURRENCY_WAIT seconds.
+    """
+    acquired = _webhook_slots.acquire(timeout=float(os.getenv("N8N_CONCURRENCY_WAIT", "30")))
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            _webhook_slots.release()
+
+def try_webhook_slot() -> bool:
+    """
+    Takes a webhook slot only if one is free right now, for calls that are worth
+    making only when there is spare capacity. Give it back with release_webhook_slot().
+    """
+    return _webhook_slots.acquire(blocking=False)
+
+def release_webhook_slot():
+    _webhook_slots.release()
+
+# Per-user turn accounting: {user_id: {"active": n, "queue": [turns waiting, oldest first]}},
+# guarded by _turns_changed.
+_user_turns = {}
+# Recently submitted prompts: {(user_id, session_id, normalized prompt): _Submission}
+_recent_prompts = {}
+_turns_changed = threading.Condition()
+
+class _Submission:
+    def __init__(self):
+        self.done = threading.Event()
+        self.completed = False
+        self.finished_at = None
+
+class AgentTurn:
+    """
+    Admission control for one chat submission, used as a context manager:
+
+        with AgentTurn(user_id, session_id, prompt) as turn:
+            status = turn.wait()   # "run", "duplicate" or "busy"
+            if status == "run":
+                ...                # call the agent and store the exchange
+                turn.complete()
+
+    Each user has at most AGENT_MAX_INFLIGHT_PER_USER turns talking to the agent and
+    AGENT_MAX_QUEUED_PER_USER more waiting behind them; beyond that a turn is "busy".
+    The same prompt submitted again in the same chat, while the first is still running
+    or within AGENT_DEDUP_WINDOW seconds after it was stored, is a "duplicate" and is
+    not sent again. A turn that ends without complete() (an error, or a rerun that
+    interrupted it) is forgotten, so submitting it again goes through.
+    """
+
+    def __init__(self, user_id, session_id, prompt: str):
+        self.user_id = user_id
+        self.key = (user_id, session_id, normalize_prompt(prompt))
+        self.status = None
+        self._submission = None
+        self._queued = False
+        self._active = False
+        self._registered = False
+
+    def __enter__(self):
+        with _turns_changed:
+            self._admit_locked()
+        return self
+
+    def _admit_locked(self):
+        now = time.monotonic()
+        window = float(os.getenv("AGENT_DEDUP_WINDOW", "10"))
+        for key, submission in list(_recent_prompts.items()):
+            if submission.finished_at is not None and now - submission.finished_at > window:
+                del _recent_prompts[key]
+
+        original = _recent_prompts.get(self.key)
+        if original is not None:
+            self.status = "duplicate"
+            self._submission = original
+            return
+
+        turns = _user_turns.setdefault(self.user_id, {"active": 0, "queue": []})
+        if (turns["active"] >= int(os.getenv("AGENT_MAX_INFLIGHT_PER_USER", "1"))
+                and len(turns["queue"]) >= int(os.getenv("AGENT_MAX_QUEUED_PER_USER", "2"))):
+            self.status = "busy"
+            return
+
+        self.status = "queued"
+        self._submission = _recent_prompts[self.key] = _Submission()
+        turns["queue"].append(self)
+        self._queued = True
+        self._registered = True
+
+    def wait(self) -> str:
+        """
+        Blocks until the turn may run: behind the user's in-flight turns (at most
+        AGENT_QUEUE_TIMEOUT seconds, then "busy"), or, for a duplicate, until the
+        original is done (then "duplicate", or "run" if the original stored nothing).
+        """
+        max_inflight = int(os.getenv("AGENT_MAX_INFLIGHT_PER_USER", "1"))
+        deadline = time.monotonic() + float(os.getenv("AGENT_QUEUE_TIMEOUT", "60"))
+        while self.status == "duplicate":
+            self._submission.done.wait(max(deadline - time.monotonic(), 0))
+            with _turns_changed:
+                if self._submission.completed or not self._submission.done.is_set():
+                    return self.status
+                # The original gave up without storing anything; take its place
+                self._admit_locked()
+
+        with _turns_changed:
+            if self.status != "queued":
+                return self.status
+            turns = _user_turns[self.user_id]
+            # First come, first served
+            while turns["active"] >= max_inflight or turns["queue"][0] is not self:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    # Leave the queue now so turns behind this one are not held up
+                    turns["queue"].remove(self)
+                    self._queued = False
+                    _turns_changed.notify_all()
+                    self.status = "busy"
+                    return self.status
+                _turns_changed.wait(remaining)
+            turns["queue"].remove(self)
+            turns["active"] += 1
+            self._queued = False
+            self._active = True
+            self.status = "run"
+        return self.status
+
+    def complete(self):
+        """Marks the prompt as answered and stored; repeats of it are now duplicates."""
+        if self.status == "run":
+            self._submission.completed = True
+
+    def __exit__(self, exc_type, exc, tb):
+        with _turns_changed:
+            turns = _user_turns.get(self.user_id)
+            if turns is not None:
+                if self._queued:
+                    turns["queue"].remove(self)
+                if self._active:
+                    turns["active"] -= 1
+                if not turns["active"] and not turns["queue"]:
+                    del _user_turns[self.user_id]
+            if self._registered:
+                if not self._submission.completed and _recent_prompts.get(self.key) is self._submission:
+                    del _recent_prompts[self.key]
+                self._submission.finished_at = time.monotonic()
+                self._submission.done.set()
+            _turns_changed.notify_all()
+        return False
@@ -0,0 +1,355 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from functools import wraps
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+
+# Spans and HTTP calls kept per rerun for the debug panel
+_RERUN_LIMIT = 500
+
+class Histogram:
+    """A fixed-bucket latency histogram (seconds), Prometheus style."""
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile by interpolating inside the bucket that holds it."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if BUCKETS[i] != float("inf") else lower * 2 or 1.0
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return BUCKETS[-2]
+
+# Process-wide aggregates, shared by all sessions
+_lock = threading.Lock()
+_span_histograms = {}    # (span, service, status) -> Histogram
+_http_histograms = {}    # (service, status) -> Histogram
+_http_bytes = {}         # (service, direction) -> bytes
+_http_retries = {}       # service -> retried attempts
+_rerun_histograms = {}   # (scope, service) -> Histogram of time spent per rerun
+_events = {}             # (service, event) -> count
+
+_local = threading.local()
+
+class Span:
+    def __init__(self, name: str, service: str, attrs: dict):
+        self.name = name
+        self.service = service
+        self.attrs = attrs
+        self.status = "ok"
+        self.started = time.perf_counter()
+        self.seconds = None
+
+def _span_stack() -> list:
+    if not hasattr(_local, "spans"):
+        _local.spans = []
+    return _local.spans
+
+def _rerun_record():
+    """This rerun's span/HTTP record, or None outside a script thread."""
+    # Spans also close on worker threads (journal, naming, hedging), which have no context
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return None
+    try:
+        return st.session_state.setdefault("_metrics_rerun", {"started": time.perf_counter(), "spans": [], "http": []})
+    except Exception:
+        return None
+
+@contextmanager
+def span(name: str, service: str = "app", **attrs):
+    """
+    Times a block as a named span. The span is an error if the block raises
+    (other than st.stop/st.rerun) or if an HTTP call made inside it failed,
+    so helpers that swallow their errors are still reported correctly.
+    """
+    current = Span(name, service, attrs)
+    stack = _span_stack()
+    stack.append(current)
+    try:
+        yield current
+    # st.stop()/st.rerun() raise BaseExceptions, which pass through as control flow
+    except Exception:
+        current.status = "error"
+        raise
+    finally:
+        # A span in an abandoned generator may be closed later, from another thread
+        if current in stack:
+            stack.remove(current)
+        current.seconds = time.perf_counter() - current.started
+        with _lock:
+            _span_histograms.setdefault((name, service, current.status), Histogram()).observe(current.seconds)
+        record = _rerun_record()
+        if record is not None and len(record["spans"]) < _RERUN_LIMIT:
+            record["spans"].append({
+                "span": name,
+                "service": service,
+                "ms": round(current.seconds * 1000, 1),
+                "status": current.status,
+                **current.attrs,
+            })
+
+def timed(name: str, service: str = "app"):
+    """Decorator form of span()."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, service):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def annotate(**attrs):
+    """Adds attributes (cache hits, row counts, ...) to the innermost open span."""
+    stack = _span_stack()
+    if stack:
+        stack[-1].attrs.update(attrs)
+
+def mark_error():
+    """Marks the innermost open span as failed, for errors a helper handles itself."""
+    stack = _span_stack()
+    if stack:
+        stack[-1].status = "error"
+
+def record_http(service: str, seconds: float, status=None, request_bytes: int = 0, response_bytes: int = 0, retry: bool = False, error: str = None):
+    """
+    Records one outbound HTTP call: `status` is the response code, or None with
+    `error` set when no response arrived. Failed calls mark every open span as errors.
+    """
+    status_label = str(status) if status is not None else (error or "error")
+    with _lock:
+        _http_histograms.setdefault((service, status_label), Histogram()).observe(seconds)
+        _http_bytes[(service, "sent")] = _http_bytes.get((service, "sent"), 0) + request_bytes
+        _http_bytes[(service, "received")] = _http_bytes.get((service, "received"), 0) + response_bytes
+        if retry:
+            _http_retries[service] = _http_retries.get(service, 0) + 1
+
+    if status is None or status >= 400:
+        for open_span in _span_stack():
+            open_span.status = "error"
+    record = _rerun_record()
+    if record is not None and len(record["http"]) < _RERUN_LIMIT:
+        record["http"].append({"service": service, "ms": round(seconds * 1000, 1), "status": status_label})
+
+def count_event(service: str, event: str, count: int = 1):
+    """Counts a notable occurrence (a breaker opening, a message set aside, ...)."""
+    with _lock:
+        _events[(service, event)] = _events.get((service, event), 0) + count
+
+def instrumented_transport(transport, classify):
+    """
+    Wraps an httpx transport so every request is timed and recorded with
+    record_http(); `classify(request)` names the service it went to.
+    Responses are read in full here, which the JSON APIs we call do anyway.
+    """
+    import httpx
+
+    class InstrumentedTransport(httpx.BaseTransport):
+        def handle_request(self, request):
+            started = time.perf_counter()
+            service = classify(request)
+            try:
+                response = transport.handle_request(request)
+                response.read()
+            except httpx.HTTPError as e:
+                record_http(service, time.perf_counter() - started, request_bytes=len(request.content), error=type(e).__name__)
+                raise
+            record_http(service, time.perf_counter() - started, response.status_code, len(request.content), len(response.content))
+            return response
+
+        def close(self):
+            transport.close()
+
+    return InstrumentedTransport()
+
+def begin_rerun():
+    """Starts a fresh per-rerun record; called at the top of every full rerun."""
+    if get_script_run_ctx(suppress_warning=True) is not None:
+        st.session_state["_metrics_rerun"] = {"started": time.perf_counter(), "spans": [], "http": []}
+
+def end_rerun(scope: str = "app") -> dict:
+    """
+    Closes the current rerun: adds its time per service to the process-wide
+    per-rerun histograms under `scope` ("app" for full reruns, the fragment's name
+    for fragment reruns) and returns {"total_ms", "services": {service: ms}}.
+    """
+    record = _rerun_record()
+    if record is None:
+        return {"total_ms": 0.0, "services": {}}
+    services = {}
+    for call in record["http"]:
+        services[call["service"]] = services.get(call["service"], 0.0) + call["ms"]
+    for entry in record["spans"]:
+        if entry["service"] == "render":
+            services["render"] = services.get("render", 0.0) + entry["ms"]
+    total_ms = (time.perf_counter() - record["started"]) * 1000
+    with _lock:
+        _rerun_histograms.setdefault((scope, "total"), Histogram()).observe(total_ms / 1000)
+        for service, ms in services.items():
+            _rerun_histograms.setdefault((scope, service), Histogram()).observe(ms / 1000)
+    return {"total_ms": round(total_ms, 1), "services": {s: round(ms, 1) for s, ms in services.items()}}
+
+def fragment_rerun(fn):
+    """
+    Decorator for st.fragment bodies: when the fragment reruns on its own, its spans
+    and HTTP calls get a record of their own, aggregated under the fragment's name.
+    Inside a full rerun it adds nothing; main.py's record covers it.
+    """
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        ctx = get_script_run_ctx(suppress_warning=True)
+        if ctx is None or not ctx.fragment_ids_this_run:
+            return fn(*args, **kwargs)
+        begin_rerun()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            # Also when the fragment ends with st.rerun()/st.stop()
+            end_rerun(fn.__name__)
+    return wrapper
+
+def snapshot() -> dict:
+    """Process-wide metrics as JSON-serializable data."""
+    def summary(histogram):
+        return {
+            "count": histogram.count,
+            "sum_ms": round(histogram.sum * 1000, 1),
+            "p50_ms": round(histogram.quantile(0.5) * 1000, 1),
+            "p95_ms": round(histogram.quantile(0.95) * 1000, 1),
+        }
+    with _lock:
+        return {
+            "spans": [
+                {"span": name, "service": service, "status": status, **summary(histogram)}
+                for (name, service, status), histogram in sorted(_span_histograms.items())
+            ],
+            "http": [
+                {"service": service, "status": status, **summary(histogram)}
+                for (service, status), histogram in sorted(_http_histograms.items())
+            ],
+            "http_bytes": [{"service": s, "direction": d, "bytes": b} for (s, d), b in sorted(_http_bytes.items())],
+            "http_retries": dict(_http_retries),
+            "reruns": [{"scope": scope, "service": service, **summary(h)}
+                       for (scope, service), h in sorted(_rerun_histograms.items())],
+            "events": [{"service": s, "event": e, "count": c} for (s, e), c in sorted(_events.items())],
+        }
+
+def _prometheus_histogram(lines, metric, labels, histogram):
+    cumulative = 0
+    for bound, bucket_count in zip(BUCKETS, histogram.counts):
+        cumulative += bucket_count
+        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+        lines.append(f'{metric}_bucket{{{labels},le="{le}"}} {cumulative}')
+    lines.append(f"{metric}_sum{{{labels}}} {histogram.sum:.6f}")
+    lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+
+def render_prometheus() -> str:
+    """Process-wide metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        lines.append("# TYPE app_span_duration_seconds histogram")
+        for (name, service, status), histogram in sorted(_span_histograms.items()):
+            _prometheus_histogram(lines, "app_span_duration_seconds", f'span="{name}",service="{service}",status="{status}"', histogram)
+        lines.append("# TYPE app_http_request_duration_seconds histogram")
+        for (service, status), histogram in sorted(_http_histograms.items()):
+            _prometheus_histogram(lines, "app_http_request_duration_seconds", f'service="{service}",status="{status}"', histogram)
+        lines.append("# TYPE app_rerun_service_seconds histogram")
+        for (scope, service), histogram in sorted(_rerun_histograms.items()):
+            _prometheus_histogram(lines, "app_rerun_service_seconds", f'scope="{scope}",service="{service}"', histogram)
+        lines.append("# TYPE app_http_bytes_total counter")
+        for (service, direction), total in sorted(_http_bytes.items()):
+            lines.append(f'app_http_bytes_total{{service="{service}",direction="{direction}"}} {total}')
+        lines.append("# TYPE app_http_retries_total counter")
+        for service, total in sorted(_http_retries.items()):
+            lines.append(f'app_http_retries_total{{service="{service}"}} {total}')
+        lines.append("# TYPE app_events_total counter")
+        for (service, event), total in sorted(_events.items()):
+            lines.append(f'app_events_total{{service="{service}",event="{event}"}} {total}')
+    return "\n".join(lines) + "\n"
+
+@st.cache_resource(show_spinner=False)
+def start_exporters():
+    """
+    Starts the optional process-wide sinks, once per process:
+    METRICS_PORT serves /metrics (Prometheus text) and /metrics.json;
+    METRICS_LOG_INTERVAL logs a JSON snapshot (logger "app.metrics", level INFO)
+    every that many seconds.
+    """
+    port = os.getenv("METRICS_PORT")
+    if port:
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    body, content_type = json.dumps(snapshot()).encode(), "application/json"
+                elif self.path.startswith("/metrics"):
+                    body, content_type = render_prometheus().encode(), "text/plain; version=0.0.4"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            server = ThreadingHTTPServer((os.getenv("METRICS_HOST", "127.0.0.1"), int(port)), MetricsHandler)
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        except OSError as e:
+            logger.warning("Metrics endpoint not started: %s", e)
+
+    interval = float(os.getenv("METRICS_LOG_INTERVAL", "0"))
+    if interval > 0:
+        def log_forever():
+            while True:
+                time.sleep(interval)
+                logger.info("metrics %s", json.dumps(snapshot()))
+        threading.Thread(target=log_forever, name="metrics-log", daemon=True).start()
+    return True
+
+def is_debug_panel_enabled() -> bool:
+    return os.getenv("METRICS_DEBUG_PANEL", "false").lower() in ("1", "true", "yes")
+
+def render_debug_panel(summary: dict):
+    """
+    Sidebar panel with this rerun's spans (and `summary` from end_rerun) and the
+    process-wide percentiles. Shows the last full rerun; fragment reruns do not refresh it.
+    """
+    record = _rerun_record() or {"spans": [], "http": []}
+    with st.expander("Performance"):
+        st.caption(f"This rerun: {summary['total_ms']:.0f} ms")
+        if summary["services"]:
+            st.dataframe([{"service": s, "ms": ms} for s, ms in summary["services"].items()], hide_index=True)
+        if record["spans"]:
+            st.dataframe(record["spans"], hide_index=True)
+        data = snapshot()
+        st.caption("Process (since start)")
+        st.dataframe(data["spans"], hide_index=True)
+        st.dataframe(data["http"], hide_index=True)
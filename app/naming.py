@@ -0,0 +1,98 @@
+import os
+import re
+import uuid
+import logging
+import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
+from app.auth import update_session_title
+from app.cache import LRUCache
+from app.utils import invoke_n8n_webhook
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TITLES = ("New Chat", "Untitled Chat")
+
+# Titles shown in the sidebar until the stored title catches up, keyed by session ID.
+# Entries of sessions nobody looks at again are never read (and dropped), so the cap
+# bounds them; an evicted title falls back to the stored one.
+_pending_titles = LRUCache(max_entries=int(os.getenv("NAMING_PENDING_MAX", "4096")))
+
+def is_inline_title_enabled() -> bool:
+    """
+    Whether the n8n workflow returns a `title` next to `reply` when asked,
+    which saves the separate naming call entirely.
+    """
+    return os.getenv("N8N_INLINE_TITLE", "false").lower() in ("1", "true", "yes")
+
+@st.cache_resource(show_spinner=False)
+def _get_naming_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(
+        max_workers=int(os.getenv("NAMING_WORKERS", "2")),
+        thread_name_prefix="session-naming",
+    )
+
+def heuristic_title(prompt: str) -> str:
+    """
+    A cheap local title: the first line of the prompt, whitespace-collapsed and trimmed.
+    """
+    first_line = prompt.strip().splitlines()[0] if prompt.strip() else ""
+    title = re.sub(r"\s+", " ", first_line).strip()
+    return title[:30] + "..." if len(title) > 30 else title or "New Chat"
+
+def clean_title(generated_title: str, prompt: str) -> str:
+    # Clean up title (remove quotes if any, trim)
+    new_title = (generated_title or "").strip().strip('"').strip("'")
+
+    # Fallback if AI fails or returns something too long/empty
+    if not new_title or len(new_title) > 50 or "Error" in new_title:
+        new_title = heuristic_title(prompt)
+    return new_title
+
+def pending_title(session_id):
+    """
+    Returns the title to show for a session whose naming job has not been
+    persisted yet, or None. Finished entries are dropped once read, since by
+    then the stored title is already up to date.
+    """
+    entry = _pending_titles.get(session_id)
+    if entry and entry["done"]:
+        _pending_titles.pop(session_id)
+    return entry["title"] if entry else None
+
+def _set_pending(session_id, title, done=False):
+    _pending_titles.set(session_id, {"title": title, "done": done})
+
+def _generate_and_save_title(session_id, prompt, response_text, access_token, title):
+    try:
+        if not title:
+            naming_prompt = (
+                f"Generate a very short, concise title (max 5 words) for a chat session that starts with this exchange:\n"
+                f"User: {prompt}\n"
+                f"AI: {response_text}\n"
+                f"Return ONLY the title, no quotes or extra text."
+            )
+            # Use a temporary session ID to avoid polluting the main chat context
+            meta = {}
+            title = invoke_n8n_webhook(naming_prompt, f"naming-{uuid.uuid4()}", meta=meta, cacheable=True)
+            if meta.get("error"):
+                title = None
+
+        new_title = clean_title(title, prompt)
+        _set_pending(session_id, new_title)
+        # Keep the title pending (still shown locally) if it could not be stored
+        if update_session_title(session_id, new_title, access_token=access_token) is not None:
+            _set_pending(session_id, new_title, done=True)
+    except Exception as e:
+        # Keep showing the heuristic title locally; the stored title stays the default
+        logger.warning("Smart naming failed for session %s: %s", session_id, e)
+        _set_pending(session_id, heuristic_title(prompt))
+
+def schedule_session_title(session_id, prompt, response_text, access_token, title=None):
+    """
+    Names a session after its first exchange without blocking the reply.
+    A heuristic title is shown immediately; the real one (from `title`, when the
+    webhook already returned one, or from a separate naming call) is generated
+    and saved on a background worker and picked up by a later rerun.
+    """
+    _set_pending(session_id, heuristic_title(prompt))
+    _get_naming_executor().submit(_generate_and_save_title, session_id, prompt, response_text, access_token, title)
@@ -1,6 +1,20 @@
+import os
+import logging
 import streamlit as st
-from app.utils import load_css, invoke_n8n_webhook
-from app.auth import get_user_sessions, create_session, get_session_messages, save_message, update_session_title, delete_session, require_authentication
+from streamlit.errors import StreamlitAPIException
+from app.utils import load_css, invoke_n8n_webhook, stream_n8n_webhook, is_streaming_enabled
+from app.resilience import turn_deadline
+from app.realtime import watch_changes
+from app.data import take_prefetched
+from app.export import EXPORT_FORMATS, deferred_export
+from app.render import prepare_markdown, render_message_history
+from app.limits import AgentTurn
+from app.metrics import fragment_rerun
+from app.naming import DEFAULT_TITLES, clean_title, is_inline_title_enabled, pending_title, schedule_session_title
+from app.auth import list_user_sessions, load_more_user_sessions, create_session, sync_session_messages, load_older_session_messages, load_session_messages_through, search_messages, save_message, append_exchange, is_session_deleted, unsaved_messages, retry_unsaved_messages, discard_unsaved_messages, update_session_title, delete_session, delete_sessions, require_authentication
+
+# Streamlit runs pages as __main__; name the logger so it is one of the app's (app.*)
+logger = logging.getLogger("app.pages.chat")
 
 # Authentication check - ensure user is logged in
 require_authentication()
@@ -16,8 +30,45 @@ st.caption("Company Insights & Career Guidance Assistant")
 if "current_session_id" not in st.session_state:
     st.session_state.current_session_id = None
 
+SESSION_PAGE_SIZE = int(os.getenv("SESSION_PAGE_SIZE", "30"))
+MESSAGE_PAGE_SIZE = int(os.getenv("MESSAGE_PAGE_SIZE", "50"))
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "10"))
+
+# Initialize editing state if not present
+if "editing_session_id" not in st.session_state:
+    st.session_state.editing_session_id = None
+
+def save_rename(session_id):
+    # Runs before the fragment body, so make sure the token is fresh first
+    require_authentication()
+    new_title = st.session_state[f"input_{session_id}"]
+    if new_title:
+        update_session_title(session_id, new_title)
+    st.session_state.editing_session_id = None
+    # on_change runs before the fragment reruns, so the list re-renders with the new title
+
+def rerun_fragment():
+    """
+    Reruns only the calling fragment, or the whole app when the fragment
+    is executing as part of a full-app run (where a scoped rerun is not allowed).
+    """
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
 # Sidebar - Chat History
-with st.sidebar:
+# A fragment: renaming, opening a menu or paging the list reruns only the sidebar.
+# Anything that changes the open chat (switch, new chat, deleting it) reruns the app.
+# Each fragment checks the session itself: a fragment rerun skips the check at the top
+# of the page, and a user can stay in one fragment past the access token's lifetime.
+# The check only reads the token's expiry unless it is due for a refresh.
+@st.fragment
+@fragment_rerun
+def render_session_list():
+    require_authentication()
+    # With Realtime on, sessions created, renamed or deleted elsewhere rerun just this fragment
+    watch_changes("sessions")
     st.title("Chat History")
     
     if st.button("+ New Chat", use_container_width=True):
@@ -28,21 +79,32 @@ with st.sidebar:
 
     st.markdown("---")
     
-    sessions = get_user_sessions()
-    
-    # Initialize editing state if not present
-    if "editing_session_id" not in st.session_state:
-        st.session_state.editing_session_id = None
-
-    def save_rename(session_id):
-        new_title = st.session_state[f"input_{session_id}"]
-        if new_title:
-            update_session_title(session_id, new_title)
-        st.session_state.editing_session_id = None
-        # No need to rerun here, on_change handles the value update, and the loop will re-render with new title next run
-        # But to show the change immediately, we might need a rerun or just let Streamlit handle it.
-        # Actually, on_change runs BEFORE the script rerun. So the next rerun will have the updated data.
+    sessions, has_more_sessions = take_prefetched("sessions") or list_user_sessions(SESSION_PAGE_SIZE)
+
+    if st.toggle("Select", key="selecting_sessions"):
+        render_session_selection(sessions)
+    else:
+        render_session_rows(sessions)
+
+    if has_more_sessions:
+        st.button("Show more", on_click=load_more_user_sessions, args=(SESSION_PAGE_SIZE,), use_container_width=True)
 
+def after_delete(session_ids):
+    """Leaves a deleted chat if it was open; otherwise only the sidebar reruns."""
+    if st.session_state.current_session_id in session_ids:
+        st.session_state.current_session_id = None
+        st.rerun()
+    rerun_fragment()
+
+def render_session_selection(sessions):
+    # Bulk delete: one request soft-deletes every checked session
+    selected = [session["id"] for session in sessions
+                if st.checkbox(pending_title(session["id"]) or session.get("title", "Untitled Chat"), key=f"sel_{session['id']}")]
+    if st.button(f"🗑️ Delete selected ({len(selected)})", disabled=not selected, type="primary", use_container_width=True):
+        if delete_sessions(selected):
+            after_delete(selected)
+
+def render_session_rows(sessions):
     for session in sessions:
         col1, col2 = st.columns([0.85, 0.15])
         
@@ -59,7 +121,8 @@ with st.sidebar:
                 )
             else:
                 # Normal Mode: Show Session Button
-                if st.button(session.get("title", "Untitled Chat"), key=f"btn_{session['id']}", use_container_width=True):
+                title = pending_title(session["id"]) or session.get("title", "Untitled Chat")
+                if st.button(title, key=f"btn_{session['id']}", use_container_width=True):
                     st.session_state.current_session_id = session["id"]
                     st.rerun()
         
@@ -68,17 +131,84 @@ with st.sidebar:
             with st.popover("⋮", use_container_width=True):
                 if st.button("✏️ Rename", key=f"edit_{session['id']}", use_container_width=True):
                     st.session_state.editing_session_id = session["id"]
-                    st.rerun()
+                    rerun_fragment()
                 
                 if st.button("🗑️ Delete", key=f"del_{session['id']}", use_container_width=True):
                     if delete_session(session["id"]):
-                        if st.session_state.current_session_id == session["id"]:
-                            st.session_state.current_session_id = None
-                        st.rerun()
+                        after_delete({session["id"]})
+
+def show_more_results():
+    st.session_state.search_pages += 1
+
+# Sidebar - Search: runs in the database (migrations/003_message_search.sql);
+# picking a result opens its chat at that message
+@st.fragment
+@fragment_rerun
+def render_search():
+    require_authentication()
+    query = st.text_input("Search chats", key="search_query", placeholder="Search your chats", label_visibility="collapsed")
+    if not query.strip():
+        return
+    if st.session_state.get("search_for") != query:
+        st.session_state.search_for = query
+        st.session_state.search_pages = 1
+
+    results, has_more = [], False
+    for page in range(st.session_state.search_pages):
+        rows, has_more = search_messages(query, SEARCH_PAGE_SIZE, page * SEARCH_PAGE_SIZE)
+        results += rows
+
+    if not results:
+        st.caption("No matching messages.")
+    for result in results:
+        snippet = " ".join(result["snippet"].split())
+        label = prepare_markdown(f"**{result.get('session_title') or 'Untitled Chat'}** · {snippet}")
+        if st.button(label, key=f"search_{result['message_id']}", use_container_width=True):
+            st.session_state.current_session_id = result["session_id"]
+            st.session_state.jump_to_message = result
+            st.rerun()
+    if has_more:
+        st.button("More results", on_click=show_more_results, use_container_width=True)
+    st.markdown("---")
+
+# Sidebar - Export: built only once Download is clicked, on Streamlit's download thread
+@st.fragment
+@fragment_rerun
+def render_export():
+    require_authentication()
+    with st.expander("Export chats"):
+        scope = st.radio("Chats", ["This chat", "All chats"], key="export_scope", horizontal=True)
+        fmt = st.radio("Format", list(EXPORT_FORMATS), format_func=lambda f: EXPORT_FORMATS[f][0], key="export_format", horizontal=True)
+        # Shown only after this click, so the download uses the current access token
+        if not st.button("Prepare export", use_container_width=True):
+            return
+
+        session = None
+        if scope == "This chat":
+            session_id = st.session_state.current_session_id
+            if not session_id:
+                st.info("Open a chat to export it.")
+                return
+            sessions, _ = list_user_sessions(SESSION_PAGE_SIZE)
+            session = next((s for s in sessions if s["id"] == session_id), {"id": session_id, "title": None, "created_at": None})
+        _, mime, extension = EXPORT_FORMATS[fmt]
+        st.download_button(
+            "Download",
+            data=deferred_export(fmt, st.session_state.access_token, st.session_state.user.id, session),
+            file_name=f"{'chat' if session else 'chat-history'}.{extension}",
+            mime=mime,
+            use_container_width=True,
+        )
+
+with st.sidebar:
+    render_search()
+    render_session_list()
+    render_export()
 
 # Main Chat Area
 if not st.session_state.current_session_id:
     # If no session selected, create one automatically or show welcome
+    sessions, _ = list_user_sessions(SESSION_PAGE_SIZE)
     if not sessions:
         new_session = create_session()
         if new_session:
@@ -88,73 +218,141 @@ if not st.session_state.current_session_id:
         st.session_state.current_session_id = sessions[0]["id"]
         st.rerun()
 
-# Load messages for current session
-messages = get_session_messages(st.session_state.current_session_id)
+def leave_if_deleted(session_id):
+    """Leaves the open chat once it is known to be deleted, e.g. from another tab or device."""
+    if is_session_deleted(session_id):
+        st.session_state.current_session_id = None
+        st.rerun()
 
-# Display Chat History
-for message in messages:
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
+def render_unsaved_messages():
+    """Messages the journal could not save (MESSAGE_JOURNAL_ENABLED), with retry and discard."""
+    unsaved = unsaved_messages()
+    if not unsaved:
+        return
+    count = sum(len(entry["messages"]) for entry in unsaved)
+    st.warning(f"{count} message(s) could not be saved.")
+    with st.expander("Show unsaved messages"):
+        for entry in unsaved:
+            for message in entry["messages"]:
+                st.markdown(f"**{message['role']}:** {prepare_markdown(message['content'] or '')}")
+            st.caption(entry["error"] or "")
+        col1, col2 = st.columns(2)
+        col1.button("Retry saving", on_click=retry_unsaved_messages, use_container_width=True)
+        col2.button("Discard", on_click=discard_unsaved_messages, use_container_width=True)
 
-# Chat Input
-if prompt := st.chat_input("Ask me about company roles, salaries, or interview tips..."):
-    # Save user message
-    save_message(st.session_state.current_session_id, "user", prompt)
-    
-    # Display user message
-    with st.chat_message("user"):
-        st.markdown(prompt)
-
-    # Generate Response
-    with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            response_text = invoke_n8n_webhook(prompt, st.session_state.current_session_id)
-            st.markdown(response_text)
-    
-    # Save assistant message
-    save_message(st.session_state.current_session_id, "assistant", response_text)
-    
-    # Smart Session Naming: Rename if it's the first interaction
-    # If we have exactly 2 messages (1 user, 1 assistant), it's time to name the session
-    try:
-        # Check if we need to rename (only if title is default)
-        current_title = "New Chat"
-        for s in sessions:
-            if s["id"] == st.session_state.current_session_id:
-                current_title = s.get("title", "New Chat")
-                break
+# Chat pane: a fragment, so sending a message or loading older ones leaves the sidebar alone
+@st.fragment
+@fragment_rerun
+def render_chat():
+    require_authentication()
+    session_id = st.session_state.current_session_id
+    # With Realtime on, messages added elsewhere rerun just this fragment
+    watch_changes(("messages", session_id))
+    leave_if_deleted(session_id)
+
+    render_unsaved_messages()
+
+    # Coming from a search result: make sure its message is loaded, then focus it
+    jump = st.session_state.pop("jump_to_message", None)
+    focus_id = None
+    if jump and jump["session_id"] == session_id and load_session_messages_through(session_id, jump, MESSAGE_PAGE_SIZE):
+        focus_id = jump["message_id"]
+
+    # Load messages for current session: the cached window plus any rows newer than it
+    # (the prefetched window may predate loading the search result above)
+    prefetched = take_prefetched("messages", session_id)
+    messages, has_older_messages = (not focus_id and prefetched) or sync_session_messages(session_id, MESSAGE_PAGE_SIZE)
+
+    if has_older_messages:
+        st.button(
+            "Load older messages",
+            on_click=load_older_session_messages,
+            args=(session_id, MESSAGE_PAGE_SIZE),
+            use_container_width=True,
+        )
+
+    # Display Chat History: recent messages in full, older ones folded into groups
+    render_message_history(session_id, messages, focus_id)
+
+    # Chat Input
+    if prompt := st.chat_input("Ask me about company roles, salaries, or interview tips..."):
+        # Display user message (it is stored together with the reply below)
+        with st.chat_message("user"):
+            st.markdown(prepare_markdown(prompt))
+
+        # Backpressure: a user gets one reply at a time (a few more may queue), and the same
+        # prompt submitted twice (e.g. a double submit during a rerun) is only sent once
+        with AgentTurn(st.session_state.user.id, session_id, prompt) as turn:
+            with st.spinner("Waiting for your previous message to finish..."):
+                status = turn.wait()
+            if status == "duplicate":
+                # Already answered (or still being answered) by another run; show what is stored
+                rerun_fragment()
+            if status == "busy":
+                st.warning("You already have messages waiting for a reply. Please wait for them to finish.")
+                return
+
+            # Smart Session Naming applies only to the first exchange of a default-titled session
+            # (messages list was loaded before this turn, so it is empty on the first exchange)
+            current_title = "New Chat"
+            for s in list_user_sessions(SESSION_PAGE_SIZE)[0]:
+                if s["id"] == session_id:
+                    current_title = s.get("title", "New Chat")
+                    break
+            needs_title = current_title in DEFAULT_TITLES and len(messages) == 0
+            request_title = needs_title and is_inline_title_enabled()
+
+            reply_meta = {}
+            # The agent call gets AGENT_TURN_DEADLINE seconds from here, retries and hedging included
+            deadline = turn_deadline()
+            # Only a session's first message is independent of earlier context, so only it may hit the response cache
+            cacheable = len(messages) == 0
+
+            # Generate Response
+            with st.chat_message("assistant"):
+                if is_streaming_enabled():
+                    # Render tokens as n8n produces them; write_stream returns the full text
+                    response_text = st.write_stream(stream_n8n_webhook(prompt, session_id, request_title, reply_meta, cacheable, deadline))
+                    if not isinstance(response_text, str):
+                        response_text = "".join(str(chunk) for chunk in response_text)
+                else:
+                    with st.spinner("Thinking..."):
+                        response_text = invoke_n8n_webhook(prompt, session_id, request_title, reply_meta, cacheable, deadline)
+                        st.markdown(prepare_markdown(response_text))
+                if reply_meta.get("error"):
+                    st.caption("The reply failed and was not saved; your message was. Send it again to retry.")
+
+            # Failed replies are never stored, but the prompt is, so it stays in the chat;
+            # leaving without complete() lets it be resent
+            if reply_meta.get("error"):
+                if save_message(session_id, "user", prompt) is None:
+                    leave_if_deleted(session_id)
+                return
+
+            # A title that came back with the reply is saved in the same call as the messages
+            inline_title = clean_title(reply_meta["title"], prompt) if needs_title and reply_meta.get("title") else None
+
+            # Save the whole exchange in one transaction; from here on a resubmit is a duplicate
+            if append_exchange(session_id, prompt, response_text, title=inline_title) is not None:
+                turn.complete()
+            else:
+                leave_if_deleted(session_id)
         
-        # We only rename if it's still the default title and we have just completed the first exchange
-        # (messages list was loaded before this turn, so it was empty, now we added 2 messages)
-        if (current_title == "New Chat" or current_title == "Untitled Chat") and len(messages) == 0:
-            # Generate title from prompt and response
-            import uuid
-            naming_prompt = (
-                f"Generate a very short, concise title (max 5 words) for a chat session that starts with this exchange:\n"
-                f"User: {prompt}\n"
-                f"AI: {response_text}\n"
-                f"Return ONLY the title, no quotes or extra text."
-            )
-            
-            # Use a temporary session ID to avoid polluting the main chat context
-            temp_session_id = f"naming-{uuid.uuid4()}"
-            
-            # Call AI for title
-            generated_title = invoke_n8n_webhook(naming_prompt, temp_session_id)
-            
-            # Clean up title (remove quotes if any, trim)
-            new_title = generated_title.strip().strip('"').strip("'")
-            
-            # Fallback if AI fails or returns something too long/empty
-            if not new_title or len(new_title) > 50 or "Error" in new_title:
-                 new_title = prompt[:30] + "..." if len(prompt) > 30 else prompt
-
-            update_session_title(st.session_state.current_session_id, new_title)
+            # Otherwise name the session in the background; the sidebar shows a heuristic title until it lands
+            if needs_title and not inline_title:
+                try:
+                    schedule_session_title(
+                        session_id,
+                        prompt,
+                        response_text,
+                        st.session_state.access_token,
+                    )
+                except Exception as e:
+                    logger.warning("Smart naming failed for session %s: %s", session_id, e)
+
+        # A new title must show up in the sidebar; otherwise only the chat pane needs to refresh
+        if needs_title:
             st.rerun()
-    except Exception as e:
-        # Silently fail to simple naming or just keep existing
-        print(f"Smart naming failed: {e}")
-        pass
+        rerun_fragment()
 
-    # Rerun to update history
-    st.rerun()
+render_chat()
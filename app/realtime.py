@@ -0,0 +1,319 @@
+import os
+import json
+import time
+import logging
+import itertools
+import threading
+from dataclasses import dataclass
+from urllib.parse import urlencode, urlsplit
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from app.auth import apply_message_change, apply_session_change, invalidate_user_sessions, set_live
+
+logger = logging.getLogger(__name__)
+
+# websockets is imported on first use, by the subscription threads.
+
+# Fragment reruns from outside the script thread rely on Streamlit internals
+# (see _request_fragment_rerun); they are only used on versions checked against them.
+# Keep in step with the pin in requirements.txt.
+_RERUN_INTERNALS_VERSIONS = ((1, 52), (1, 66))
+
+def is_realtime_enabled() -> bool:
+    """
+    Whether chat changes are pushed over Supabase Realtime
+    (needs migrations/005_realtime.sql).
+    """
+    return os.getenv("REALTIME_ENABLED", "false").lower() in ("1", "true", "yes")
+
+def realtime_url(supabase_url: str, api_key: str) -> str:
+    parts = urlsplit(supabase_url)
+    scheme = "wss" if parts.scheme == "https" else "ws"
+    return f"{scheme}://{parts.netloc}{parts.path.rstrip('/')}/realtime/v1/websocket?" + urlencode({"apikey": api_key, "vsn": "1.0.0"})
+
+class RealtimeSubscription:
+    """
+    One user's Realtime channel for chat_sessions and chat_messages changes, over its
+    own websocket on a daemon thread (Phoenix channel protocol, vsn 1.0.0).
+    Calls on_change(table, type, record, old_record) for each change, on_join(rejoined)
+    once the server confirms the postgres_changes subscription (its "Subscribed to
+    PostgreSQL" system message, which follows the join reply), and on_leave() when the
+    connection drops; reconnects with exponential backoff until close().
+    """
+
+    HEARTBEAT_INTERVAL = 25
+
+    def __init__(self, url: str, user_id, access_token: str, on_change, on_join, on_leave):
+        self.user_id = user_id
+        self.topic = f"realtime:chat-{user_id}"
+        self._url = url
+        self._token = access_token
+        self._on_change = on_change
+        self._on_join = on_join
+        self._on_leave = on_leave
+        self._refs = itertools.count(1)
+        self._lock = threading.Lock()
+        self._ws = None
+        self._join_ref = None
+        self._closed = threading.Event()
+        threading.Thread(target=self._run, name=f"realtime-{user_id}", daemon=True).start()
+
+    def set_token(self, access_token: str):
+        """Hands a refreshed access token to the open channel (and to later reconnects)."""
+        with self._lock:
+            if access_token == self._token:
+                return
+            self._token = access_token
+            ws = self._ws
+        if ws is not None:
+            try:
+                self._send(ws, self.topic, "access_token", {"access_token": access_token})
+            except Exception:
+                pass
+
+    def close(self):
+        self._closed.set()
+        with self._lock:
+            ws = self._ws
+        if ws is not None:
+            ws.close()
+
+    def _send(self, ws, topic, event, payload) -> str:
+        ref = str(next(self._refs))
+        ws.send(json.dumps({"topic": topic, "event": event, "payload": payload, "ref": ref}))
+        return ref
+
+    def _join_config(self) -> dict:
+        mine = f"user_id=eq.{self.user_id}"
+        return {
+            "broadcast": {"self": False},
+            "presence": {"key": ""},
+            "postgres_changes": [
+                # Sessions are soft-deleted (migrations/006), so a delete arrives as an
+                # UPDATE setting deleted_at; the purge's hard deletes need no binding
+                {"event": "*", "schema": "public", "table": "chat_sessions", "filter": mine},
+                {"event": "INSERT", "schema": "public", "table": "chat_messages", "filter": mine},
+            ],
+        }
+
+    def _run(self):
+        from websockets.sync.client import connect
+
+        delay, joined_before = 1.0, False
+        while not self._closed.is_set():
+            try:
+                with connect(self._url, open_timeout=10, close_timeout=2) as ws:
+                    with self._lock:
+                        self._ws = ws
+                        token = self._token
+                    self._join_ref = self._send(ws, self.topic, "phx_join", {"config": self._join_config(), "access_token": token})
+                    next_heartbeat = time.monotonic() + self.HEARTBEAT_INTERVAL
+                    while not self._closed.is_set():
+                        try:
+                            raw = ws.recv(timeout=max(next_heartbeat - time.monotonic(), 0))
+                        except TimeoutError:
+                            self._send(ws, "phoenix", "heartbeat", {})
+                            next_heartbeat = time.monotonic() + self.HEARTBEAT_INTERVAL
+                            continue
+                        if self._handle(json.loads(raw), joined_before):
+                            joined_before, delay = True, 1.0
+            except Exception as e:
+                if not self._closed.is_set():
+                    logger.warning("Realtime connection for user %s lost: %s", self.user_id, e)
+            finally:
+                with self._lock:
+                    self._ws = None
+                self._on_leave()
+            self._closed.wait(delay)
+            delay = min(delay * 2, 60.0)
+
+    def _handle(self, message: dict, joined_before: bool) -> bool:
+        """Handles one server message; returns True when it confirms the subscription."""
+        event, payload = message.get("event"), message.get("payload") or {}
+        if event == "phx_reply" and message.get("ref") == self._join_ref:
+            # The channel is joined, but changes only flow once the server has
+            # subscribed to PostgreSQL; that is confirmed by a system message
+            if payload.get("status") != "ok":
+                raise ConnectionError(f"channel join refused: {payload.get('response')}")
+        elif event == "postgres_changes":
+            data = payload.get("data") or {}
+            self._on_change(data.get("table"), data.get("type"), data.get("record"), data.get("old_record"))
+        elif event in ("phx_error", "phx_close"):
+            raise ConnectionError(f"channel {event}")
+        elif event == "system" and payload.get("extension", "postgres_changes") == "postgres_changes":
+            if payload.get("status") == "ok":
+                self._on_join(joined_before)
+                return True
+            logger.warning("Realtime error for user %s: %s", self.user_id, payload.get("message"))
+        return False
+
+@dataclass
+class _Listener:
+    """A fragment in a browser session that shows data of `topic` for a user."""
+    user_id: str
+    topic: object
+    session_id: str
+    fragment_id: str
+    page_script_hash: str
+    query_string: str
+
+def _current_fragment_id(ctx):
+    """The ID of the fragment being run, or None outside fragments."""
+    try:
+        # Streamlit 1.58+ keeps it in per-thread fragment state
+        from streamlit.runtime.scriptrunner_utils.script_run_context import ThreadState
+    except ImportError:
+        return getattr(ctx, "current_fragment_id", None)
+    try:
+        return ThreadState.get().fragment_id
+    except RuntimeError:
+        return None
+
+def _streamlit_version() -> tuple:
+    return tuple(int(part) for part in st.__version__.split(".")[:2] if part.isdigit())
+
+def _schedule_rerun(instance, session_id: str, client_state) -> None:
+    """
+    The Streamlit internals behind _request_fragment_rerun: the runtime's session
+    manager and the session's event loop. Checked against the versions in
+    _RERUN_INTERNALS_VERSIONS only.
+    """
+    session = instance._session_mgr.get_active_session_info(session_id).session
+    session._event_loop.call_soon_threadsafe(session.request_rerun, client_state)
+
+def _request_fragment_rerun(listener: _Listener) -> bool:
+    """
+    Asks a browser session to rerun one fragment, as its browser would for a
+    run_every fragment. There is no public API for a rerun started outside the script
+    thread; on Streamlit versions outside _RERUN_INTERNALS_VERSIONS nothing is rerun
+    and changes show up on the next rerun. Returns False if the session is gone.
+    """
+    from streamlit import runtime
+    from streamlit.proto.ClientState_pb2 import ClientState
+
+    instance = runtime.get_instance()
+    if not instance.is_active_session(listener.session_id):
+        return False
+    low, high = _RERUN_INTERNALS_VERSIONS
+    if not low <= _streamlit_version() < high:
+        return True
+    try:
+        _schedule_rerun(instance, listener.session_id, ClientState(
+            query_string=listener.query_string,
+            page_script_hash=listener.page_script_hash,
+            fragment_id=listener.fragment_id,
+        ))
+    except Exception as e:
+        # The cache is already updated; the change shows up on the next rerun
+        logger.warning("Realtime: could not rerun fragment %s: %s", listener.fragment_id, e)
+    return True
+
+class RealtimeHub:
+    """
+    Process-wide: one RealtimeSubscription per signed-in user, shared by all of that
+    user's browser sessions, plus the fragments watching each user's data. A change
+    is applied to the in-process caches in app/auth.py, and only fragments showing
+    data it actually changed are rerun.
+    """
+
+    def __init__(self, url: str):
+        self._url = url
+        self._lock = threading.Lock()
+        self._subscriptions = {}  # user_id -> RealtimeSubscription
+        self._listeners = {}      # (browser session ID, fragment ID) -> _Listener
+
+    def watch(self, user_id, access_token: str, topic):
+        """Registers the calling fragment as showing `topic` for the user."""
+        ctx = get_script_run_ctx()
+        fragment_id = _current_fragment_id(ctx) if ctx else None
+        if not fragment_id:
+            return
+        listener = _Listener(user_id, topic, ctx.session_id, fragment_id, ctx.page_script_hash, getattr(ctx, "query_string", ""))
+        with self._lock:
+            self._listeners[(ctx.session_id, fragment_id)] = listener
+            subscription = self._subscriptions.get(user_id)
+            if subscription is None:
+                self._subscriptions[user_id] = RealtimeSubscription(
+                    self._url, user_id, access_token,
+                    on_change=lambda *change: self._on_change(user_id, *change),
+                    on_join=lambda rejoined: self._on_join(user_id, rejoined),
+                    on_leave=lambda: set_live(user_id, False),
+                )
+                return
+        subscription.set_token(access_token)
+
+    def _on_join(self, user_id, rejoined: bool):
+        set_live(user_id, True)
+        if rejoined:
+            # Changes made while disconnected were missed: reload what the fragments show
+            invalidate_user_sessions(user_id)
+            self._rerun(user_id, None)
+
+    def _on_change(self, user_id, table, change_type, record, old_record):
+        if table == "chat_sessions":
+            changed = apply_session_change(user_id, change_type, record, old_record)
+            session_id = (record or old_record or {}).get("id")
+            deleted = change_type == "DELETE" or (record or {}).get("deleted_at")
+            topics = {"sessions", ("messages", session_id)} if deleted else {"sessions"}
+        elif table == "chat_messages" and record:
+            changed = apply_message_change(user_id, change_type, record)
+            topics = {("messages", record.get("session_id"))}
+        else:
+            return
+        if changed:
+            self._rerun(user_id, topics)
+
+    def _rerun(self, user_id, topics):
+        """Reruns the user's fragments watching any of `topics` (all of them for None)."""
+        with self._lock:
+            listeners = [(key, listener) for key, listener in self._listeners.items()
+                         if listener.user_id == user_id and (topics is None or listener.topic in topics)]
+        gone = [key for key, listener in listeners if not _request_fragment_rerun(listener)]
+        if gone:
+            self._prune(gone)
+
+    def _prune(self, keys):
+        """Forgets listeners of closed browser sessions, and users left without any."""
+        with self._lock:
+            for key in keys:
+                self._listeners.pop(key, None)
+            watched = {listener.user_id for listener in self._listeners.values()}
+            idle = [user_id for user_id in self._subscriptions if user_id not in watched]
+            subscriptions = [self._subscriptions.pop(user_id) for user_id in idle]
+        for subscription in subscriptions:
+            subscription.close()
+
+    def sweep(self):
+        """Prunes listeners whose browser sessions have ended."""
+        from streamlit import runtime
+
+        instance = runtime.get_instance()
+        with self._lock:
+            gone = [key for key, listener in self._listeners.items() if not instance.is_active_session(listener.session_id)]
+        self._prune(gone)
+
+@st.cache_resource(show_spinner=False)
+def _get_hub():
+    hub = RealtimeHub(realtime_url(os.environ["SUPABASE_URL"], os.environ["SUPABASE_KEY"]))
+
+    def sweep():
+        while True:
+            time.sleep(60)
+            try:
+                hub.sweep()
+            except Exception as e:
+                logger.warning("Realtime sweep failed: %s", e)
+    threading.Thread(target=sweep, name="realtime-sweep", daemon=True).start()
+    return hub
+
+def watch_changes(topic):
+    """
+    Called from a fragment: reruns it when `topic` changes for the signed-in user,
+    "sessions" for the session list or ("messages", session_id) for a chat.
+    Does nothing unless REALTIME_ENABLED is on.
+    """
+    user = st.session_state.get("user")
+    token = st.session_state.get("access_token")
+    if not is_realtime_enabled() or not user or not token:
+        return
+    _get_hub().watch(user.id, token, topic)
@@ -0,0 +1,94 @@
+import os
+import re
+import streamlit as st
+import streamlit.components.v1 as components
+from app.cache import LRUCache
+from app.metrics import timed
+
+# Prepared markdown of stored messages, keyed by message ID. Stored messages never
+# change, so entries never go stale; the cap only bounds memory.
+_markdown_cache = LRUCache(
+    max_entries=int(os.getenv("RENDER_CACHE_MAX_ENTRIES", "4096")),
+    max_bytes=int(os.getenv("RENDER_CACHE_MAX_MB", "32")) * 1024 * 1024,
+)
+
+# Spans of markdown whose dollar signs are left alone (code and LaTeX math), and the
+# bare dollar signs to escape. Inline math follows Pandoc's rule: the opening "$" is
+# followed by a non-space, the closing one preceded by a non-space and not followed
+# by a digit, so "$x^2$" stays math while "$120k - $150k" does not.
+_MARKDOWN_DOLLARS = re.compile(
+    r"(?P<fence>^[ \t]{0,3}(?P<marker>`{3,}|~{3,}).*?(?:^[ \t]{0,3}(?P=marker)[ \t]*$|\Z))"
+    r"|(?P<code>(?P<ticks>`+)(?:[^`\n]|\n(?![ \t]*\n)|(?!(?P=ticks))`)+?(?P=ticks))"
+    r"|(?P<math>\$\$.+?\$\$|\$(?=\S)(?:\\.|[^$\\\n])+?(?<=\S)\$(?!\d))"
+    r"|(?P<dollar>(?<!\\)\$)",
+    re.MULTILINE | re.DOTALL,
+)
+
+def prepare_markdown(content: str) -> str:
+    """
+    Turns raw agent output into the markdown we hand to st.markdown: dollar signs
+    outside code and math are escaped, so salary figures ("$120k - $150k") are not
+    typeset as LaTeX. Everything else is passed through as is.
+    """
+    if "$" not in content:
+        return content
+    return _MARKDOWN_DOLLARS.sub(lambda match: "\\$" if match.group("dollar") else match.group(0), content)
+
+def message_markdown(message: dict) -> str:
+    """
+    Prepared markdown for a stored message, cached by its ID.
+    """
+    message_id = message.get("id")
+    if message_id is None:
+        return prepare_markdown(message["content"])
+    cached = _markdown_cache.get(message_id)
+    if cached is None:
+        cached = prepare_markdown(message["content"])
+        _markdown_cache.set(message_id, cached)
+    return cached
+
+def render_message(message: dict, focused: bool = False):
+    with st.chat_message(message["role"]):
+        if focused:
+            # Anchor for _scroll_to() below
+            st.markdown(f'<div id="message-{message["id"]}"></div>', unsafe_allow_html=True)
+            st.caption("🔎 Search result")
+        st.markdown(message_markdown(message))
+
+def _scroll_to(message_id):
+    # Runs in a zero-height component iframe, which shares the app's origin
+    components.html(
+        f"""<script>
+        const target = window.parent.document.getElementById("message-{message_id}");
+        if (target) target.scrollIntoView({{block: "center"}});
+        </script>""",
+        height=0,
+    )
+
+@timed("render.history", "render")
+def render_message_history(session_id, messages, focus_id=None):
+    """
+    Renders the newest CHAT_RENDER_WINDOW messages in full and folds older ones into
+    groups of CHAT_RENDER_GROUP_SIZE that are only rendered once the user opens them.
+    With focus_id, the group holding that message is opened and scrolled to.
+    """
+    window = int(os.getenv("CHAT_RENDER_WINDOW", "20"))
+    group_size = int(os.getenv("CHAT_RENDER_GROUP_SIZE", "25"))
+    split = max(len(messages) - window, 0)
+    older, recent = messages[:split], messages[split:]
+
+    for start in range(0, len(older), group_size):
+        group = older[start:start + group_size]
+        key = f"history_group_{session_id}_{group[0]['id']}"
+        if focus_id and any(message["id"] == focus_id for message in group):
+            st.session_state[key] = True
+        # Collapsed groups send nothing but the toggle to the browser
+        if st.toggle(f"Messages {start + 1}-{start + len(group)}", key=key):
+            for message in group:
+                render_message(message, focused=message["id"] == focus_id)
+
+    for message in recent:
+        render_message(message, focused=message["id"] == focus_id)
+
+    if focus_id:
+        _scroll_to(focus_id)
@@ -0,0 +1,212 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import streamlit as st
+from app.limits import try_webhook_slot, release_webhook_slot
+from app.metrics import annotate, count_event
+from app.transport import post_json
+
+logger = logging.getLogger(__name__)
+
+class CircuitOpenError(Exception):
+    """Every configured webhook URL has its circuit breaker open."""
+
+class DeadlineExceeded(Exception):
+    """The turn's deadline passed before the agent answered."""
+
+def turn_deadline() -> float:
+    """A time.monotonic() deadline AGENT_TURN_DEADLINE seconds from now."""
+    return time.monotonic() + float(os.getenv("AGENT_TURN_DEADLINE", "90"))
+
+class CircuitBreaker:
+    """
+    Fails fast once a webhook keeps failing. Outcomes of the last `window` seconds are
+    kept; with at least `min_calls` of them and an error rate of `error_rate` or more,
+    the breaker opens and rejects calls for `cooldown` seconds. It then lets one probe
+    call through (half-open): a success closes it, a failure opens it again.
+    """
+
+    def __init__(self, error_rate: float, min_calls: int, window: float, cooldown: float):
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._outcomes = deque()  # (monotonic time, ok)
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self._opened_at >= self.cooldown else "open"
+
+    def allow(self):
+        """Returns "call" or "probe" if a call may go ahead, else None."""
+        with self._lock:
+            if self._opened_at is None:
+                return "call"
+            if self._probing or time.monotonic() - self._opened_at < self.cooldown:
+                return None
+            self._probing = True
+            return "probe"
+
+    def record(self, permit: str, ok: bool):
+        """Records the outcome of a call allowed with `permit`."""
+        with self._lock:
+            now = time.monotonic()
+            if permit == "probe":
+                self._probing = False
+                self._opened_at = None if ok else now
+                self._outcomes.clear()
+                return
+            if self._opened_at is not None:
+                # A call that started before the breaker opened
+                return
+            self._outcomes.append((now, ok))
+            while self._outcomes and now - self._outcomes[0][0] > self.window:
+                self._outcomes.popleft()
+            failures = sum(1 for _, outcome in self._outcomes if not outcome)
+            if len(self._outcomes) >= self.min_calls and failures >= self.error_rate * len(self._outcomes):
+                logger.warning("Circuit breaker open: %s of the last %s webhook calls failed", failures, len(self._outcomes))
+                count_event("n8n", "breaker_open")
+                self._opened_at = now
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(url: str) -> CircuitBreaker:
+    """The process-wide circuit breaker for a webhook URL."""
+    with _breakers_lock:
+        if url not in _breakers:
+            _breakers[url] = CircuitBreaker(
+                error_rate=float(os.getenv("N8N_BREAKER_ERROR_RATE", "0.5")),
+                min_calls=int(os.getenv("N8N_BREAKER_MIN_CALLS", "10")),
+                window=float(os.getenv("N8N_BREAKER_WINDOW", "60")),
+                cooldown=float(os.getenv("N8N_BREAKER_COOLDOWN", "30")),
+            )
+        return _breakers[url]
+
+# Recent successful primary response times (seconds), for the hedging delay
+_latencies = deque(maxlen=200)
+_latencies_lock = threading.Lock()
+
+def hedge_delay() -> float:
+    """
+    How long to wait for the primary webhook before also asking the hedge URL:
+    the p95 of recent primary response times, and N8N_HEDGE_DEFAULT_DELAY until
+    there are 20 of them. Never less than N8N_HEDGE_MIN_DELAY.
+    """
+    with _latencies_lock:
+        samples = sorted(_latencies)
+    floor = float(os.getenv("N8N_HEDGE_MIN_DELAY", "1"))
+    if len(samples) < 20:
+        return max(float(os.getenv("N8N_HEDGE_DEFAULT_DELAY", "15")), floor)
+    return max(samples[int(0.95 * (len(samples) - 1))], floor)
+
+@st.cache_resource(show_spinner=False)
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(
+        max_workers=2 * int(os.getenv("N8N_MAX_CONCURRENCY", "8")),
+        thread_name_prefix="webhook-hedge",
+    )
+
+def _attempt(url: str, permit: str, primary: bool, payload: dict, idempotency_key: str, headers: dict, stream: bool, deadline: float):
+    started = time.monotonic()
+    try:
+        response = post_json(url, payload, idempotency_key=idempotency_key, headers=headers, stream=stream, deadline=deadline)
+    except Exception:
+        get_breaker(url).record(permit, False)
+        raise
+    get_breaker(url).record(permit, True)
+    if primary:
+        with _latencies_lock:
+            _latencies.append(time.monotonic() - started)
+    return response
+
+def _close_unused(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+def post_webhook(payload: dict, idempotency_key: str, deadline: float, headers: dict = None, stream: bool = False):
+    """
+    POSTs to the agent webhook (N8N_WEBHOOK_URL) within `deadline`, behind a circuit breaker.
+
+    With N8N_HEDGE_WEBHOOK_URL set, the same request also goes there when the primary
+    has not answered after hedge_delay(), or at once when the primary fails or its
+    breaker is open; the first response wins and the other is closed. For streams,
+    "answered" means the response headers arrived. n8n ignores the Idempotency-Key, so
+    a hedged turn can run the workflow twice; point the hedge URL at a workflow that may.
+    A hedge takes a second webhook slot (app/limits.py) and is skipped when none is free,
+    so hedging never pushes n8n past N8N_MAX_CONCURRENCY.
+
+    Raises CircuitOpenError when no URL may be called, DeadlineExceeded when the deadline
+    passes first, and requests' exceptions when every attempt failed.
+    """
+    urls = [url for url in (os.getenv("N8N_WEBHOOK_URL"), os.getenv("N8N_HEDGE_WEBHOOK_URL")) if url]
+    if len(urls) == 1:
+        # Nothing to hedge with: call on this thread
+        permit = get_breaker(urls[0]).allow()
+        if permit is None:
+            annotate(breaker_open=True)
+            raise CircuitOpenError("the agent webhook is failing; calls are paused")
+        return _attempt(urls[0], permit, True, payload, idempotency_key, headers, stream, deadline)
+
+    pending, started, last_error = set(), 0, None
+    executor = _get_hedge_executor()
+
+    def start_next():
+        # Starts the next URL whose breaker lets a call through; False if there is none
+        nonlocal started
+        while started < len(urls):
+            url, primary = urls[started], started == 0
+            started += 1
+            # The caller's slot covers the primary call only; a hedge needs one of its own
+            if not primary and not try_webhook_slot():
+                annotate(hedge_skipped=True)
+                return False
+            permit = get_breaker(url).allow()
+            if permit is None:
+                annotate(**{"breaker_open" if primary else "hedge_breaker_open": True})
+                if not primary:
+                    release_webhook_slot()
+                continue
+            future = executor.submit(_attempt, url, permit, primary, payload, idempotency_key, headers, stream, deadline)
+            if not primary:
+                annotate(hedged=True)
+                future.add_done_callback(lambda _: release_webhook_slot())
+            pending.add(future)
+            return True
+        return False
+
+    if not start_next():
+        raise CircuitOpenError("the agent webhook is failing; calls are paused")
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded("no reply before the deadline")
+            can_hedge = started < len(urls)
+            done, _ = wait(pending, timeout=min(hedge_delay(), remaining) if can_hedge else remaining, return_when=FIRST_COMPLETED)
+            if not done:
+                if can_hedge:
+                    start_next()
+                continue
+            for future in done:
+                pending.discard(future)
+                if future.exception() is None:
+                    return future.result()
+                last_error = future.exception()
+            if not pending and not start_next():
+                break
+    finally:
+        for future in pending:
+            future.add_done_callback(_close_unused)
+    if last_error is None:
+        raise CircuitOpenError("the agent webhook is failing; calls are paused")
+    raise last_error
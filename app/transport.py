@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import random
+from email.utils import parsedate_to_datetime
+import streamlit as st
+from app.metrics import record_http
+
+# requests is imported on first use, keeping it off the app's cold-start path.
+
+# Status codes worth retrying, when they come with Retry-After: the request was turned
+# away before the workflow ran. 502/504 are not among them, as the workflow may have run.
+RETRY_STATUS_CODES = {429, 503}
+
+def _timeouts(deadline: float = None):
+    """
+    (connect, read) timeouts in seconds. The read timeout bounds the gap
+    between bytes, so a hung n8n worker can no longer pin a script thread.
+    Neither reaches past `deadline` (a time.monotonic() timestamp).
+    """
+    connect = float(os.getenv("N8N_CONNECT_TIMEOUT", "5"))
+    read = float(os.getenv("N8N_READ_TIMEOUT", "120"))
+    if deadline is None:
+        return connect, read
+    remaining = deadline - time.monotonic()
+    return min(connect, remaining), min(read, remaining)
+
+@st.cache_resource(show_spinner=False)
+def get_http_session():
+    """
+    One keep-alive requests.Session for the whole process.
+    Its connection pool is sized by N8N_POOL_MAXSIZE; retries are handled
+    by post_json() so they can be made idempotency-aware.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    pool_size = int(os.getenv("N8N_POOL_MAXSIZE", "10"))
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def _backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter, capped at N8N_RETRY_MAX_DELAY."""
+    base = float(os.getenv("N8N_RETRY_BACKOFF", "0.5"))
+    cap = float(os.getenv("N8N_RETRY_MAX_DELAY", "8"))
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+def _retry_after(response) -> float:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date), or None."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+def _never_sent(error) -> bool:
+    """
+    Whether a failed request cannot have reached the server: connect timeouts and
+    refused or unresolvable connections. Anything else may have started a run.
+    """
+    import requests
+    from urllib3.exceptions import NewConnectionError
+
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(error, requests.exceptions.ConnectionError) and isinstance(reason, NewConnectionError)
+
+def post_json(url: str, payload: dict, idempotency_key: str = None, headers: dict = None, stream: bool = False, deadline: float = None):
+    """
+    POSTs JSON through the shared session with bounded timeouts and jittered retries.
+    With `deadline` (a time.monotonic() timestamp), timeouts are cut to the time left
+    and no retry is started that could not finish its backoff before it.
+
+    Only requests the workflow cannot have run are retried: connect timeouts, refused
+    connections, and 429/503 answers that carry Retry-After (waited for, up to
+    N8N_RETRY_MAX_DELAY). Read timeouts and dropped connections are never retried:
+    n8n does not deduplicate, so a retry would run the agent (and its tools) twice.
+    `idempotency_key` is still sent as `Idempotency-Key`, for receivers that honour it.
+    Raises requests.exceptions.RequestException once retries are exhausted.
+    """
+    import requests
+
+    max_retries = int(os.getenv("N8N_MAX_RETRIES", "2"))
+    max_delay = float(os.getenv("N8N_RETRY_MAX_DELAY", "8"))
+    request_headers = dict(headers or {})
+    if idempotency_key:
+        request_headers["Idempotency-Key"] = idempotency_key
+
+    session = get_http_session()
+    request_bytes = len(json.dumps(payload))
+    attempt = 0
+    while True:
+        if deadline is not None and deadline <= time.monotonic():
+            raise requests.exceptions.Timeout("deadline exceeded before the request was sent")
+        delay = _backoff_delay(attempt)
+        started = time.perf_counter()
+        try:
+            response = session.post(url, json=payload, headers=request_headers, timeout=_timeouts(deadline), stream=stream)
+            # Streamed bodies are still unread here; Content-Length is all we know of their size
+            record_http("n8n", time.perf_counter() - started, response.status_code, request_bytes,
+                        int(response.headers.get("Content-Length") or 0), retry=attempt > 0)
+            retry_after = _retry_after(response) if response.status_code in RETRY_STATUS_CODES else None
+            if retry_after is not None and retry_after <= max_delay and _may_retry(attempt, max_retries, retry_after, deadline):
+                response.close()
+                delay = retry_after
+            else:
+                response.raise_for_status()
+                return response
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            record_http("n8n", time.perf_counter() - started, request_bytes=request_bytes, retry=attempt > 0, error=type(e).__name__)
+            if not _never_sent(e) or not _may_retry(attempt, max_retries, delay, deadline):
+                raise
+
+        time.sleep(delay)
+        attempt += 1
+
+def _may_retry(attempt: int, max_retries: int, delay: float, deadline: float = None) -> bool:
+    return attempt < max_retries and (deadline is None or time.monotonic() + delay < deadline)
@@ -1,194 +1,192 @@
 import os
-import requests
+import re
+import time
+import json
+import hashlib
+import functools
 import streamlit as st
-from dotenv import load_dotenv
+from app.cache import PromptCache
+from app.config import load_env
+from app.metrics import span, annotate, mark_error
+from app.limits import webhook_slot
+from app.resilience import CircuitOpenError, DeadlineExceeded, post_webhook, turn_deadline
 
-load_dotenv()
+load_env()
+
+STYLESHEET_PATH = os.path.join(os.path.dirname(__file__), "style.css")
+
+@functools.lru_cache(maxsize=None)
+def _stylesheet_html() -> str:
+    """
+    Reads app/style.css once per process, strips comments and redundant whitespace,
+    and tags it with a content fingerprint so every rerun emits byte-identical markup.
+    """
+    with open(STYLESHEET_PATH, encoding="utf-8") as f:
+        css = f.read()
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};])\s*", r"\1", css).strip()
+    fingerprint = hashlib.sha256(css.encode("utf-8")).hexdigest()[:12]
+    return f'<style id="app-style-{fingerprint}">{css}</style>'
 
 def load_css():
     """
     Injects custom CSS for a premium, 'Slate Minimal' professional feel.
     """
-    st.markdown("""
-        <style>
-        @import url('https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600&display=swap');
+    st.markdown(_stylesheet_html(), unsafe_allow_html=True)
 
-        /* Force Light Mode Colors for Consistency */
-        :root {
-            --background-color: #f8fafc; /* Slate-50 */
-            --text-color: #334155; /* Slate-700 */
-            --card-bg: #ffffff;
-            --border-color: #e2e8f0;
-        }
-
-        /* General App Styling */
-        .stApp {
-            background-color: var(--background-color);
-            color: var(--text-color);
-            font-family: 'Inter', sans-serif;
-        }
-        
-        /* Force text color on all elements to avoid Dark Mode conflicts */
-        .stApp p, .stApp div, .stApp span, .stApp h1, .stApp h2, .stApp h3 {
-            color: var(--text-color) !important;
-        }
-
-        /* Hide Streamlit Branding but keep Sidebar Toggle */
-        #MainMenu {visibility: hidden;}
-        footer {visibility: hidden;}
-        header {
-            visibility: visible !important;
-            background-color: transparent !important;
-        }
-        [data-testid="stHeader"] {
-            background-color: transparent !important;
-            z-index: 1;
-        }
-        
-        /* Chat Input Styling */
-        .stChatInputContainer {
-            padding-bottom: 2rem;
-            background-color: transparent;
-        }
-        
-        .stChatInputContainer textarea {
-            background-color: #ffffff !important;
-            border: 1px solid #cbd5e1 !important;
-            color: #334155 !important;
-            border-radius: 12px;
-            box-shadow: 0 4px 6px -1px rgba(0, 0, 0, 0.05);
-        }
-        
-        /* Chat Message Styling - Unified Card Style */
-        .stChatMessage {
-            background-color: var(--card-bg) !important;
-            border: 1px solid var(--border-color);
-            border-radius: 12px;
-            padding: 1.5rem;
-            margin-bottom: 1rem;
-            box-shadow: 0 1px 3px rgba(0,0,0,0.05);
-        }
+def is_streaming_enabled() -> bool:
+    """
+    Whether the n8n webhook is configured with "Response Mode: Streaming".
+    """
+    return os.getenv("N8N_STREAMING", "false").lower() in ("1", "true", "yes")
 
-        /* Avatar Styling */
-        .stChatMessage .stAvatar {
-            background-color: #f1f5f9; /* Slate-100 */
-            border: 1px solid #e2e8f0;
-        }
-        
-        /* Spinner */
-        .stSpinner > div {
-            border-top-color: #334155 !important;
-        }
+def _error_reply(meta: dict, text: str) -> str:
+    """
+    Returns `text`, shown in place of (or after part of) a reply, and flags the reply
+    as failed in `meta["error"]` so it is neither cached nor stored as a message.
+    """
+    if meta is not None:
+        meta["error"] = True
+    return text
 
-        /* Buttons */
-        .stButton button {
-            background: linear-gradient(to right, #4f46e5, #7c3aed);
-            color: white;
-            border: none;
-            border-radius: 8px;
-            font-weight: 600;
-            transition: all 0.2s;
-        }
+def _iter_reply_chunks(lines, content_type: str = "", meta: dict = None):
+    """
+    Extracts reply text from a webhook body, one line (or SSE event) at a time.
+    Understands n8n's streaming NDJSON events ({"type": "item", "content": ...}),
+    Server-Sent Events carrying the same payloads, and the buffered {"reply": ...} JSON.
+    A "title" field on any event is stored in `meta`, if given, and errors are flagged there.
+    """
+    is_sse = "text/event-stream" in content_type
+    unparsed = []
+    yielded = False
 
-        .stButton button:hover {
-            transform: translateY(-1px);
-            box-shadow: 0 4px 12px rgba(79, 70, 229, 0.3);
-        }
+    for line in lines:
+        if not line:
+            continue
+        if is_sse:
+            if not line.startswith("data:"):
+                continue
+            line = line[5:].strip()
+            if line == "[DONE]":
+                break
 
-        /* Sidebar Buttons (Session List) */
-        [data-testid="stSidebar"] .stButton button {
-            background: transparent;
-            border: none; /* Remove border for cleaner look */
-            text-align: left;
-            justify-content: flex-start;
-            padding-left: 0.5rem;
-            font-weight: 400;
-            color: #cbd5e1;
-            transition: background-color 0.2s, color 0.2s;
-        }
+        try:
+            event = json.loads(line)
+        except ValueError:
+            if is_sse:
+                yielded = True
+                yield line
+            else:
+                unparsed.append(line)
+            continue
 
-        [data-testid="stSidebar"] .stButton button:hover {
-            background: rgba(255, 255, 255, 0.05);
-            color: white;
-        }
+        if not isinstance(event, dict):
+            unparsed.append(line)
+            continue
+        if meta is not None and event.get("title"):
+            meta["title"] = event["title"]
+        if event.get("type") == "item" and event.get("content"):
+            yielded = True
+            yield event["content"]
+        elif event.get("type") == "error":
+            yielded = True
+            yield _error_reply(meta, f"Error communicating with agent: {event.get('content', 'stream error')}")
+        elif "reply" in event:
+            yielded = True
+            yield event["reply"]
 
-        [data-testid="stSidebar"] .stButton button:focus {
-            color: #818cf8;
-        }
+    # Lines that were not standalone JSON are most likely a pretty-printed buffered body
+    if unparsed:
+        body = "\n".join(unparsed)
+        try:
+            data = json.loads(body)
+            if isinstance(data, dict) and "reply" in data:
+                if meta is not None and data.get("title"):
+                    meta["title"] = data["title"]
+                yield data["reply"]
+                return
+        except ValueError:
+            pass
+        yield body
+    elif not yielded:
+        yield _error_reply(meta, "No reply received from agent.")
 
-        /* Sidebar Column Spacing */
-        [data-testid="stSidebar"] [data-testid="column"] {
-            padding-left: 0 !important;
-            padding-right: 0 !important;
-            gap: 0 !important;
-        }
-
-        /* Compact Action Buttons (Edit/Delete) */
-        [data-testid="stSidebar"] [data-testid="column"]:nth-child(2) button,
-        [data-testid="stSidebar"] [data-testid="column"]:nth-child(3) button {
-            padding: 0px 4px !important; /* Minimal padding */
-            border: none;
-            background: transparent;
-            color: #64748b; /* Muted color */
-            min-height: auto;
-            height: 36px; /* Match row height */
-            line-height: 1;
-        }
+@st.cache_resource(show_spinner=False)
+def _get_response_cache():
+    """
+    The opt-in process-wide cache of agent replies, or None when AGENT_CACHE_ENABLED is off.
+    """
+    if os.getenv("AGENT_CACHE_ENABLED", "false").lower() not in ("1", "true", "yes"):
+        return None
+    similarity = os.getenv("AGENT_CACHE_SIMILARITY")
+    return PromptCache(
+        max_entries=int(os.getenv("AGENT_CACHE_MAX_ENTRIES", "1024")),
+        ttl=float(os.getenv("AGENT_CACHE_TTL", "3600")),
+        similarity=float(similarity) if similarity else None,
+    )
 
-        [data-testid="stSidebar"] [data-testid="column"]:nth-child(2) button:hover,
-        [data-testid="stSidebar"] [data-testid="column"]:nth-child(3) button:hover {
-            color: #f8fafc;
-            background: rgba(255, 255, 255, 0.1);
-        }
-        
-        /* Tabs */
-        .stTabs [data-baseweb="tab-list"] {
-            gap: 8px;
-            background-color: rgba(30, 41, 59, 0.5);
-            padding: 4px;
-            border-radius: 8px;
-        }
+def get_response_cache_stats() -> dict:
+    cache = _get_response_cache()
+    return cache.stats() if cache is not None else {}
 
-        .stTabs [data-baseweb="tab"] {
-            height: 40px;
-            border-radius: 6px;
-            color: #94a3b8;
-        }
+# Returned instead of calling n8n when all N8N_MAX_CONCURRENCY webhook slots stay taken
+AGENT_BUSY_REPLY = "Error: the assistant is busy right now. Please try again in a moment."
+# Returned without calling n8n while its circuit breaker is open (app/resilience.py)
+AGENT_UNAVAILABLE_REPLY = "Error: the assistant is temporarily unavailable. Please try again in a moment."
 
-        .stTabs [aria-selected="true"] {
-            background-color: rgba(79, 70, 229, 0.2);
-            color: #818cf8;
-        }
+def _lookup_cached_reply(cache, message: str, meta: dict = None):
+    cached = cache.lookup(message)
+    if cached is not None and meta is not None and cached.get("title"):
+        meta["title"] = cached["title"]
+    return cached["reply"] if cached is not None else None
 
-        /* Mobile Responsiveness */
-        @media (max-width: 768px) {
-            /* Increase touch targets for sidebar buttons */
-            [data-testid="stSidebar"] [data-testid="column"] button {
-                padding: 0.5rem 0.75rem !important; /* Larger padding */
-                min-height: 44px; /* Minimum touch target size */
-            }
-            
-            /* Stack sidebar columns if needed, or just give them more breathing room */
-            [data-testid="stSidebar"] [data-testid="column"] {
-                margin-bottom: 0.25rem;
-            }
-
-            /* Adjust main chat padding */
-            .stChatMessage {
-                padding: 1rem;
-            }
-        }
-        </style>
-    """, unsafe_allow_html=True)
+def _store_cached_reply(cache, message: str, reply: str, meta: dict):
+    if reply and not meta.get("error"):
+        cache.store(message, {"reply": reply, "title": meta.get("title")})
 
-def invoke_n8n_webhook(message: str, session_id: str) -> str:
+def invoke_n8n_webhook(message: str, session_id: str, request_title: bool = False, meta: dict = None, cacheable: bool = False, deadline: float = None) -> str:
     """
     Sends the user message to the n8n webhook and returns the response.
     Includes sessionId for conversation memory.
+    With request_title, asks the workflow to also return a session title,
+    which is stored in `meta["title"]` when the response carries one.
+    With cacheable (only for messages that do not depend on earlier context),
+    replies may be served from and stored in the opt-in response cache.
+    The call ends by `deadline` (a time.monotonic() timestamp; AGENT_TURN_DEADLINE
+    seconds from now by default). When what is returned is an error message rather
+    than a reply, `meta["error"]` is set.
     """
+    meta = {} if meta is None else meta
+    deadline = deadline or turn_deadline()
+    with span("n8n.invoke", "n8n", prompt_chars=len(message)):
+        cache = _get_response_cache() if cacheable else None
+        if cache is not None:
+            reply = _lookup_cached_reply(cache, message, meta)
+            annotate(cache="hit" if reply is not None else "miss")
+            if reply is not None:
+                return reply
+            reply = _capped_invoke_n8n_webhook(message, session_id, request_title, meta, deadline)
+            _store_cached_reply(cache, message, reply, meta)
+        else:
+            reply = _capped_invoke_n8n_webhook(message, session_id, request_title, meta, deadline)
+        annotate(reply_chars=len(reply))
+        if meta.get("error"):
+            mark_error()
+        return reply
+
+def _capped_invoke_n8n_webhook(message: str, session_id: str, request_title: bool, meta: dict, deadline: float) -> str:
+    with webhook_slot() as acquired:
+        if not acquired:
+            return _error_reply(meta, AGENT_BUSY_REPLY)
+        return _invoke_n8n_webhook(message, session_id, request_title, meta, deadline)
+
+def _invoke_n8n_webhook(message: str, session_id: str, request_title: bool, meta: dict, deadline: float) -> str:
+    import requests
+
     webhook_url = os.getenv("N8N_WEBHOOK_URL")
     if not webhook_url:
-        return "Error: N8N_WEBHOOK_URL not configured."
+        return _error_reply(meta, "Error: N8N_WEBHOOK_URL not configured.")
 
     try:
         # Payload with message and session ID as requested
@@ -199,18 +197,99 @@ def invoke_n8n_webhook(message: str, session_id: str) -> str:
             "sessionId": session_id,
             "messageId": str(uuid.uuid4())
         }
+        if request_title:
+            payload["generateTitle"] = True
         
-        response = requests.post(webhook_url, json=payload)
-        response.raise_for_status()
+        response = post_webhook(payload, payload["messageId"], deadline)
         
         # Parse response
-        data = response.json()
+        try:
+            data = response.json()
+        except ValueError:
+            # A workflow in streaming mode answers with NDJSON even when we read it all at once
+            return "".join(_iter_reply_chunks(response.text.splitlines(), response.headers.get("Content-Type", ""), meta))
         
         # The user's workflow "Respond to Webhook" node sends:
         # { "reply": "{{ $json.output }}" }
-        return data.get("reply", "No reply received from agent.")
+        # and, when asked for one, { "reply": ..., "title": ... }
+        if data.get("title"):
+            meta["title"] = data["title"]
+        if "reply" not in data:
+            return _error_reply(meta, "No reply received from agent.")
+        return data["reply"]
+
+    except CircuitOpenError:
+        return _error_reply(meta, AGENT_UNAVAILABLE_REPLY)
+    except (DeadlineExceeded, requests.exceptions.RequestException) as e:
+        return _error_reply(meta, f"Error communicating with agent: {e}")
+    except Exception as e:
+        return _error_reply(meta, f"An unexpected error occurred: {e}")
+
+def stream_n8n_webhook(message: str, session_id: str, request_title: bool = False, meta: dict = None, cacheable: bool = False, deadline: float = None):
+    """
+    Sends the user message to the n8n webhook and yields the reply as it is generated.
+    Meant for st.write_stream; the joined chunks equal what invoke_n8n_webhook would return.
+    request_title, meta, cacheable and deadline behave as in invoke_n8n_webhook; a stream
+    still running at the deadline ends with an error message.
+    """
+    meta = {} if meta is None else meta
+    deadline = deadline or turn_deadline()
+    with span("n8n.stream", "n8n", prompt_chars=len(message)):
+        cache = _get_response_cache() if cacheable else None
+        if cache is not None:
+            reply = _lookup_cached_reply(cache, message, meta)
+            annotate(cache="hit" if reply is not None else "miss")
+            if reply is not None:
+                yield reply
+                return
+        chunks = []
+        # The slot is held until the stream ends, since n8n is busy until then
+        with webhook_slot() as acquired:
+            for chunk in _stream_n8n_webhook(message, session_id, request_title, meta, deadline) if acquired else [_error_reply(meta, AGENT_BUSY_REPLY)]:
+                chunks.append(chunk)
+                yield chunk
+        reply = "".join(chunks)
+        annotate(reply_chars=len(reply))
+        if meta.get("error"):
+            mark_error()
+        elif cache is not None:
+            _store_cached_reply(cache, message, reply, meta)
+
+def _until(lines, deadline: float):
+    for line in lines:
+        if time.monotonic() > deadline:
+            raise DeadlineExceeded("reply not finished before the deadline")
+        yield line
+
+def _stream_n8n_webhook(message: str, session_id: str, request_title: bool, meta: dict, deadline: float):
+    import requests
+
+    webhook_url = os.getenv("N8N_WEBHOOK_URL")
+    if not webhook_url:
+        yield _error_reply(meta, "Error: N8N_WEBHOOK_URL not configured.")
+        return
+
+    try:
+        import uuid
+        payload = {
+            "message": message,
+            "sessionId": session_id,
+            "messageId": str(uuid.uuid4())
+        }
+        if request_title:
+            payload["generateTitle"] = True
+
+        headers = {"Accept": "application/x-ndjson, text/event-stream, application/json"}
+        with post_webhook(payload, payload["messageId"], deadline, headers=headers, stream=True) as response:
+            # n8n does not always send a charset; its output is UTF-8
+            if response.encoding is None or response.encoding.lower() == "iso-8859-1":
+                response.encoding = "utf-8"
+            lines = _until(response.iter_lines(decode_unicode=True), deadline)
+            yield from _iter_reply_chunks(lines, response.headers.get("Content-Type", ""), meta)
 
-    except requests.exceptions.RequestException as e:
-        return f"Error communicating with agent: {e}"
+    except CircuitOpenError:
+        yield _error_reply(meta, AGENT_UNAVAILABLE_REPLY)
+    except (DeadlineExceeded, requests.exceptions.RequestException) as e:
+        yield _error_reply(meta, f"Error communicating with agent: {e}")
     except Exception as e:
-        return f"An unexpected error occurred: {e}"
+        yield _error_reply(meta, f"An unexpected error occurred: {e}")
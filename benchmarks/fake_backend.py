@@ -0,0 +1,549 @@
+"""
+Local stand-ins for the services the app talks to, for benchmarks.
+
+One threaded HTTP server answers:
+  * /auth/v1/*  like GoTrue (password sign-in, token refresh, logout);
+  * /rest/v1/*  like PostgREST, for the profiles, chat_sessions and chat_messages
+    tables and the append_exchange, append_messages and search_messages RPCs, with just enough of the query syntax
+    (select, eq, order, limit, the keyset `or` filter, single) for app/auth.py;
+  * /webhook/*  like the n8n chat workflow ({"reply": ...}, plus "title" when asked);
+  * /realtime/v1/websocket  like Supabase Realtime: Phoenix channels (join, heartbeat,
+    access_token) whose postgres_changes bindings receive every insert, update and delete
+    made through the routes above or insert(), with `col=eq.value` filters honored.
+
+Every request is counted per service and per route, and each service can be given
+an injected latency, so reruns can be timed and their outbound calls counted
+without any network. Data lives in memory and is reset with seed().
+"""
+import base64
+import hashlib
+import json
+import struct
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+USER_ID = "00000000-0000-4000-8000-000000000001"
+USER_EMAIL = "bench@example.com"
+
+def _b64(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+def make_jwt(claims: dict) -> str:
+    """An unsigned JWT; the app only reads `exp` from it."""
+    return f"{_b64({'alg': 'HS256', 'typ': 'JWT'})}.{_b64(claims)}.c2lnbmF0dXJl"
+
+# Shaped like a Supabase anon key, for SUPABASE_KEY
+ANON_KEY = make_jwt({"role": "anon", "iss": "supabase"})
+
+def _timestamp(moment: datetime) -> str:
+    # Fixed-width, so string order is time order (as with timestamptz in Postgres)
+    return moment.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+class FakeBackend:
+    """
+    Owns the server thread, the in-memory tables and the request counters.
+    Latencies are in seconds and can be changed between scenarios.
+    """
+
+    def __init__(self, supabase_latency: float = 0.0, n8n_latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.latency = {"supabase": supabase_latency, "n8n": n8n_latency}
+        self._lock = threading.Lock()
+        self.calls = Counter()
+        self.routes = Counter()
+        self._realtime_connections = set()
+        self._realtime_lock = threading.Lock()
+        self.seed()
+        backend = self
+
+        class Handler(_Handler):
+            pass
+        Handler.backend = backend
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-backend", daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def env(self) -> dict:
+        """Environment variables pointing the app at this backend."""
+        return {
+            "SUPABASE_URL": self.url,
+            "SUPABASE_KEY": ANON_KEY,
+            "N8N_WEBHOOK_URL": f"{self.url}/webhook/bench",
+        }
+
+    # Data
+
+    def seed(self, sessions: int = 0, messages_per_session: int = 0, profile: bool = True):
+        """Resets all tables: one user, `sessions` chats with `messages_per_session` messages each."""
+        with self._lock:
+            self._clock = datetime(2026, 1, 1, tzinfo=timezone.utc)
+            self.tables = {"profiles": [], "chat_sessions": [], "chat_messages": []}
+            if profile:
+                self.tables["profiles"].append({"id": USER_ID, "full_name": "Bench User"})
+            for i in range(sessions):
+                session = self._insert_locked("chat_sessions", {"user_id": USER_ID, "title": f"Chat {i + 1}"})
+                for j in range(messages_per_session):
+                    self._insert_locked("chat_messages", {
+                        "session_id": session["id"],
+                        "role": "user" if j % 2 == 0 else "assistant",
+                        "content": f"Message {j + 1} about **salaries** ($120k) and interviews.\n\n- point one\n- point two",
+                    })
+
+    def sessions(self) -> list:
+        """The seeded user's sessions, newest first."""
+        with self._lock:
+            rows = [row for row in self.tables["chat_sessions"] if row["user_id"] == USER_ID]
+        return sorted(rows, key=lambda row: (row["created_at"], row["id"]), reverse=True)
+
+    def insert(self, table: str, values: dict) -> dict:
+        """Inserts a row as another client would (e.g. the same user on another device)."""
+        with self._lock:
+            return dict(self._insert_locked(table, values))
+
+    def update(self, table: str, row_id, values: dict) -> dict:
+        """Updates a row as another client would (e.g. deleting a chat on another device)."""
+        with self._lock:
+            row = next(row for row in self.tables[table] if row["id"] == row_id)
+            row.update(values)
+            self._publish(table, "UPDATE", row)
+            return dict(row)
+
+    def _now(self) -> str:
+        # A strictly increasing clock keeps keyset order deterministic
+        self._clock += timedelta(microseconds=1)
+        return _timestamp(self._clock)
+
+    def _insert_locked(self, table: str, values: dict) -> dict:
+        row = dict(values)
+        row.setdefault("id", str(uuid.uuid4()))
+        if table != "profiles":
+            row.setdefault("created_at", self._now())
+        if table == "chat_messages":
+            session = next(s for s in self.tables["chat_sessions"] if s["id"] == row["session_id"])
+            row.setdefault("user_id", session["user_id"])
+        self.tables[table].append(row)
+        self._publish(table, "INSERT", row)
+        return row
+
+    def _publish(self, table: str, change_type: str, record: dict = None, old_record: dict = None):
+        """Sends a change to the Realtime channels subscribed to it."""
+        with self._realtime_lock:
+            connections = list(self._realtime_connections)
+        for connection in connections:
+            connection.publish(table, change_type, dict(record or {}), dict(old_record or {}))
+
+    # Counters
+
+    def reset_counts(self):
+        with self._lock:
+            self.calls.clear()
+            self.routes.clear()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"calls": dict(self.calls), "routes": dict(self.routes)}
+
+    def _count(self, service: str, route: str):
+        with self._lock:
+            self.calls[service] += 1
+            self.routes[route] += 1
+
+class _Handler(BaseHTTPRequestHandler):
+    backend: FakeBackend = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if urlsplit(self.path).path == "/realtime/v1/websocket" and self.headers.get("Upgrade", "").lower() == "websocket":
+            return self._realtime()
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+    def _dispatch(self, method):
+        parts = urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        body = json.loads(raw) if raw else None
+        query = parse_qsl(parts.query, keep_blank_values=True)
+
+        if parts.path.startswith("/webhook/"):
+            service, route = "n8n", f"{method} /webhook"
+        elif parts.path.startswith("/auth/v1/"):
+            service, route = "supabase", f"{method} {parts.path}"
+        elif parts.path.startswith("/rest/v1/"):
+            service, route = "supabase", f"{method} {parts.path}"
+        else:
+            return self._send(404, {"message": "not found"})
+
+        self.backend._count(service, route)
+        time.sleep(self.backend.latency[service])
+        try:
+            if service == "n8n":
+                status, payload = _webhook(body or {})
+            elif parts.path.startswith("/auth/v1/"):
+                status, payload = _gotrue(parts.path[len("/auth/v1/"):], dict(query), body or {})
+            else:
+                status, payload = _postgrest(self.backend, method, parts.path[len("/rest/v1/"):], query, body, self.headers)
+        except Exception as e:
+            status, payload = 500, {"message": str(e)}
+        self._send(status, payload)
+
+    def _realtime(self):
+        accept = base64.b64encode(hashlib.sha1((self.headers["Sec-WebSocket-Key"] + _WS_GUID).encode()).digest()).decode()
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept)
+        self.end_headers()
+        self.wfile.flush()
+        self.backend._count("supabase", "WS /realtime/v1/websocket")
+        self.close_connection = True
+
+        connection = _RealtimeConnection(self.rfile, self.wfile)
+        with self.backend._realtime_lock:
+            self.backend._realtime_connections.add(connection)
+        try:
+            connection.serve()
+        finally:
+            with self.backend._realtime_lock:
+                self.backend._realtime_connections.discard(connection)
+
+    def _send(self, status, payload):
+        data = b"" if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        if payload is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+class _RealtimeConnection:
+    """One websocket client of the Realtime stand-in: frames, Phoenix messages and bindings."""
+
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+        self._send_lock = threading.Lock()
+        self.channels = {}  # topic -> [(binding ID, postgres_changes binding)]
+
+    def _read_frame(self):
+        header = self.rfile.read(2)
+        if len(header) < 2:
+            return None, None
+        opcode, length = header[0] & 0x0F, header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self.rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self.rfile.read(8))[0]
+        mask = self.rfile.read(4) if header[1] & 0x80 else b"\0\0\0\0"
+        data = bytes(byte ^ mask[i % 4] for i, byte in enumerate(self.rfile.read(length)))
+        return opcode, data
+
+    def _write_frame(self, opcode: int, data: bytes):
+        length = len(data)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        with self._send_lock:
+            self.wfile.write(header + data)
+            self.wfile.flush()
+
+    def send(self, message: dict):
+        try:
+            self._write_frame(0x1, json.dumps(message).encode())
+        except OSError:
+            pass
+
+    def serve(self):
+        while True:
+            opcode, data = self._read_frame()
+            if opcode is None or opcode == 0x8:
+                return
+            if opcode == 0x9:
+                self._write_frame(0xA, data)
+            elif opcode == 0x1:
+                self._handle(json.loads(data))
+
+    def _handle(self, message: dict):
+        topic, event, ref = message.get("topic"), message.get("event"), message.get("ref")
+        response = {}
+        if event == "phx_join":
+            bindings = (message.get("payload") or {}).get("config", {}).get("postgres_changes", [])
+            self.channels[topic] = list(enumerate(bindings, 1))
+            response = {"postgres_changes": [{"id": binding_id, **binding} for binding_id, binding in self.channels[topic]]}
+        elif event == "phx_leave":
+            self.channels.pop(topic, None)
+        self.send({"topic": topic, "event": "phx_reply", "payload": {"status": "ok", "response": response}, "ref": ref})
+        if event == "phx_join" and self.channels[topic]:
+            # Like Realtime, confirm the postgres_changes subscription after the join reply
+            self.send({"topic": topic, "event": "system", "ref": None, "payload": {
+                "channel": topic.partition(":")[2], "extension": "postgres_changes",
+                "message": "Subscribed to PostgreSQL", "status": "ok",
+            }})
+
+    def publish(self, table: str, change_type: str, record: dict, old_record: dict):
+        for topic, bindings in list(self.channels.items()):
+            ids = [binding_id for binding_id, binding in bindings if _binding_matches(binding, table, change_type, record)]
+            if ids:
+                self.send({"topic": topic, "event": "postgres_changes", "ref": None, "payload": {"ids": ids, "data": {
+                    "schema": "public", "table": table, "type": change_type,
+                    "commit_timestamp": _timestamp(datetime.now(timezone.utc)),
+                    "record": record, "old_record": old_record, "columns": [], "errors": None,
+                }}})
+
+def _binding_matches(binding: dict, table: str, change_type: str, record: dict) -> bool:
+    if binding.get("table") != table or binding.get("event") not in ("*", change_type):
+        return False
+    if not binding.get("filter"):
+        return True
+    # Like Realtime, filtered bindings never receive deletes
+    column, _, value = binding["filter"].partition("=eq.")
+    return change_type != "DELETE" and str(record.get(column)) == value
+
+def _webhook(body):
+    reply = {"reply": f"Here is what I know about: {body.get('message', '')[:80]}"}
+    if body.get("generateTitle"):
+        reply["title"] = "Benchmark Chat"
+    return 200, reply
+
+def session_payload() -> dict:
+    """A GoTrue session response for the seeded user, valid for an hour."""
+    now = int(time.time())
+    user = {
+        "id": USER_ID,
+        "aud": "authenticated",
+        "role": "authenticated",
+        "email": USER_EMAIL,
+        "app_metadata": {"provider": "email"},
+        "user_metadata": {},
+        "created_at": "2026-01-01T00:00:00Z",
+    }
+    return {
+        "access_token": make_jwt({"sub": USER_ID, "role": "authenticated", "exp": now + 3600}),
+        "refresh_token": uuid.uuid4().hex,
+        "token_type": "bearer",
+        "expires_in": 3600,
+        "expires_at": now + 3600,
+        "user": user,
+    }
+
+def _gotrue(path, query, body):
+    if path == "token" and query.get("grant_type") in ("password", "refresh_token"):
+        return 200, session_payload()
+    if path == "logout":
+        return 204, None
+    if path == "signup":
+        return 200, session_payload()
+    return 404, {"msg": f"unsupported auth route {path}"}
+
+_FILTER = re.compile(r"^(eq|neq|lt|gt|lte|gte|is|in)\.(.*)$")
+_KEYSET = re.compile(r'created_at\.(lt|gt)\."([^"]+)",and\(created_at\.eq\."[^"]+",id\.(?:lt|gt)\.([^)]+)\)')
+
+def _compare(op, left, right):
+    return {
+        "eq": left == right, "neq": left != right,
+        "lt": left < right, "gt": left > right,
+        "lte": left <= right, "gte": left >= right,
+    }[op]
+
+def _select(rows, query):
+    """Applies filters, order and limit from PostgREST query parameters."""
+    order, limit = None, None
+    for key, value in query:
+        if key in ("select", "columns", "on_conflict"):
+            continue
+        if key == "order":
+            order = [term.split(".") for term in value.split(",")]
+        elif key == "limit":
+            limit = int(value)
+        elif key == "or":
+            match = _KEYSET.search(value)
+            if not match:
+                raise ValueError(f"unsupported or filter {value}")
+            op, created_at, row_id = match.groups()
+            rows = [row for row in rows if _compare(op, (row["created_at"], row["id"]), (created_at, row_id))]
+        else:
+            match = _FILTER.match(value)
+            if not match:
+                raise ValueError(f"unsupported filter {key}={value}")
+            op, operand = match.groups()
+            if op == "is":
+                # Only is.null is used (soft-deleted sessions)
+                rows = [row for row in rows if row.get(key) is None]
+            elif op == "in":
+                members = {member.strip('"') for member in operand.strip("()").split(",")}
+                rows = [row for row in rows if str(row.get(key)) in members]
+            elif op == "eq":
+                rows = [row for row in rows if str(row.get(key)) == operand]
+            else:
+                rows = [row for row in rows if _compare(op, str(row.get(key)), operand)]
+    for column, *direction in reversed(order or []):
+        rows = sorted(rows, key=lambda row: row.get(column) or "", reverse="desc" in direction)
+    return rows[:limit] if limit is not None else rows
+
+def _columns(rows, query):
+    select = dict(query).get("select", "*")
+    if select == "*":
+        return [dict(row) for row in rows]
+    columns = [column.strip() for column in select.split(",")]
+    return [{column: row.get(column) for column in columns} for row in rows]
+
+def _postgrest(backend, method, path, query, body, headers):
+    single = "vnd.pgrst.object" in (headers.get("Accept") or "")
+    if path == "rpc/append_exchange":
+        return _append_exchange(backend, body)
+    if path == "rpc/append_messages":
+        return _append_messages(backend, body)
+    if path == "rpc/search_messages":
+        return _search_messages(backend, body)
+
+    with backend._lock:
+        table = backend.tables.get(path)
+        if table is None:
+            return 404, {"message": f"relation {path} does not exist"}
+
+        if method == "GET":
+            rows = _columns(_select(table, query), query)
+        elif method == "POST":
+            values = body if isinstance(body, list) else [body]
+            deleted = next((value["session_id"] for value in values if path == "chat_messages"
+                            and _session_deleted_locked(backend, value["session_id"])), None)
+            if deleted is not None:
+                # Like the insert trigger in migrations/006_soft_delete_sessions.sql
+                return 400, _error("P0002", f"chat session {deleted} was deleted", deleted)
+            rows = []
+            for value in values:
+                existing = next((row for row in table if "id" in value and row["id"] == value["id"]), None)
+                if existing and "merge-duplicates" in (headers.get("Prefer") or ""):
+                    existing.update(value)
+                    rows.append(dict(existing))
+                else:
+                    rows.append(dict(backend._insert_locked(path, value)))
+        elif method == "PATCH":
+            rows = _select(table, query)
+            for row in rows:
+                row.update(body)
+                backend._publish(path, "UPDATE", row)
+            rows = [dict(row) for row in rows]
+        else:
+            rows = _select(table, query)
+            for row in rows:
+                backend._publish(path, "DELETE", old_record={"id": row["id"]})
+            doomed = {row["id"] for row in rows}
+            backend.tables[path] = [row for row in table if row["id"] not in doomed]
+            if path == "chat_sessions":
+                backend.tables["chat_messages"] = [
+                    row for row in backend.tables["chat_messages"] if row["session_id"] not in doomed
+                ]
+            rows = [dict(row) for row in rows]
+
+    if single:
+        if len(rows) != 1:
+            return 406, _error("PGRST116", "JSON object requested, multiple (or no) rows returned")
+        return 200, rows[0]
+    return (201 if method == "POST" else 200), rows
+
+def _error(code: str, message: str, details: str = None) -> dict:
+    # PostgREST's error body; postgrest-py needs every field to parse it
+    return {"code": code, "message": message, "details": details, "hint": None}
+
+def _session_deleted_locked(backend, session_id) -> bool:
+    return any(row["id"] == session_id and row.get("deleted_at") for row in backend.tables["chat_sessions"])
+
+def _append_exchange(backend, params):
+    columns = ("id", "role", "content", "created_at")
+    with backend._lock:
+        session = next((row for row in backend.tables["chat_sessions"] if row["id"] == params["p_session_id"]), None)
+        if session is None:
+            return 400, _error("P0001", f"chat session {params['p_session_id']} does not exist")
+        if session.get("deleted_at"):
+            # Raised by the insert trigger in migrations/006_soft_delete_sessions.sql
+            return 400, _error("P0002", f"chat session {session['id']} was deleted", session["id"])
+        inserted = [
+            backend._insert_locked("chat_messages", {"session_id": session["id"], "role": role, "content": params[key]})
+            for role, key in (("user", "p_user_content"), ("assistant", "p_assistant_content"))
+            if params.get(key) is not None
+        ]
+        session["last_message_at"] = inserted[-1]["created_at"]
+        if params.get("p_title"):
+            session["title"] = params["p_title"]
+        backend._publish("chat_sessions", "UPDATE", session)
+    return 200, [{column: row[column] for column in columns} for row in inserted]
+
+def _append_messages(backend, params):
+    columns = ("id", "session_id", "role", "content", "created_at")
+    with backend._lock:
+        sessions = {row["id"]: row for row in backend.tables["chat_sessions"]}
+        existing = {row["id"] for row in backend.tables["chat_messages"]}
+        deleted = next((message["session_id"] for message in params["p_messages"]
+                        if sessions.get(message["session_id"], {}).get("deleted_at")), None)
+        if deleted:
+            return 400, _error("P0002", f"chat session {deleted} was deleted", deleted)
+        inserted = []
+        for message in params["p_messages"]:
+            session = sessions.get(message["session_id"])
+            if session is None or message["id"] in existing:
+                continue
+            inserted.append(backend._insert_locked("chat_messages", {column: message[column] for column in columns}))
+            session["last_message_at"] = max(session.get("last_message_at") or "", message["created_at"])
+            if message.get("title"):
+                session["title"] = message["title"]
+            backend._publish("chat_sessions", "UPDATE", session)
+    return 200, [{column: row[column] for column in columns} for row in inserted]
+
+def _search_messages(backend, params):
+    # Word matching instead of Postgres full-text search; enough to exercise the UI
+    words = [word for word in re.findall(r"\w+", params["p_query"].casefold()) if len(word) > 2]
+    with backend._lock:
+        titles = {row["id"]: row["title"] for row in backend.tables["chat_sessions"]
+                  if row["user_id"] == USER_ID and row.get("deleted_at") is None}
+        hits = []
+        for row in backend.tables["chat_messages"]:
+            content = row["content"].casefold()
+            rank = sum(content.count(word) for word in words)
+            if row["session_id"] in titles and words and all(word in content for word in words):
+                hits.append((rank, row))
+    hits.sort(key=lambda hit: (hit[0], hit[1]["created_at"]), reverse=True)
+    offset, limit = params.get("p_offset", 0), min(params.get("p_limit", 20), 50)
+    return 200, [{
+        "message_id": row["id"],
+        "session_id": row["session_id"],
+        "session_title": titles[row["session_id"]],
+        "role": row["role"],
+        "snippet": re.sub("(" + "|".join(map(re.escape, words)) + ")", r"**\1**", row["content"][:160], flags=re.I),
+        "rank": rank,
+        "created_at": row["created_at"],
+    } for rank, row in hits[offset:offset + limit]]
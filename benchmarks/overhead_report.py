@@ -0,0 +1,108 @@
+"""
+Import-time and per-rerun overhead report.
+
+Measures, in fresh interpreters:
+  * how long importing the app's modules takes on top of streamlit itself,
+    and whether the supabase / requests stacks get pulled in at import time;
+  * what load_css() costs per rerun (time and bytes sent to the browser).
+
+Usage (from the repository root):
+  python benchmarks/overhead_report.py                  # current tree
+  python benchmarks/overhead_report.py --ref HEAD~1     # also measure a git ref, side by side
+  python benchmarks/overhead_report.py --json out.json  # machine-readable output
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+PROBE = r"""
+import json, sys, time, logging
+logging.disable(logging.CRITICAL)
+t0 = time.perf_counter()
+import streamlit as st
+t1 = time.perf_counter()
+import app.auth, app.utils
+t2 = time.perf_counter()
+heavy = {name: name in sys.modules for name in ("supabase", "postgrest", "httpx", "requests")}
+
+sent = []
+st.markdown = lambda body, **kwargs: sent.append(body)
+timings = []
+for _ in range(200):
+    start = time.perf_counter()
+    app.utils.load_css()
+    timings.append(time.perf_counter() - start)
+
+print(json.dumps({
+    "streamlit_import_s": t1 - t0,
+    "app_import_s": t2 - t1,
+    "heavy_modules_at_import": heavy,
+    "load_css_first_ms": timings[0] * 1000,
+    "load_css_rerun_ms": sorted(timings[1:])[len(timings[1:]) // 2] * 1000,
+    "load_css_bytes": len(sent[-1].encode("utf-8")),
+}))
+"""
+
+def measure(tree: str, runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", PROBE],
+            cwd=tree,
+            env={**os.environ, "PYTHONPATH": tree, "PYTHONDONTWRITEBYTECODE": "1"},
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip().splitlines()[-1]
+        samples.append(json.loads(out))
+    result = dict(samples[-1])
+    for key in ("streamlit_import_s", "app_import_s", "load_css_first_ms", "load_css_rerun_ms"):
+        result[key] = statistics.median(sample[key] for sample in samples)
+    return result
+
+def export_ref(ref: str, root: str) -> str:
+    target = tempfile.mkdtemp(prefix="overhead-")
+    archive = subprocess.run(["git", "archive", ref], cwd=root, capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(target)
+    return target
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ref", help="git ref to measure alongside the working tree")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per tree (median is reported)")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = {"current": measure(root, args.runs)}
+    if args.ref:
+        results[args.ref] = measure(export_ref(args.ref, root), args.runs)
+
+    rows = [
+        ("app import (s)", "app_import_s", "{:.3f}"),
+        ("streamlit import (s)", "streamlit_import_s", "{:.3f}"),
+        ("load_css first call (ms)", "load_css_first_ms", "{:.3f}"),
+        ("load_css per rerun (ms)", "load_css_rerun_ms", "{:.4f}"),
+        ("load_css bytes per rerun", "load_css_bytes", "{}"),
+    ]
+    names = list(results)
+    print(f"{'metric':<28}" + "".join(f"{name:>16}" for name in names))
+    for label, key, fmt in rows:
+        print(f"{label:<28}" + "".join(f"{fmt.format(results[name][key]):>16}" for name in names))
+    for name in names:
+        loaded = [m for m, present in results[name]["heavy_modules_at_import"].items() if present]
+        print(f"{name}: imported at startup: {', '.join(loaded) or 'none of supabase/postgrest/httpx/requests'}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""
+Rerun latency benchmark.
+
+Drives main.py and app/pages/chat.py through Streamlit's AppTest against the local
+stand-ins in fake_backend.py (GoTrue, PostgREST and the n8n webhook), with injected
+per-service latency, and reports for every step of every scenario:
+  * wall time (median, min and max over --runs repetitions);
+  * outbound HTTP calls, per service and per route.
+
+Scenarios: login, open_session (a chat with --messages messages, cold then warm),
+send_message, first_message_naming, rename, delete. Each repetition starts from
+freshly seeded data and empty in-process caches; connection pools stay warm.
+No network access is needed.
+
+AppTest has no fragment reruns: a widget inside a fragment reruns the whole script.
+So every step is timed as a full rerun, including the page-level work (the session
+check, with a GoTrue refresh when one is due, and the page data loads) that a
+fragment rerun in the app skips. The "in app" column names what the step reruns in
+the real app: a fragment, "app" for a full rerun, or "<fragment>+app" when the
+fragment goes on to rerun the app. For steps that stay within a fragment the numbers
+are an upper bound, and their HTTP calls include the page-level ones.
+
+Usage (from the repository root):
+  python benchmarks/rerun_latency.py                                   # all scenarios
+  python benchmarks/rerun_latency.py --supabase-latency 40 --n8n-latency 800
+  python benchmarks/rerun_latency.py --scenario open_session --messages 1000
+  python benchmarks/rerun_latency.py --json after.json --baseline before.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_backend import FakeBackend, session_payload
+
+def configure_app_env(backend: FakeBackend):
+    """Points the app at the backend; must run before any app module is imported."""
+    os.environ.update(backend.env())
+    os.environ.update({
+        "N8N_STREAMING": "false",
+        "N8N_INLINE_TITLE": "false",
+        "N8N_MAX_RETRIES": "0",
+        "AGENT_CACHE_ENABLED": "false",
+    })
+
+def reset_app_caches():
+    """Empties every in-process data cache, so each repetition starts cold."""
+    import app.auth
+    import app.render
+    import app.naming
+    app.auth._session_list_cache.clear()
+    app.auth._message_cache.clear()
+    app.auth._profile_cache.clear()
+    app.auth._refresh_flights.clear()
+    app.render._markdown_cache.clear()
+    app.naming._pending_titles.clear()
+
+def new_app(authenticated=True, session_id=None):
+    from streamlit.testing.v1 import AppTest
+    from supabase_auth.types import Session
+
+    at = AppTest.from_file(os.path.join(ROOT, "main.py"), default_timeout=120)
+    if authenticated:
+        session = Session.model_validate(session_payload())
+        at.session_state["session"] = {
+            "access_token": session.access_token,
+            "refresh_token": session.refresh_token,
+            "user": session.user,
+        }
+    if session_id:
+        at.session_state["current_session_id"] = session_id
+    return at
+
+def wait_for_naming(session_id, timeout=60.0):
+    """Blocks until the background naming job for a session has stored its title."""
+    import app.naming
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        entry = app.naming._pending_titles.get(session_id)
+        if entry and entry["done"]:
+            return
+        time.sleep(0.002)
+    raise TimeoutError(f"naming for {session_id} did not finish")
+
+def check(at):
+    if at.exception:
+        raise RuntimeError(f"app raised: {at.exception[0].value}")
+    return at
+
+# Scenarios: each is a generator that seeds the backend, prepares an app and yields
+# (step name, action, scope in the app) triples; only the actions are timed and counted.
+# The scope is the fragment the step reruns in the app, "app" for a full rerun, and
+# "<fragment>+app" when the fragment goes on to rerun the app (st.rerun()).
+
+def scenario_login(backend, options):
+    backend.seed(sessions=5, messages_per_session=options.messages)
+    at = new_app(authenticated=False)
+
+    def open_login_page():
+        check(at.run())
+
+    def sign_in():
+        at.text_input(key="login_email").input("bench@example.com")
+        at.text_input(key="login_password").input("secret")
+        next(button for button in at.button if button.label == "Sign In").click()
+        check(at.run())
+    yield "login page", open_login_page, "app"
+    yield "sign in", sign_in, "app"
+
+def scenario_open_session(backend, options):
+    backend.seed(sessions=5, messages_per_session=options.messages)
+    at = new_app(session_id=backend.sessions()[0]["id"])
+    yield "cold open", lambda: check(at.run()), "app"
+    yield "warm rerun", lambda: check(at.run()), "app"
+
+def scenario_send_message(backend, options):
+    backend.seed(sessions=5, messages_per_session=options.messages)
+    at = check(new_app(session_id=backend.sessions()[0]["id"]).run())
+    yield "send message", lambda: check(at.chat_input[0].set_value("What does an SDE II earn at Google?").run()), "render_chat"
+    yield "rerun after reply", lambda: check(at.run()), "app"
+
+def scenario_first_message_naming(backend, options):
+    backend.seed(sessions=5, messages_per_session=options.messages)
+    session_id = backend.sessions()[0]["id"]
+    with backend._lock:
+        backend.tables["chat_messages"] = [row for row in backend.tables["chat_messages"] if row["session_id"] != session_id]
+        backend.tables["chat_sessions"][-1]["title"] = "New Chat"
+    at = check(new_app(session_id=session_id).run())
+    yield "send first message", lambda: check(at.chat_input[0].set_value("Interview tips for Amazon?").run()), "render_chat+app"
+    yield "background naming", lambda: wait_for_naming(session_id), "-"
+    yield "rerun with title", lambda: check(at.run()), "app"
+
+def scenario_rename(backend, options):
+    backend.seed(sessions=5, messages_per_session=options.messages)
+    target = backend.sessions()[1]["id"]
+    at = check(new_app(session_id=backend.sessions()[0]["id"]).run())
+    yield "open rename", lambda: check(at.button(key=f"edit_{target}").click().run()), "render_session_list"
+    yield "save rename", lambda: check(at.text_input(key=f"input_{target}").set_value("Renamed chat").run()), "render_session_list"
+
+def scenario_delete(backend, options):
+    backend.seed(sessions=5, messages_per_session=options.messages)
+    open_id, other_id = backend.sessions()[0]["id"], backend.sessions()[1]["id"]
+    at = check(new_app(session_id=open_id).run())
+    yield "delete other chat", lambda: check(at.button(key=f"del_{other_id}").click().run()), "render_session_list"
+    yield "delete open chat", lambda: check(at.button(key=f"del_{open_id}").click().run()), "render_session_list+app"
+
+SCENARIOS = {
+    "login": scenario_login,
+    "open_session": scenario_open_session,
+    "send_message": scenario_send_message,
+    "first_message_naming": scenario_first_message_naming,
+    "rename": scenario_rename,
+    "delete": scenario_delete,
+}
+
+def run_scenario(backend, name, options) -> list:
+    steps = {}
+    for _ in range(options.runs):
+        reset_app_caches()
+        for step, action, app_scope in SCENARIOS[name](backend, options):
+            backend.reset_counts()
+            start = time.perf_counter()
+            action()
+            elapsed = time.perf_counter() - start
+            snapshot = backend.snapshot()
+            record = steps.setdefault(step, {"step": step, "app_scope": app_scope, "samples_ms": [], **snapshot})
+            record["samples_ms"].append(elapsed * 1000)
+            # Call counts should not depend on timing; flag a step whose counts drift between runs
+            if snapshot["calls"] != record["calls"]:
+                record["calls_varied"] = True
+    results = []
+    for record in steps.values():
+        samples = record.pop("samples_ms")
+        results.append({
+            **record,
+            "median_ms": statistics.median(samples),
+            "min_ms": min(samples),
+            "max_ms": max(samples),
+        })
+    return results
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def print_report(report, baseline=None):
+    previous = {}
+    if baseline:
+        for name, steps in baseline["scenarios"].items():
+            for step in steps:
+                previous[(name, step["step"])] = step
+
+    print(f"{'scenario':<22}{'step':<22}{'in app':<25}{'median ms':>11}{'min':>9}{'max':>9}  {'supabase':>8}{'n8n':>5}", end="")
+    print(f"  {'vs baseline':>12}" if baseline else "")
+    for name, steps in report["scenarios"].items():
+        for step in steps:
+            line = (
+                f"{name:<22}{step['step']:<22}{step.get('app_scope', '?'):<25}{step['median_ms']:>11.1f}{step['min_ms']:>9.1f}{step['max_ms']:>9.1f}"
+                f"  {step['calls'].get('supabase', 0):>8}{step['calls'].get('n8n', 0):>5}"
+            )
+            before = previous.get((name, step["step"]))
+            if before:
+                delta = step["median_ms"] - before["median_ms"]
+                calls_delta = sum(step["calls"].values()) - sum(before["calls"].values())
+                line += f"  {delta:>+9.1f} ms" + (f" {calls_delta:+d} calls" if calls_delta else "")
+            print(line)
+    print("\nEvery step is timed as a full rerun (AppTest has no fragment reruns). Steps whose")
+    print("\"in app\" scope is only a fragment run less in the app: no session check or page loads.")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="run only these (repeatable)")
+    parser.add_argument("--runs", type=int, default=5, help="repetitions per scenario (median is reported)")
+    parser.add_argument("--messages", type=int, default=200, help="messages per seeded chat")
+    parser.add_argument("--supabase-latency", type=float, default=20.0, help="injected ms per GoTrue/PostgREST call")
+    parser.add_argument("--n8n-latency", type=float, default=200.0, help="injected ms per webhook call")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="a previous --json file to compare against")
+    options = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    backend = FakeBackend(options.supabase_latency / 1000, options.n8n_latency / 1000).start()
+    configure_app_env(backend)
+    os.chdir(ROOT)
+
+    import streamlit
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "streamlit": streamlit.__version__,
+        "config": {
+            "runs": options.runs,
+            "messages": options.messages,
+            "supabase_latency_ms": options.supabase_latency,
+            "n8n_latency_ms": options.n8n_latency,
+        },
+        "scenarios": {},
+    }
+    try:
+        for name in options.scenario or SCENARIOS:
+            report["scenarios"][name] = run_scenario(backend, name, options)
+    finally:
+        backend.stop()
+
+    baseline = None
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
 import streamlit as st
-from dotenv import load_dotenv
+from app.config import load_env
 
-# Load environment variables
-load_dotenv()
+# Load environment variables (once per process)
+load_env()
 
 # Main Entry Point
 # This file handles the navigation to different pages.
@@ -10,7 +10,13 @@ load_dotenv()
 # Page Configuration
 st.set_page_config(page_title="Sam - AI Assistant", page_icon="🤖", layout="centered")
 
-from app.auth import sign_in, sign_up, sign_out, get_profile, update_profile, restore_session
+from app.auth import sign_in, sign_up, sign_out, update_profile, restore_session
+from app.data import load_page_data
+from app import metrics
+
+# Per-rerun timings start here; exporters (if configured) start once per process
+metrics.begin_rerun()
+metrics.start_exporters()
 
 # Initialize session state for authentication
 if "session" not in st.session_state:
@@ -70,10 +76,16 @@ login_page = st.Page(login_page_func, title="Login", icon="🔒")
 chat_page = st.Page("app/pages/chat.py", title="Chat", icon="💬")
 
 if st.session_state.authenticated:
+    # Fetch the profile, session list and open chat concurrently
+    page_data = load_page_data(st.session_state.user.id, st.session_state.get("current_session_id"))
+    for part, error in page_data.errors.items():
+        st.error(f"Error loading {part}: {error}")
+
     # Check for User Profile (Onboarding)
-    profile = get_profile(st.session_state.user.id)
+    profile = page_data.profile
     
-    if not profile:
+    # A profile that failed to load is not a missing one; skip onboarding in that case
+    if not profile and "profile" not in page_data.errors:
         # Onboarding Flow
         st.title("Welcome! Let's get to know you.")
         with st.form("onboarding_form"):
@@ -103,3 +115,9 @@ else:
 
 # Run the selected page
 pg.run()
+
+# Close this rerun's timings; the panel shows where they went
+rerun_summary = metrics.end_rerun()
+if st.session_state.authenticated and metrics.is_debug_panel_enabled():
+    with st.sidebar:
+        metrics.render_debug_panel(rerun_summary)
@@ -0,0 +1,81 @@
+-- Migration 001: indexes for the hot chat queries and cheaper RLS predicates
+-- Apply after supabase_schema.sql, supabase_schema_advanced.sql and supabase_schema_update.sql.
+
+begin;
+
+create table if not exists public.schema_migrations (
+  version text primary key,
+  applied_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+
+-- Sidebar: a user's sessions, newest first, paged by (created_at, id)
+create index if not exists chat_sessions_user_id_created_at_idx
+  on chat_sessions (user_id, created_at desc, id desc);
+
+-- Chat pane: a session's messages in order, paged by (created_at, id)
+create index if not exists chat_messages_session_id_created_at_idx
+  on chat_messages (session_id, created_at, id);
+
+-- Denormalize the session owner onto chat_messages so RLS needs no join
+alter table chat_messages add column if not exists user_id uuid references auth.users on delete cascade;
+
+update chat_messages
+set user_id = chat_sessions.user_id
+from chat_sessions
+where chat_sessions.id = chat_messages.session_id
+  and chat_messages.user_id is null;
+
+alter table chat_messages alter column user_id set not null;
+
+create index if not exists chat_messages_user_id_idx on chat_messages (user_id);
+
+-- Fill user_id from the parent session. Runs before RLS checks the new row, so a
+-- message aimed at someone else's session carries their user_id and is rejected.
+create or replace function public.set_chat_message_user_id()
+returns trigger as $$
+begin
+  select user_id into new.user_id from public.chat_sessions where id = new.session_id;
+  if new.user_id is null then
+    raise exception 'chat session % does not exist', new.session_id;
+  end if;
+  return new;
+end;
+$$ language plpgsql security definer set search_path = public;
+
+drop trigger if exists set_chat_message_user_id on chat_messages;
+create trigger set_chat_message_user_id
+  before insert or update of session_id on chat_messages
+  for each row execute procedure public.set_chat_message_user_id();
+
+-- Policies: evaluate auth.uid() once per statement (initplan) instead of once per row
+drop policy if exists "Users can select their own sessions" on chat_sessions;
+create policy "Users can select their own sessions" on chat_sessions
+  for select using ((select auth.uid()) = user_id);
+
+drop policy if exists "Users can insert their own sessions" on chat_sessions;
+create policy "Users can insert their own sessions" on chat_sessions
+  for insert with check ((select auth.uid()) = user_id);
+
+drop policy if exists "Users can update their own sessions" on chat_sessions;
+create policy "Users can update their own sessions" on chat_sessions
+  for update using ((select auth.uid()) = user_id);
+
+drop policy if exists "Users can delete their own sessions" on chat_sessions;
+create policy "Users can delete their own sessions" on chat_sessions
+  for delete using ((select auth.uid()) = user_id);
+
+drop policy if exists "Users can select messages from their sessions" on chat_messages;
+create policy "Users can select messages from their sessions" on chat_messages
+  for select using ((select auth.uid()) = user_id);
+
+drop policy if exists "Users can insert messages to their sessions" on chat_messages;
+create policy "Users can insert messages to their sessions" on chat_messages
+  for insert with check ((select auth.uid()) = user_id);
+
+drop policy if exists "Users can delete messages from their sessions" on chat_messages;
+create policy "Users can delete messages from their sessions" on chat_messages
+  for delete using ((select auth.uid()) = user_id);
+
+insert into public.schema_migrations (version) values ('001') on conflict do nothing;
+
+commit;
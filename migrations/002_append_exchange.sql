@@ -0,0 +1,51 @@
+-- Migration 002: write a whole chat turn in one transaction and one HTTP call
+-- Apply after migrations/001_chat_indexes_and_rls.sql.
+
+begin;
+
+-- Last time a message was written to the session
+alter table chat_sessions add column if not exists last_message_at timestamp with time zone;
+
+-- Inserts the user's message and the assistant's reply, and optionally renames the
+-- session, atomically. Runs as the caller, so the usual RLS policies apply.
+-- A null p_user_content stores only the reply (the app saves the prompt before
+-- calling the agent). Returns the inserted messages in chronological order.
+create or replace function public.append_exchange(
+  p_session_id uuid,
+  p_user_content text,
+  p_assistant_content text,
+  p_title text default null
+)
+returns table (id uuid, role text, content text, created_at timestamp with time zone)
+as $$
+declare
+  -- now() is fixed for the transaction, so order the two rows explicitly
+  v_now timestamp with time zone := clock_timestamp();
+begin
+  update chat_sessions
+  set last_message_at = v_now + interval '1 microsecond',
+      title = coalesce(nullif(p_title, ''), chat_sessions.title)
+  where chat_sessions.id = p_session_id;
+
+  if not found then
+    raise exception 'chat session % does not exist', p_session_id;
+  end if;
+
+  return query
+  insert into chat_messages as m (session_id, role, content, created_at)
+  select turn.session_id, turn.role, turn.content, turn.created_at
+  from (values
+    (p_session_id, 'user', p_user_content, v_now),
+    (p_session_id, 'assistant', p_assistant_content, v_now + interval '1 microsecond')
+  ) as turn (session_id, role, content, created_at)
+  where turn.content is not null
+  order by turn.created_at
+  returning m.id, m.role, m.content, m.created_at;
+end;
+$$ language plpgsql security invoker set search_path = public;
+
+grant execute on function public.append_exchange(uuid, text, text, text) to authenticated;
+
+insert into public.schema_migrations (version) values ('002') on conflict do nothing;
+
+commit;
@@ -0,0 +1,64 @@
+-- Migration 003: full-text search over a user's chat history
+-- Apply after migrations/002_append_exchange.sql.
+-- Adding the generated column rewrites chat_messages once; run it off-peak on large tables.
+
+begin;
+
+-- English full-text vector of each message, kept up to date by Postgres itself
+alter table chat_messages add column if not exists content_tsv tsvector
+  generated always as (to_tsvector('english', coalesce(content, ''))) stored;
+
+create index if not exists chat_messages_content_tsv_idx
+  on chat_messages using gin (content_tsv);
+
+-- Ranked search over the caller's messages. p_query uses web search syntax
+-- ("quoted phrases", or, -excluded). Returns at most 50 rows per call, best first;
+-- page with p_offset. Snippets mark matches with **, for markdown.
+-- Security definer: under RLS, Postgres may not evaluate the (non-leakproof) @@
+-- operator before the policy, so it could never use the GIN index. The function
+-- instead filters on auth.uid() itself, which the planner combines with the index.
+create or replace function public.search_messages(
+  p_query text,
+  p_limit integer default 20,
+  p_offset integer default 0
+)
+returns table (
+  message_id uuid,
+  session_id uuid,
+  session_title text,
+  role text,
+  snippet text,
+  rank real,
+  created_at timestamp with time zone
+)
+as $$
+  with query as (
+    select websearch_to_tsquery('english', p_query) as q
+  ),
+  hits as (
+    select m.id, m.session_id, m.role, m.content, m.created_at,
+           ts_rank_cd(m.content_tsv, query.q) as rank
+    from chat_messages m, query
+    where m.user_id = (select auth.uid())
+      and m.content_tsv @@ query.q
+    order by rank desc, m.created_at desc, m.id
+    limit least(greatest(p_limit, 1), 50)
+    offset greatest(p_offset, 0)
+  )
+  -- ts_headline re-parses the text, so it only runs for the rows of this page
+  select hits.id, hits.session_id, s.title, hits.role,
+         ts_headline('english', hits.content, query.q,
+                     'StartSel=**, StopSel=**, MinWords=8, MaxWords=24, MaxFragments=2, FragmentDelimiter=" … "'),
+         hits.rank, hits.created_at
+  from hits
+  join chat_sessions s on s.id = hits.session_id and s.user_id = (select auth.uid())
+  cross join query
+  order by hits.rank desc, hits.created_at desc, hits.id;
+$$ language sql stable security definer set search_path = public;
+
+revoke execute on function public.search_messages(text, integer, integer) from public;
+grant execute on function public.search_messages(text, integer, integer) to authenticated;
+
+insert into public.schema_migrations (version) values ('003') on conflict do nothing;
+
+commit;
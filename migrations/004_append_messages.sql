@@ -0,0 +1,48 @@
+-- Migration 004: idempotent batch insert for messages written behind from the app's local journal
+-- Apply after migrations/003_message_search.sql.
+
+begin;
+
+-- Inserts a batch of messages that already carry their id and created_at, skipping
+-- ids that exist (a retried batch is a no-op) and messages of sessions that are gone
+-- or not the caller's. Moves each session's last_message_at forward and applies the
+-- newest non-empty "title" given for it. Runs as the caller, so RLS applies.
+-- p_messages: [{"id", "session_id", "role", "content", "created_at", "title"?}, ...]
+-- Returns the inserted messages.
+create or replace function public.append_messages(p_messages jsonb)
+returns table (id uuid, session_id uuid, role text, content text, created_at timestamp with time zone)
+as $$
+  with batch as (
+    select (e->>'id')::uuid as id, (e->>'session_id')::uuid as session_id, e->>'role' as role,
+           e->>'content' as content, (e->>'created_at')::timestamp with time zone as created_at,
+           nullif(e->>'title', '') as title
+    from jsonb_array_elements(p_messages) e
+    where exists (select 1 from chat_sessions s where s.id = (e->>'session_id')::uuid)
+  ),
+  touched as (
+    update chat_sessions s
+    set last_message_at = greatest(s.last_message_at, sessions.last_at),
+        title = coalesce(sessions.title, s.title)
+    from (
+      select batch.session_id,
+             max(batch.created_at) as last_at,
+             (array_agg(batch.title order by batch.created_at desc) filter (where batch.title is not null))[1] as title
+      from batch
+      group by batch.session_id
+    ) sessions
+    where s.id = sessions.session_id
+    returning s.id
+  )
+  insert into chat_messages as m (id, session_id, role, content, created_at)
+  select batch.id, batch.session_id, batch.role, batch.content, batch.created_at
+  from batch
+  order by batch.created_at, batch.id
+  on conflict (id) do nothing
+  returning m.id, m.session_id, m.role, m.content, m.created_at;
+$$ language sql volatile security invoker set search_path = public;
+
+grant execute on function public.append_messages(jsonb) to authenticated;
+
+insert into public.schema_migrations (version) values ('004') on conflict do nothing;
+
+commit;
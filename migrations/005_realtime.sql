@@ -0,0 +1,27 @@
+-- Migration 005: publish chat changes to Supabase Realtime
+-- Apply after migrations/004_append_messages.sql.
+-- Realtime checks each change against the subscriber's RLS policies before sending it,
+-- so subscribers only receive inserts and updates of their own rows. Deletes carry only
+-- the primary key.
+
+begin;
+
+do $publication$
+begin
+  if not exists (select 1 from pg_publication where pubname = 'supabase_realtime') then
+    create publication supabase_realtime;
+  end if;
+  if not exists (select 1 from pg_publication_tables
+                 where pubname = 'supabase_realtime' and schemaname = 'public' and tablename = 'chat_sessions') then
+    alter publication supabase_realtime add table public.chat_sessions;
+  end if;
+  if not exists (select 1 from pg_publication_tables
+                 where pubname = 'supabase_realtime' and schemaname = 'public' and tablename = 'chat_messages') then
+    alter publication supabase_realtime add table public.chat_messages;
+  end if;
+end
+$publication$;
+
+insert into public.schema_migrations (version) values ('005') on conflict do nothing;
+
+commit;
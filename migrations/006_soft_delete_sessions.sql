@@ -0,0 +1,161 @@
+-- Migration 006: soft delete for chat sessions, purged in batches in the background
+-- Apply after migrations/005_realtime.sql.
+-- Deleting a session now only sets deleted_at; the app hides it at once and no more
+-- messages can be added to it. Its rows are removed later by purge_deleted_sessions(),
+-- a bounded batch at a time, so users never wait on the ON DELETE CASCADE over a long chat.
+
+begin;
+
+alter table chat_sessions add column if not exists deleted_at timestamp with time zone;
+
+-- Sidebar: a user's live sessions, newest first, paged by (created_at, id)
+create index if not exists chat_sessions_user_id_live_created_at_idx
+  on chat_sessions (user_id, created_at desc, id desc)
+  where deleted_at is null;
+
+-- Purge: finds sessions whose grace period is over
+create index if not exists chat_sessions_deleted_at_idx
+  on chat_sessions (deleted_at)
+  where deleted_at is not null;
+
+-- The sidebar now only reads live sessions, so the full index from migration 001 goes
+drop index if exists chat_sessions_user_id_created_at_idx;
+
+-- Nothing can be written to a deleted session, so a tab or device that still has it
+-- open cannot add messages the purge would race with. The trigger from migration 001
+-- already reads the parent session for every new message, so it refuses these with a
+-- distinct error (no_data_found, with the session ID as detail) that the app takes as
+-- "the session is gone". This covers plain inserts, append_exchange (migration 002) and
+-- append_messages (migration 004), whose whole transaction is rolled back.
+create or replace function public.set_chat_message_user_id()
+returns trigger as $$
+declare
+  v_deleted_at timestamp with time zone;
+begin
+  select user_id, deleted_at into new.user_id, v_deleted_at
+  from public.chat_sessions where id = new.session_id;
+  if new.user_id is null then
+    raise exception 'chat session % does not exist', new.session_id;
+  end if;
+  if v_deleted_at is not null then
+    raise exception 'chat session % was deleted', new.session_id
+      using errcode = 'no_data_found', detail = new.session_id::text;
+  end if;
+  return new;
+end;
+$$ language plpgsql security definer set search_path = public;
+
+-- The insert policy stays as in migration 001 (recreated here in case an earlier draft
+-- of this migration gave it a deleted-session check; the trigger above does that)
+drop policy if exists "Users can insert messages to their sessions" on chat_messages;
+create policy "Users can insert messages to their sessions" on chat_messages
+  for insert with check ((select auth.uid()) = user_id);
+
+-- Search (migration 003) skips deleted sessions
+create or replace function public.search_messages(
+  p_query text,
+  p_limit integer default 20,
+  p_offset integer default 0
+)
+returns table (
+  message_id uuid,
+  session_id uuid,
+  session_title text,
+  role text,
+  snippet text,
+  rank real,
+  created_at timestamp with time zone
+)
+as $$
+  with query as (
+    select websearch_to_tsquery('english', p_query) as q
+  ),
+  hits as (
+    select m.id, m.session_id, m.role, m.content, m.created_at,
+           ts_rank_cd(m.content_tsv, query.q) as rank
+    from chat_messages m, query
+    where m.user_id = (select auth.uid())
+      and m.content_tsv @@ query.q
+      and not exists (
+        select 1 from chat_sessions d
+        where d.id = m.session_id and d.deleted_at is not null
+      )
+    order by rank desc, m.created_at desc, m.id
+    limit least(greatest(p_limit, 1), 50)
+    offset greatest(p_offset, 0)
+  )
+  select hits.id, hits.session_id, s.title, hits.role,
+         ts_headline('english', hits.content, query.q,
+                     'StartSel=**, StopSel=**, MinWords=8, MaxWords=24, MaxFragments=2, FragmentDelimiter=" … "'),
+         hits.rank, hits.created_at
+  from hits
+  join chat_sessions s on s.id = hits.session_id and s.user_id = (select auth.uid())
+  cross join query
+  order by hits.rank desc, hits.created_at desc, hits.id;
+$$ language sql stable security definer set search_path = public;
+
+-- Removes up to p_batch_size messages of sessions soft-deleted more than p_grace ago,
+-- then those sessions that have no messages left (up to p_batch_size of them).
+-- Each call is one short transaction; call it repeatedly (see the schedule below)
+-- until it returns zeros. Not callable by app users.
+create or replace function public.purge_deleted_sessions(
+  p_grace interval default interval '10 minutes',
+  p_batch_size integer default 5000
+)
+returns table (messages_deleted bigint, sessions_deleted bigint)
+as $$
+  with doomed_sessions as (
+    select id from chat_sessions
+    where deleted_at < now() - p_grace
+  ),
+  doomed_messages as (
+    select m.id from chat_messages m
+    where m.session_id in (select id from doomed_sessions)
+    limit p_batch_size
+  ),
+  deleted_messages as (
+    delete from chat_messages m
+    where m.id in (select id from doomed_messages)
+    returning m.session_id
+  ),
+  empty_sessions as (
+    select s.id from doomed_sessions s
+    -- The statement still sees the messages it deletes, so sessions it empties go next call
+    where not exists (select 1 from chat_messages m where m.session_id = s.id)
+    limit p_batch_size
+  ),
+  deleted_sessions as (
+    delete from chat_sessions s
+    where s.id in (select id from empty_sessions)
+    returning s.id
+  )
+  select (select count(*) from deleted_messages), (select count(*) from deleted_sessions);
+$$ language sql volatile security definer set search_path = public;
+
+revoke execute on function public.purge_deleted_sessions(interval, integer) from public;
+do $revoke$
+begin
+  -- Supabase grants new functions to its API roles by default
+  if exists (select 1 from pg_roles where rolname = 'anon') then
+    revoke execute on function public.purge_deleted_sessions(interval, integer) from anon;
+  end if;
+  if exists (select 1 from pg_roles where rolname = 'authenticated') then
+    revoke execute on function public.purge_deleted_sessions(interval, integer) from authenticated;
+  end if;
+end
+$revoke$;
+
+-- Run the purge every minute where pg_cron is available; elsewhere, schedule
+-- `select * from public.purge_deleted_sessions();` with any job runner.
+do $schedule$
+begin
+  if exists (select 1 from pg_extension where extname = 'pg_cron') then
+    perform cron.schedule('purge-deleted-chat-sessions', '* * * * *',
+                          'select * from public.purge_deleted_sessions()');
+  end if;
+end
+$schedule$;
+
+insert into public.schema_migrations (version) values ('006') on conflict do nothing;
+
+commit;
@@ -0,0 +1,100 @@
+-- EXPLAIN check for the indexes of migrations 001 and 006. Run from the repository root
+-- against a throwaway local Postgres:
+--   psql "postgresql://postgres@localhost:5432/postgres" -f migrations/checks/001_explain.sql
+-- Applies the schema and migrations, seeds data in a transaction, asserts that the hot
+-- queries use index scans under RLS, and rolls the seed data back.
+
+\set ON_ERROR_STOP on
+
+-- Minimal stand-ins for what Supabase provides (skipped when an auth schema already exists)
+do $stubs$
+begin
+  if not exists (select 1 from pg_namespace where nspname = 'auth') then
+    create schema auth;
+    create table auth.users (id uuid primary key, raw_user_meta_data jsonb);
+    create function auth.uid() returns uuid language sql stable as
+      $uid$ select nullif(current_setting('request.jwt.claim.sub', true), '')::uuid $uid$;
+  end if;
+  if not exists (select 1 from pg_roles where rolname = 'authenticated') then
+    create role authenticated nologin;
+  end if;
+end
+$stubs$;
+
+\i supabase_schema.sql
+\i supabase_schema_advanced.sql
+\i supabase_schema_update.sql
+\i migrations/001_chat_indexes_and_rls.sql
+\i migrations/002_append_exchange.sql
+\i migrations/003_message_search.sql
+\i migrations/004_append_messages.sql
+\i migrations/005_realtime.sql
+\i migrations/006_soft_delete_sessions.sql
+
+grant usage on schema auth to authenticated;
+grant select, insert, update, delete on chat_sessions, chat_messages to authenticated;
+
+begin;
+
+-- 500 users x 20 sessions x 20 messages = 200k messages
+insert into auth.users (id)
+select gen_random_uuid() from generate_series(1, 500);
+
+insert into chat_sessions (user_id, title, created_at)
+select users.id, 'Chat ' || n, now() - (n || ' hours')::interval
+from auth.users users, generate_series(1, 20) n;
+
+insert into chat_messages (session_id, role, content, created_at)
+select sessions.id, case when n % 2 = 0 then 'assistant' else 'user' end,
+       repeat('lorem ipsum ', 20), sessions.created_at + (n || ' seconds')::interval
+from chat_sessions sessions, generate_series(1, 20) n;
+
+-- Some deleted sessions for the partial sidebar index to skip (after their messages:
+-- nothing can be added to a deleted session)
+update chat_sessions set deleted_at = now()
+where id in (select id from chat_sessions order by random() limit 1000);
+
+analyze auth.users;
+analyze chat_sessions;
+analyze chat_messages;
+
+select id as check_user_id from auth.users limit 1 \gset
+select id as check_session_id, created_at as check_created_at from chat_sessions
+where user_id = :'check_user_id' and deleted_at is null order by created_at desc limit 1 \gset
+
+create function pg_temp.assert_index_scan(label text, query text) returns void as $$
+declare
+  plan text;
+  line text;
+begin
+  for line in execute 'explain (costs off) ' || query loop
+    raise notice '% | %', label, line;
+  end loop;
+  execute 'explain (format json) ' || query into plan;
+  if plan not like '%Index Scan%' and plan not like '%Index Only Scan%' then
+    raise exception '% does not use an index scan', label;
+  end if;
+  if plan like '%"Node Type": "Seq Scan"%' then
+    raise exception '% still sequentially scans a table', label;
+  end if;
+end;
+$$ language plpgsql;
+
+grant execute on function pg_temp.assert_index_scan(text, text) to authenticated;
+
+set local role authenticated;
+select set_config('request.jwt.claim.sub', :'check_user_id', true);
+
+select pg_temp.assert_index_scan('sidebar page', format(
+  'select id, title, created_at from chat_sessions where user_id = %L and deleted_at is null order by created_at desc, id desc limit 31',
+  :'check_user_id'));
+
+select pg_temp.assert_index_scan('latest messages page', format(
+  'select id, role, content, created_at from chat_messages where session_id = %L order by created_at desc, id desc limit 51',
+  :'check_session_id'));
+
+select pg_temp.assert_index_scan('messages after cursor', format(
+  'select id, role, content, created_at from chat_messages where session_id = %L and (created_at > %L or (created_at = %L and id > %L)) order by created_at, id',
+  :'check_session_id', :'check_created_at', :'check_created_at', '00000000-0000-0000-0000-000000000000'));
+
+rollback;
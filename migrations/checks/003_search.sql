@@ -0,0 +1,110 @@
+-- Check for migration 003. Run from the repository root against a throwaway local Postgres:
+--   psql "postgresql://postgres@localhost:5432/postgres" -f migrations/checks/003_search.sql
+-- Applies the schema and migrations, seeds data in a transaction, asserts that message
+-- search uses the GIN index and returns exactly the caller's matching messages, and
+-- rolls the seed data back.
+
+\set ON_ERROR_STOP on
+
+-- Minimal stand-ins for what Supabase provides (skipped when an auth schema already exists)
+do $stubs$
+begin
+  if not exists (select 1 from pg_namespace where nspname = 'auth') then
+    create schema auth;
+    create table auth.users (id uuid primary key, raw_user_meta_data jsonb);
+    create function auth.uid() returns uuid language sql stable as
+      $uid$ select nullif(current_setting('request.jwt.claim.sub', true), '')::uuid $uid$;
+  end if;
+  if not exists (select 1 from pg_roles where rolname = 'authenticated') then
+    create role authenticated nologin;
+  end if;
+end
+$stubs$;
+
+\i supabase_schema.sql
+\i supabase_schema_advanced.sql
+\i supabase_schema_update.sql
+\i migrations/001_chat_indexes_and_rls.sql
+\i migrations/002_append_exchange.sql
+\i migrations/003_message_search.sql
+
+grant usage on schema auth to authenticated;
+grant select, insert, update, delete on chat_sessions, chat_messages to authenticated;
+
+begin;
+
+-- 500 users x 20 sessions x 20 messages = 200k messages; one in 1000 mentions kubernetes
+insert into auth.users (id)
+select gen_random_uuid() from generate_series(1, 500);
+
+insert into chat_sessions (user_id, title, created_at)
+select users.id, 'Chat ' || n, now() - (n || ' hours')::interval
+from auth.users users, generate_series(1, 20) n;
+
+insert into chat_messages (session_id, role, content, created_at)
+select sessions.id, case when n % 2 = 0 then 'assistant' else 'user' end,
+       case when random() < 0.001 then 'Senior engineers at Acme run Kubernetes clusters; salary $150k.'
+            else 'Interview tips and salary ranges for product roles. ' || md5(random()::text) end,
+       sessions.created_at + (n || ' seconds')::interval
+from chat_sessions sessions, generate_series(1, 20) n;
+
+-- Make sure the checked user has a match
+select id as check_user_id from auth.users limit 1 \gset
+select id as check_session_id from chat_sessions where user_id = :'check_user_id' limit 1 \gset
+
+insert into chat_messages (session_id, role, content)
+values (:'check_session_id', 'assistant', 'Acme interviews cover Kubernetes operators and cluster upgrades.');
+
+-- A heavy user (20k messages), where scanning all of their messages is what the index must avoid
+insert into chat_messages (session_id, role, content, created_at)
+select :'check_session_id', 'user', 'Salary ranges for product roles. ' || md5(random()::text), now() - (n || ' seconds')::interval
+from generate_series(1, 20000) n;
+
+-- What the checked user should find, counted as superuser (bypassing RLS)
+select set_config('check.expected_hits', count(*)::text, true)
+from chat_messages where user_id = :'check_user_id' and content ilike '%kubernetes%';
+
+analyze auth.users;
+analyze chat_sessions;
+analyze chat_messages;
+
+select set_config('request.jwt.claim.sub', :'check_user_id', true);
+
+-- The function runs as its owner, so check its search query's plan as the owner
+do $check$
+declare
+  plan text;
+  line text;
+  query text := 'select id from chat_messages where user_id = (select auth.uid()) '
+                'and content_tsv @@ websearch_to_tsquery(''english'', ''kubernetes'')';
+begin
+  for line in execute 'explain (costs off) ' || query loop
+    raise notice 'search | %', line;
+  end loop;
+  execute 'explain (format json) ' || query into plan;
+  if plan not like '%chat_messages_content_tsv_idx%' then
+    raise exception 'search does not use the GIN index';
+  end if;
+  if plan like '%"Node Type": "Seq Scan"%' then
+    raise exception 'search still sequentially scans chat_messages';
+  end if;
+end
+$check$;
+
+set local role authenticated;
+
+select session_title, role, snippet, rank from search_messages('kubernetes cluster');
+
+do $check$
+declare
+  hits integer;
+begin
+  select count(*) into hits from search_messages('kubernetes', 50, 0);
+  if hits <> current_setting('check.expected_hits')::integer then
+    raise exception 'search found % messages, expected exactly the caller''s %',
+      hits, current_setting('check.expected_hits');
+  end if;
+end
+$check$;
+
+rollback;
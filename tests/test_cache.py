@@ -0,0 +1,72 @@
+"""
+app/cache.py: the agent reply cache's near-duplicate matching.
+
+Usage (from the repository root):
+  python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.cache import PromptCache, key_terms, normalize_prompt, same_terms
+
+# Pairs whose trigram similarity is high but whose answers differ
+DIFFERENT = [
+    ("What is the salary of SDE 1 at Google?", "What is the salary of SDE 2 at Google?"),
+    ("Average salary for SDE at Microsoft in Seattle", "Average salary for SDE at Microsoft in Redmond"),
+    ("Is it worth joining Amazon?", "Is it not worth joining Amazon?"),
+    ("Average salary for SDE at Google", "Average salary for SDE at Amazon"),
+]
+
+# Rephrasings of the same question
+SAME = [
+    ("average salary for SDE at Google", "What is the average salary for SDE at Google?"),
+    ("How do I prepare for a Google interview?", "how do i prepare for a googel interview"),
+    ("interview tips for Amazon SDE", "Amazon SDE interview tips"),
+]
+
+def cache_with(prompt, similarity=0.8):
+    cache = PromptCache(similarity=similarity)
+    cache.store(prompt, "cached reply")
+    return cache
+
+@pytest.mark.parametrize("cached, asked", DIFFERENT)
+def test_different_question_is_not_served(cached, asked):
+    cache = cache_with(cached)
+    assert cache.lookup(asked) is None
+    assert cache.stats()["similar_hits"] == 0
+
+@pytest.mark.parametrize("cached, asked", SAME)
+def test_rephrased_question_is_served(cached, asked):
+    cache = cache_with(cached)
+    assert cache.lookup(asked) == "cached reply"
+    assert cache.stats()["similar_hits"] == 1
+
+def test_threshold_still_applies():
+    cached, asked = SAME[0]
+    assert cache_with(cached, similarity=0.95).lookup(asked) is None
+
+def test_exact_match_without_similarity():
+    cache = PromptCache()
+    cache.store("What is the salary of SDE 1 at Google?", "cached reply")
+    assert cache.lookup("what is the salary of sde 1 at google") == "cached reply"
+    assert cache.lookup("What is the salary of SDE 2 at Google?") is None
+
+def test_key_terms_keep_numbers_and_negations():
+    assert key_terms(normalize_prompt("Is it not worth joining Amazon?")) == ("amazon", "joining", "not", "worth")
+    assert key_terms(normalize_prompt("SDE 2 at Google")) == ("2", "google", "sde")
+
+@pytest.mark.parametrize("a, b, expected", [
+    ("google", "googel", True),
+    ("salary", "salry", True),
+    ("seattle", "seattles", True),
+    ("sde", "sdf", False),
+    ("2023", "2024", False),
+    ("seattle", "redmond", False),
+])
+def test_same_terms_allows_a_typo_in_longer_words(a, b, expected):
+    assert same_terms((a,), (b,)) is expected
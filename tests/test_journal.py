@@ -0,0 +1,137 @@
+"""
+app/journal.py: how the write-behind journal handles failed sends. The `send`
+function is a stand-in that records each batch; nothing leaves the process.
+
+Usage (from the repository root):
+  python -m pytest tests
+"""
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.journal import EntriesRejected, MessageJournal, SessionDeleted, TokenRejected
+
+USER_ID = "user-1"
+
+def wait_until(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return
+        time.sleep(0.01)
+    raise TimeoutError("condition not met")
+
+class Backend:
+    """Stores what `send` delivers; `refuse(token, messages)` decides what to raise."""
+
+    def __init__(self, refuse=lambda token, messages: None):
+        self.refuse = refuse
+        self.batches = []
+        self.stored = []
+        self._lock = threading.Lock()
+
+    def send(self, token, messages):
+        with self._lock:
+            self.batches.append((token, [message["content"] for message in messages]))
+        error = self.refuse(token, messages)
+        if error is not None:
+            raise error
+        with self._lock:
+            self.stored.extend(message["content"] for message in messages)
+
+@pytest.fixture
+def journal_for(tmp_path):
+    def journal_for(backend, **kwargs):
+        return MessageJournal(str(tmp_path / "journal.db"), backend.send, retry_base=0.01, **kwargs)
+    return journal_for
+
+def append_all(journal, backend, contents, session_id="session-1"):
+    """Appends one entry per content, all sent in a single batch once a token arrives."""
+    for content in contents:
+        journal.append(USER_ID, "held", session_id, [("user", content)])
+    # Whether or not the journal got to try the refused token, it now waits
+    wait_until(lambda: not backend.batches or backend.batches[-1][0] == "held")
+    journal.remember_token(USER_ID, "token")
+
+def refuse_held_token(token, messages):
+    return TokenRejected("held") if token == "held" else None
+
+def test_bad_entry_is_isolated_by_halving(journal_for):
+    def refuse(token, messages):
+        if token == "held":
+            return TokenRejected("held")
+        if any(message["content"] == "bad" for message in messages):
+            return EntriesRejected("invalid input syntax")
+        return None
+
+    backend = Backend(refuse)
+    journal = journal_for(backend)
+    append_all(journal, backend, ["one", "two", "bad", "four"])
+
+    wait_until(lambda: len(backend.stored) == 3)
+    assert backend.stored == ["one", "two", "four"]
+    sent = [contents for token, contents in backend.batches if token == "token"]
+    assert sent == [["one", "two", "bad", "four"], ["one", "two"], ["bad", "four"], ["bad"], ["four"]]
+
+    set_aside = journal.set_aside(USER_ID)
+    assert [entry["messages"][0]["content"] for entry in set_aside] == ["bad"]
+    assert set_aside[0]["error"] == "invalid input syntax"
+    assert journal.pending(USER_ID, "session-1") == []
+
+def test_refused_token_pauses_until_a_new_one(journal_for):
+    backend = Backend(lambda token, messages: TokenRejected("JWT expired") if token == "expired" else None)
+    journal = journal_for(backend)
+
+    journal.append(USER_ID, "expired", "session-1", [("user", "hello")])
+    wait_until(lambda: backend.batches)
+    # Neither time nor the same token again starts another attempt
+    journal.remember_token(USER_ID, "expired")
+    time.sleep(0.2)
+    assert backend.batches == [("expired", ["hello"])]
+    assert [message["content"] for message in journal.pending(USER_ID, "session-1")] == ["hello"]
+
+    journal.remember_token(USER_ID, "fresh")
+    wait_until(lambda: backend.stored)
+    assert backend.batches[-1] == ("fresh", ["hello"])
+    assert journal.pending(USER_ID, "session-1") == []
+    assert journal.set_aside(USER_ID) == []
+
+def test_deleted_session_entries_are_dropped(journal_for):
+    def refuse(token, messages):
+        if token == "held":
+            return TokenRejected("held")
+        if any(message["session_id"] == "gone" for message in messages):
+            return SessionDeleted("gone")
+        return None
+
+    deleted = []
+    backend = Backend(refuse)
+    journal = journal_for(backend, on_session_deleted=lambda user_id, session_id: deleted.append((user_id, session_id)))
+    journal.append(USER_ID, "held", "gone", [("user", "lost")])
+    append_all(journal, backend, ["kept"], session_id="kept")
+
+    wait_until(lambda: backend.stored)
+    assert backend.stored == ["kept"]
+    assert deleted == [(USER_ID, "gone")]
+    assert journal.pending(USER_ID, "gone") == []
+    assert journal.set_aside(USER_ID) == []
+
+def test_entries_survive_a_restart(tmp_path):
+    path = str(tmp_path / "journal.db")
+    first = Backend(refuse_held_token)
+    journal = MessageJournal(path, first.send, retry_base=0.01)
+    journal.append(USER_ID, "held", "session-1", [("user", "question"), ("assistant", "answer")])
+
+    # Tokens are kept in memory only: after a restart the entries wait for their user
+    second = Backend()
+    restarted = MessageJournal(path, second.send, retry_base=0.01)
+    assert [message["content"] for message in restarted.pending(USER_ID, "session-1")] == ["question", "answer"]
+    restarted.remember_token(USER_ID, "token")
+    wait_until(lambda: second.stored)
+    assert second.stored == ["question", "answer"]
@@ -0,0 +1,107 @@
+"""
+app/limits.py: AgentTurn's per-user queueing and duplicate detection.
+
+Usage (from the repository root):
+  python -m pytest tests
+"""
+import os
+import sys
+import time
+import threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.limits import AgentTurn
+
+def wait_until(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return
+        time.sleep(0.01)
+    raise TimeoutError("condition not met")
+
+def start_turn(user_id, prompt, log, release=None, complete=True):
+    """Runs a turn on its own thread; a "run" turn holds its slot until `release` is set."""
+    entered = threading.Event()
+
+    def run():
+        with AgentTurn(user_id, "session-1", prompt) as turn:
+            entered.set()
+            status = turn.wait()
+            log.append((prompt, status))
+            if status == "run":
+                if release is not None:
+                    release.wait(10)
+                if complete:
+                    turn.complete()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    entered.wait(10)
+    return thread
+
+def test_turns_run_one_at_a_time_in_order(monkeypatch):
+    monkeypatch.setenv("AGENT_MAX_INFLIGHT_PER_USER", "1")
+    monkeypatch.setenv("AGENT_MAX_QUEUED_PER_USER", "5")
+    log, release = [], threading.Event()
+
+    threads = [start_turn("fifo-user", "first", log, release)]
+    wait_until(lambda: log)
+    threads += [start_turn("fifo-user", prompt, log) for prompt in ("second", "third", "fourth")]
+    time.sleep(0.1)
+    assert log == [("first", "run")]
+
+    release.set()
+    for thread in threads:
+        thread.join(10)
+    assert log == [("first", "run"), ("second", "run"), ("third", "run"), ("fourth", "run")]
+
+def test_turns_beyond_the_queue_are_busy(monkeypatch):
+    monkeypatch.setenv("AGENT_MAX_INFLIGHT_PER_USER", "1")
+    monkeypatch.setenv("AGENT_MAX_QUEUED_PER_USER", "1")
+    log, release = [], threading.Event()
+
+    threads = [start_turn("busy-user", "first", log, release)]
+    wait_until(lambda: log)
+    threads.append(start_turn("busy-user", "second", log))
+    with AgentTurn("busy-user", "session-1", "third") as turn:
+        assert turn.wait() == "busy"
+
+    release.set()
+    for thread in threads:
+        thread.join(10)
+    assert log == [("first", "run"), ("second", "run")]
+
+def test_repeat_of_a_running_prompt_is_a_duplicate(monkeypatch):
+    monkeypatch.setenv("AGENT_DEDUP_WINDOW", "10")
+    log, release = [], threading.Event()
+
+    original = start_turn("dedup-user", "What is SDE 2 pay?", log, release)
+    wait_until(lambda: log)
+    # Normalized like cache keys: case and trailing punctuation do not matter
+    repeat = start_turn("dedup-user", "what is sde 2 pay", log)
+    time.sleep(0.1)
+    assert len(log) == 1
+
+    release.set()
+    original.join(10)
+    repeat.join(10)
+    assert log == [("What is SDE 2 pay?", "run"), ("what is sde 2 pay", "duplicate")]
+
+    # Still a duplicate within the window after it was stored
+    with AgentTurn("dedup-user", "session-1", "What is SDE 2 pay?") as turn:
+        assert turn.wait() == "duplicate"
+
+def test_repeat_runs_when_the_original_stored_nothing():
+    log, release = [], threading.Event()
+
+    original = start_turn("retry-user", "hello", log, release, complete=False)
+    wait_until(lambda: log)
+    repeat = start_turn("retry-user", "hello", log)
+
+    release.set()
+    original.join(10)
+    repeat.join(10)
+    assert log == [("hello", "run"), ("hello", "run")]
@@ -0,0 +1,167 @@
+"""
+app/realtime.py against the Realtime stand-in in benchmarks/fake_backend.py:
+subscription, cache updates and fragment reruns. No network access is needed.
+
+Usage (from the repository root):
+  python -m pytest tests
+"""
+import os
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from fake_backend import FakeBackend, USER_ID, session_payload
+
+def wait_until(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return
+        time.sleep(0.01)
+    raise TimeoutError("condition not met")
+
+@pytest.fixture(scope="module")
+def backend():
+    backend = FakeBackend().start()
+    # Must be set before any app module is imported
+    os.environ.update(backend.env())
+    os.environ["REALTIME_ENABLED"] = "true"
+    yield backend
+    backend.stop()
+
+@pytest.fixture
+def reruns(monkeypatch):
+    """The listeners asked to rerun, instead of rerunning their fragments."""
+    import app.realtime
+    requested = []
+    monkeypatch.setattr(app.realtime, "_request_fragment_rerun", lambda listener: requested.append(listener) or True)
+    return requested
+
+@pytest.fixture
+def session_id(backend):
+    import app.auth
+    backend.seed(sessions=1, messages_per_session=2)
+    app.auth._session_list_cache.clear()
+    app.auth._message_cache.clear()
+    return backend.sessions()[0]["id"]
+
+def chat_script():
+    import streamlit as st
+    from app.auth import sync_session_messages
+    from app.realtime import watch_changes
+
+    @st.fragment
+    def render_chat():
+        session_id = st.session_state.current_session_id
+        watch_changes(("messages", session_id))
+        messages, _ = sync_session_messages(session_id, 50)
+        for message in messages:
+            st.markdown(message["content"])
+
+    render_chat()
+
+def run_chat(session_id):
+    from streamlit.testing.v1 import AppTest
+    from supabase_auth.types import Session
+
+    session = Session.model_validate(session_payload())
+    at = AppTest.from_function(chat_script, default_timeout=30)
+    at.session_state["user"] = session.user
+    at.session_state["access_token"] = session.access_token
+    at.session_state["current_session_id"] = session_id
+    at.run()
+    assert not at.exception
+    return at
+
+def hub():
+    from app.realtime import _get_hub
+    return _get_hub()
+
+def test_watch_in_fragment_registers_listener(backend, session_id, reruns):
+    at = run_chat(session_id)
+    assert len(at.markdown) == 2
+
+    listeners = [listener for listener in hub()._listeners.values() if listener.topic == ("messages", session_id)]
+    assert len(listeners) == 1
+    assert listeners[0].user_id == USER_ID
+    assert listeners[0].fragment_id
+
+def test_live_only_once_subscribed(backend, session_id, reruns):
+    import app.auth
+    from app.realtime import RealtimeSubscription
+
+    joins = []
+    subscription = RealtimeSubscription(
+        hub()._url, "someone-else", "token",
+        on_change=lambda *change: None,
+        on_join=joins.append,
+        on_leave=lambda: None,
+    )
+    try:
+        wait_until(lambda: joins)
+        assert joins == [False]
+    finally:
+        subscription.close()
+
+    # The hub's own subscription for the user went live the same way
+    run_chat(session_id)
+    wait_until(lambda: USER_ID in app.auth._live_since)
+
+def test_inserted_message_updates_cache_and_reruns_fragment(backend, session_id, reruns):
+    import app.auth
+
+    run_chat(session_id)
+    wait_until(lambda: USER_ID in app.auth._live_since)
+
+    row = backend.insert("chat_messages", {"session_id": session_id, "role": "user", "content": "From another tab"})
+    wait_until(lambda: reruns)
+
+    assert [listener.topic for listener in reruns] == [("messages", session_id)]
+    cached = app.auth._message_cache.get((USER_ID, session_id))
+    assert cached["messages"][-1]["id"] == row["id"]
+
+def test_change_for_uncached_session_reruns_nothing(backend, session_id, reruns):
+    import app.auth
+
+    run_chat(session_id)
+    wait_until(lambda: USER_ID in app.auth._live_since)
+
+    other = backend.insert("chat_sessions", {"user_id": USER_ID, "title": "Elsewhere"})
+    backend.insert("chat_messages", {"session_id": other["id"], "role": "user", "content": "Not shown here"})
+    # Let both changes arrive; the session list is not cached and the chat not watched
+    time.sleep(0.3)
+    assert reruns == []
+
+def test_join_reply_alone_is_not_live():
+    from app.realtime import RealtimeSubscription
+
+    joins = []
+    # Without starting its connection thread
+    subscription = RealtimeSubscription.__new__(RealtimeSubscription)
+    subscription.user_id, subscription.topic, subscription._join_ref = USER_ID, "realtime:chat", "1"
+    subscription._on_join = joins.append
+
+    assert not subscription._handle({"topic": "realtime:chat", "event": "phx_reply", "ref": "1", "payload": {"status": "ok"}}, False)
+    assert joins == []
+    assert subscription._handle({"topic": "realtime:chat", "event": "system", "ref": None, "payload": {
+        "extension": "postgres_changes", "message": "Subscribed to PostgreSQL", "status": "ok",
+    }}, True)
+    assert joins == [True]
+
+def test_soft_delete_elsewhere_marks_session_gone(backend, session_id, reruns):
+    import app.auth
+
+    run_chat(session_id)
+    wait_until(lambda: USER_ID in app.auth._live_since)
+
+    backend.update("chat_sessions", session_id, {"deleted_at": "2026-01-02T00:00:00.000000+00:00"})
+    wait_until(lambda: reruns)
+
+    assert ("messages", session_id) in [listener.topic for listener in reruns]
+    assert app.auth.is_session_deleted(session_id)
+    assert app.auth._message_cache.get((USER_ID, session_id)) is None
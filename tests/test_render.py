@@ -0,0 +1,34 @@
+"""
+app/render.py: preparing agent output for st.markdown.
+
+Usage (from the repository root):
+  python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.render import message_markdown, prepare_markdown
+
+@pytest.mark.parametrize("content, expected", [
+    ("no dollars", "no dollars"),
+    ("Range: $120k - $150k", "Range: \\$120k - \\$150k"),
+    ("Energy $E=mc^2$ here", "Energy $E=mc^2$ here"),
+    ("$$\\sum x$$ costs $3", "$$\\sum x$$ costs \\$3"),
+    ("use `$HOME` or $PATH", "use `$HOME` or \\$PATH"),
+    ("```\ncost = $5\n```\nand $5", "```\ncost = $5\n```\nand \\$5"),
+    ("already \\$5", "already \\$5"),
+])
+def test_prepare_markdown_escapes_bare_dollars_only(content, expected):
+    assert prepare_markdown(content) == expected
+
+def test_message_markdown_is_cached_by_id():
+    message = {"id": "render-test-1", "role": "assistant", "content": "Pays $100k"}
+    assert message_markdown(message) == "Pays \\$100k"
+    # Stored messages never change, so the ID alone decides
+    assert message_markdown(dict(message, content="changed")) == "Pays \\$100k"
+    assert message_markdown({"role": "assistant", "content": "Pays $1"}) == "Pays \\$1"
@@ -0,0 +1,161 @@
+"""
+app/transport.py and app/resilience.py: retries, the circuit breaker and hedged
+webhook calls, against local HTTP servers standing in for n8n.
+
+Usage (from the repository root):
+  python -m pytest tests
+"""
+import os
+import sys
+import time
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.resilience import CircuitBreaker, CircuitOpenError, post_webhook
+from app.transport import post_json
+
+class Webhook:
+    """
+    A local stand-in for an n8n webhook. `respond(call)` gets the 1-based call number
+    and returns (status, headers, delay in seconds) for it.
+    """
+
+    def __init__(self, respond):
+        self.calls = 0
+        webhook = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                webhook.calls += 1
+                status, headers, delay = respond(webhook.calls)
+                time.sleep(delay)
+                body = json.dumps({"output": f"reply from {webhook.port}"}).encode()
+                try:
+                    self.send_response(status)
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    # The client gave up waiting
+                    pass
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_port
+        self.url = f"http://127.0.0.1:{self.port}/webhook"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+@pytest.fixture
+def webhook():
+    servers = []
+
+    def webhook(respond):
+        servers.append(Webhook(respond))
+        return servers[-1]
+
+    yield webhook
+    for server in servers:
+        server.close()
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setenv("N8N_RETRY_BACKOFF", "0.01")
+    monkeypatch.setenv("N8N_MAX_RETRIES", "2")
+
+def test_read_timeout_is_not_retried(webhook, monkeypatch):
+    monkeypatch.setenv("N8N_READ_TIMEOUT", "0.2")
+    slow = webhook(lambda call: (200, {}, 1.0))
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        post_json(slow.url, {"chatInput": "hi"})
+    time.sleep(0.1)
+    # The workflow may already be running; a second call would run it twice
+    assert slow.calls == 1
+
+def test_server_error_is_not_retried(webhook):
+    failing = webhook(lambda call: (502, {}, 0))
+    with pytest.raises(requests.exceptions.HTTPError):
+        post_json(failing.url, {"chatInput": "hi"})
+    assert failing.calls == 1
+
+def test_turned_away_with_retry_after_is_retried(webhook):
+    busy_once = webhook(lambda call: (503, {"Retry-After": "0"}, 0) if call == 1 else (200, {}, 0))
+    response = post_json(busy_once.url, {"chatInput": "hi"})
+    assert response.status_code == 200
+    assert busy_once.calls == 2
+
+def test_breaker_opens_probes_and_closes():
+    breaker = CircuitBreaker(error_rate=0.5, min_calls=4, window=60, cooldown=0.1)
+    for ok in (True, False, True):
+        breaker.record(breaker.allow(), ok)
+    assert breaker.state == "closed"
+    breaker.record(breaker.allow(), False)
+    assert breaker.state == "open"
+    assert breaker.allow() is None
+
+    time.sleep(0.12)
+    assert breaker.state == "half-open"
+    assert breaker.allow() == "probe"
+    # One probe at a time
+    assert breaker.allow() is None
+    breaker.record("probe", False)
+    assert breaker.state == "open"
+
+    time.sleep(0.12)
+    breaker.record(breaker.allow(), True)
+    assert breaker.state == "closed"
+    assert breaker.allow() == "call"
+
+def test_open_breaker_fails_fast(webhook, monkeypatch):
+    monkeypatch.setenv("N8N_BREAKER_MIN_CALLS", "1")
+    failing = webhook(lambda call: (500, {}, 0))
+    monkeypatch.setenv("N8N_WEBHOOK_URL", failing.url)
+    monkeypatch.delenv("N8N_HEDGE_WEBHOOK_URL", raising=False)
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        post_webhook({"chatInput": "hi"}, "key-1", deadline=time.monotonic() + 5)
+    with pytest.raises(CircuitOpenError):
+        post_webhook({"chatInput": "hi"}, "key-2", deadline=time.monotonic() + 5)
+    assert failing.calls == 1
+
+def test_hedge_answers_for_a_slow_primary(webhook, monkeypatch):
+    slow = webhook(lambda call: (200, {}, 1.0))
+    fast = webhook(lambda call: (200, {}, 0))
+    monkeypatch.setenv("N8N_WEBHOOK_URL", slow.url)
+    monkeypatch.setenv("N8N_HEDGE_WEBHOOK_URL", fast.url)
+    monkeypatch.setenv("N8N_HEDGE_DEFAULT_DELAY", "0.1")
+    monkeypatch.setenv("N8N_HEDGE_MIN_DELAY", "0.1")
+
+    started = time.monotonic()
+    response = post_webhook({"chatInput": "hi"}, "key-3", deadline=time.monotonic() + 5)
+    assert response.json()["output"] == f"reply from {fast.port}"
+    assert time.monotonic() - started < 0.9
+    assert (slow.calls, fast.calls) == (1, 1)
+
+def test_hedge_answers_when_primary_fails(webhook, monkeypatch):
+    failing = webhook(lambda call: (500, {}, 0))
+    fast = webhook(lambda call: (200, {}, 0))
+    monkeypatch.setenv("N8N_WEBHOOK_URL", failing.url)
+    monkeypatch.setenv("N8N_HEDGE_WEBHOOK_URL", fast.url)
+    monkeypatch.setenv("N8N_HEDGE_DEFAULT_DELAY", "5")
+
+    response = post_webhook({"chatInput": "hi"}, "key-4", deadline=time.monotonic() + 5)
+    assert response.status_code == 200
+    assert (failing.calls, fast.calls) == (1, 1)